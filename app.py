@@ -1,26 +1,36 @@
+import atexit
+import base64
+import bisect
+import gzip
 import hashlib
+import hmac
 import json
 import logging
+import math
 import os
+import pickle
+import queue
 import re
+import sqlite3
+import threading
+import time
+import unicodedata
 import uuid
-from datetime import datetime, timezone
+from collections import OrderedDict, deque
+from functools import lru_cache, wraps
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows development machines run a single process.
+    fcntl = None
 
 from dotenv import load_dotenv
 from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_cors import CORS
-from openai import OpenAI
-
-try:
-    import firebase_admin
-    from firebase_admin import auth, credentials, firestore as firebase_firestore
-except Exception:  # pragma: no cover - firebase-admin is optional until admin logs are enabled.
-    firebase_admin = None
-    auth = None
-    credentials = None
-    firebase_firestore = None
+from openai import OpenAI, Timeout
 
 load_dotenv()
 
@@ -31,12 +41,81 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 CLARUS_MODEL = os.getenv("CLARUS_MODEL", "gpt-5.4-nano")
 CLARUS_FALLBACK_MODEL = os.getenv("CLARUS_FALLBACK_MODEL", "gpt-5.4-mini")
 CLARUS_MAX_OUTPUT_TOKENS = min(int(os.getenv("CLARUS_MAX_OUTPUT_TOKENS", "360")), 500)
-CLARUS_CORPUS_ITEM_LIMIT = min(int(os.getenv("CLARUS_CORPUS_ITEM_LIMIT", "24")), 40)
+CLARUS_ROUTES: Dict[str, Dict[str, Any]] = json.loads(os.getenv("CLARUS_ROUTES", "{}") or "{}")
+CLARUS_CONNECT_MS = max(int(os.getenv("CLARUS_CONNECT_MS", "5000")), 100)
+CLARUS_FIRST_TOKEN_MS = max(int(os.getenv("CLARUS_FIRST_TOKEN_MS", "15000")), 100)
+CLARUS_TOTAL_MS = max(int(os.getenv("CLARUS_TOTAL_MS", "90000")), 1000)
+CLARUS_MODEL_DEADLINES: Dict[str, Dict[str, int]] = json.loads(os.getenv("CLARUS_MODEL_DEADLINES", "{}") or "{}")
+CLARUS_HEDGE_MS = max(int(os.getenv("CLARUS_HEDGE_MS", "0")), 0)
+CLARUS_BREAKER = os.getenv("CLARUS_BREAKER", "1").strip().lower() not in {"0", "false", "off"}
+CLARUS_BREAKER_WINDOW_SECONDS = max(int(os.getenv("CLARUS_BREAKER_WINDOW_SECONDS", "120")), 10)
+CLARUS_BREAKER_MIN_CALLS = max(int(os.getenv("CLARUS_BREAKER_MIN_CALLS", "5")), 1)
+CLARUS_BREAKER_ERROR_RATE = min(max(float(os.getenv("CLARUS_BREAKER_ERROR_RATE", "0.5")), 0.05), 1.0)
+CLARUS_BREAKER_COOLDOWN_SECONDS = max(int(os.getenv("CLARUS_BREAKER_COOLDOWN_SECONDS", "30")), 1)
+CLARUS_CORPUS_ITEM_LIMIT = min(int(os.getenv("CLARUS_CORPUS_ITEM_LIMIT", "2000")), 5000)
 CLARUS_CORPUS_BODY_CHARS = min(int(os.getenv("CLARUS_CORPUS_BODY_CHARS", "1600")), 2600)
+CLARUS_CORPUS_INDEX_CHARS = min(int(os.getenv("CLARUS_CORPUS_INDEX_CHARS", "20000")), 60000)
+CLARUS_CORPUS_TOP_K = min(max(int(os.getenv("CLARUS_CORPUS_TOP_K", "6")), 1), 24)
+CLARUS_PASSAGE_CHARS = min(max(int(os.getenv("CLARUS_PASSAGE_CHARS", "500")), 200), 2000)
 CLARUS_LOG_PATH = Path(os.getenv("CLARUS_LOG_PATH", "logs/clarus_interactions.jsonl"))
 CLARUS_LOG_COLLECTION = os.getenv("CLARUS_LOG_COLLECTION", "clarusLogs")
+CLARUS_LOG_ROTATE = os.getenv("CLARUS_LOG_ROTATE", "size").strip().lower()
+CLARUS_LOG_ROTATE_BYTES = max(int(os.getenv("CLARUS_LOG_ROTATE_BYTES", str(16 * 1024 * 1024))), 64 * 1024)
+CLARUS_LOG_ORDER_SLACK_SECONDS = 60
+CLARUS_LOG_INDEX_LINES = max(int(os.getenv("CLARUS_LOG_INDEX_LINES", "500")), 1)
+CLARUS_ROLLUP_COLLECTION = os.getenv("CLARUS_ROLLUP_COLLECTION", "clarusRollups")
+CLARUS_ROLLUP_PATH = Path(os.getenv("CLARUS_ROLLUP_PATH", "logs/clarus_rollups.sqlite3"))
+CLARUS_PRICES: Dict[str, Dict[str, float]] = json.loads(os.getenv("CLARUS_PRICES", "{}") or "{}")
+CLARUS_LOG_ASYNC = os.getenv("CLARUS_LOG_ASYNC", "1").strip().lower() not in {"0", "false", "off"}
+CLARUS_LOG_QUEUE_SIZE = max(int(os.getenv("CLARUS_LOG_QUEUE_SIZE", "5000")), 1)
+CLARUS_LOG_BATCH_SIZE = min(max(int(os.getenv("CLARUS_LOG_BATCH_SIZE", "100")), 1), 500)
+CLARUS_LOG_FLUSH_SECONDS = max(float(os.getenv("CLARUS_LOG_FLUSH_SECONDS", "0.5")), 0.05)
+CLARUS_LOG_FSYNC_SECONDS = max(float(os.getenv("CLARUS_LOG_FSYNC_SECONDS", "5")), 0.0)
+CLARUS_LOG_DROP_POLICY = os.getenv("CLARUS_LOG_DROP_POLICY", "block").strip().lower()
+CLARUS_LOG_BLOCK_MS = max(int(os.getenv("CLARUS_LOG_BLOCK_MS", "50")), 0)
+CLARUS_FIREBASE_RETRY_SECONDS = max(float(os.getenv("CLARUS_FIREBASE_RETRY_SECONDS", "30")), 1.0)
+CLARUS_ADMIN_TOKEN_CACHE = max(int(os.getenv("CLARUS_ADMIN_TOKEN_CACHE", "64")), 0)
 ADMIN_EMAIL = os.getenv("ADMIN_EMAIL", "luks@degrondvraag.com").strip().lower()
 IP_HASH_SALT = os.getenv("CLARUS_IP_HASH_SALT", "")
+CLARUS_TRUSTED_PROXIES = max(int(os.getenv("CLARUS_TRUSTED_PROXIES", "1")), 0)
+CLARUS_ESSAY_OPENING_CHARS = int(os.getenv("CLARUS_ESSAY_OPENING_CHARS", "1500"))
+CLARUS_INPUT_TOKEN_BUDGET = max(int(os.getenv("CLARUS_INPUT_TOKEN_BUDGET", "6000")), 1000)
+CLARUS_MODEL_TOKEN_BUDGETS: Dict[str, int] = json.loads(os.getenv("CLARUS_MODEL_TOKEN_BUDGETS", "{}") or "{}")
+CLARUS_PROMPT_CACHE_KEY = os.getenv("CLARUS_PROMPT_CACHE_KEY", "auto").strip()
+CLARUS_HISTORY_TURNS = min(max(int(os.getenv("CLARUS_HISTORY_TURNS", "16")), 0), 40)
+CLARUS_MAX_BODY_BYTES = max(int(os.getenv("CLARUS_MAX_BODY_BYTES", str(8 * 1024 * 1024))), 64 * 1024)
+CLARUS_REGISTRY_ESSAYS = max(int(os.getenv("CLARUS_REGISTRY_ESSAYS", "500")), 1)
+CLARUS_REGISTRY_CORPORA = max(int(os.getenv("CLARUS_REGISTRY_CORPORA", "8")), 1)
+CLARUS_COALESCE = os.getenv("CLARUS_COALESCE", "1").strip().lower() not in {"0", "false", "off"}
+CLARUS_COALESCE_WAIT = max(int(os.getenv("CLARUS_COALESCE_WAIT", "120")), 1)
+CLARUS_WORKERS = max(int(os.getenv("WEB_CONCURRENCY", "1")), 1)
+CLARUS_MAX_STREAMS = max(int(os.getenv("CLARUS_MAX_STREAMS", "0")), 0)
+CLARUS_MAX_INFLIGHT = max(int(os.getenv("CLARUS_MAX_INFLIGHT", "0")), 0)
+CLARUS_ADMISSION_QUEUE = max(int(os.getenv("CLARUS_ADMISSION_QUEUE", "16")), 0)
+CLARUS_ADMISSION_WAIT_MS = max(int(os.getenv("CLARUS_ADMISSION_WAIT_MS", "2000")), 0)
+CLARUS_RATE_PER_MINUTE = max(float(os.getenv("CLARUS_RATE_PER_MINUTE", "30")), 0.0)
+CLARUS_RATE_BURST = max(int(os.getenv("CLARUS_RATE_BURST", "10")), 1)
+CLARUS_HEARTBEAT_MS = max(int(os.getenv("CLARUS_HEARTBEAT_MS", "1000")), 100)
+CLARUS_SSE_FLUSH_MS = max(int(os.getenv("CLARUS_SSE_FLUSH_MS", "40")), 0)
+CLARUS_SSE_FLUSH_CHARS = max(int(os.getenv("CLARUS_SSE_FLUSH_CHARS", "256")), 1)
+CLARUS_CACHE_BACKEND = os.getenv("CLARUS_CACHE_BACKEND", "memory").strip().lower()
+CLARUS_CACHE_PATH = Path(os.getenv("CLARUS_CACHE_PATH", "cache/clarus_cache.sqlite3"))
+CLARUS_ADMISSION_BACKEND = os.getenv("CLARUS_ADMISSION_BACKEND", CLARUS_CACHE_BACKEND).strip().lower()
+CLARUS_ADMISSION_PATH = Path(os.getenv("CLARUS_ADMISSION_PATH", "cache/clarus_admission.sqlite3"))
+CLARUS_ANSWER_CACHE_SIZE = max(int(os.getenv("CLARUS_ANSWER_CACHE_SIZE", "1000")), 0)
+CLARUS_ANSWER_CACHE_TTL = max(int(os.getenv("CLARUS_ANSWER_CACHE_TTL", "86400")), 0)
+CLARUS_SESSION_LIMIT = max(int(os.getenv("CLARUS_SESSION_LIMIT", "5000")), 0)
+CLARUS_SESSION_TTL = max(int(os.getenv("CLARUS_SESSION_TTL", "3600")), 0)
+CLARUS_SUMMARY_THRESHOLD = max(int(os.getenv("CLARUS_SUMMARY_THRESHOLD", "1500")), 0)
+CLARUS_SUMMARY_KEEP_TURNS = min(max(int(os.getenv("CLARUS_SUMMARY_KEEP_TURNS", "4")), 2), 20)
+CLARUS_SUMMARY_MAX_TOKENS = min(max(int(os.getenv("CLARUS_SUMMARY_MAX_TOKENS", "300")), 64), 800)
+CLARUS_METRICS = os.getenv("CLARUS_METRICS", "1").strip().lower() not in {"0", "false", "off"}
+CLARUS_METRICS_BACKEND = os.getenv("CLARUS_METRICS_BACKEND", "sqlite").strip().lower()
+CLARUS_METRICS_PATH = Path(os.getenv("CLARUS_METRICS_PATH", "logs/clarus_metrics.sqlite3"))
+CLARUS_METRICS_FLUSH_SECONDS = max(float(os.getenv("CLARUS_METRICS_FLUSH_SECONDS", "5")), 0.5)
+CLARUS_METRICS_TOKEN = os.getenv("CLARUS_METRICS_TOKEN", "").strip()
+CLARUS_INTENTS = os.getenv("CLARUS_INTENTS", "1").strip().lower() not in {"0", "false", "off"}
+CLARUS_INTENT_THRESHOLD = min(max(float(os.getenv("CLARUS_INTENT_THRESHOLD", "0.8")), 0.5), 1.0)
 
 DEFAULT_ORIGINS = [
     "https://www.degrondvraag.com",
@@ -56,6 +135,8 @@ CORS_ORIGINS = [
 client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
 
 app = Flask(__name__)
+# Bodies over the cap are refused while reading, before any JSON parsing, hashing or indexing.
+app.config["MAX_CONTENT_LENGTH"] = CLARUS_MAX_BODY_BYTES
 CORS(app, resources={r"/*": {"origins": CORS_ORIGINS}})
 
 
@@ -164,6 +245,15 @@ def strip_html(value: str) -> str:
     return re.sub(r"\s+", " ", text).strip()
 
 
+def strip_html_paragraphs(value: str) -> List[str]:
+    """Like strip_html, but keep block-level boundaries and blank lines as paragraph breaks."""
+    text = re.sub(r"<(script|style).*?</\1>", " ", value or "", flags=re.IGNORECASE | re.DOTALL)
+    text = re.sub(r"<br\s*/?>|</(p|div|h[1-6]|li|blockquote|section|article)>", "\n\n", text, flags=re.IGNORECASE)
+    text = re.sub(r"<[^>]+>", " ", text)
+    paragraphs = (re.sub(r"\s+", " ", block).strip() for block in re.split(r"\n\s*\n", text))
+    return [paragraph for paragraph in paragraphs if paragraph]
+
+
 def trim_text(value: str, limit: int) -> str:
     value = value or ""
     if len(value) <= limit:
@@ -171,17 +261,21 @@ def trim_text(value: str, limit: int) -> str:
     return value[:limit].rsplit(" ", 1)[0] + "..."
 
 
+_ESTIMATE_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(value: str) -> int:
+    """Local token estimate: one token per word or symbol, plus one per further seven characters."""
+    return sum(1 + len(piece) // 7 for piece in _ESTIMATE_PATTERN.findall(value or ""))
+
+
 def normalize_language(value: str, question: str) -> str:
-    if value in {"nl", "en"}:
-        return value
-    dutch_markers = {"wat", "waarom", "hoe", "essay", "vraag", "bedoelt", "kun", "niet", "wel"}
-    words = set(re.findall(r"[a-zA-Z]+", (question or "").lower()))
-    return "nl" if words & dutch_markers else "en"
+    return classify_question(question, value)["language"]
 
 
 def normalize_corpus_item(item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
     title = trim_text(strip_html(str(item.get("title", ""))), 180)
-    body = trim_text(strip_html(str(item.get("body", ""))), CLARUS_CORPUS_BODY_CHARS)
+    body = trim_text(strip_html(str(item.get("body", ""))), CLARUS_CORPUS_INDEX_CHARS)
     excerpt = trim_text(strip_html(str(item.get("excerpt", ""))), 420)
     if not title or not (body or excerpt):
         return None
@@ -201,17 +295,7 @@ def normalize_corpus_item(item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
     }
 
 
-def build_corpus_context(items: Any) -> str:
-    if not isinstance(items, list):
-        return ""
-
-    normalized = []
-    for item in items[:CLARUS_CORPUS_ITEM_LIMIT]:
-        if isinstance(item, dict):
-            normalized_item = normalize_corpus_item(item)
-            if normalized_item:
-                normalized.append(normalized_item)
-
+def render_corpus_context(normalized: List[Dict[str, Any]]) -> str:
     blocks = []
     for index, item in enumerate(normalized, start=1):
         categories = ", ".join(item["categories"]) if item["categories"] else "uncategorized"
@@ -232,336 +316,3378 @@ def build_corpus_context(items: Any) -> str:
     return "\n\n".join(blocks)
 
 
-DEEP_TOPIC_TERMS = {
-    "argument",
-    "archive",
-    "admin",
-    "assumption",
-    "begrijpen",
-    "belief",
-    "beheerder",
-    "conscience",
-    "clarus",
-    "degrondvraag",
-    "ethic",
-    "ethical",
-    "ethics",
-    "essay",
-    "essays",
-    "feedback",
-    "fits",
-    "evil",
-    "existential",
-    "faith",
-    "freedom",
-    "god",
-    "justice",
-    "meaning",
-    "moral",
-    "morality",
-    "philosophy",
-    "recommend",
-    "recommendation",
-    "religion",
-    "religious",
-    "site",
-    "responsibility",
-    "suffering",
-    "truth",
-    "value",
-    "website",
-    "understand",
-    "waarheid",
-    "waarde",
-    "waarden",
-    "verantwoordelijkheid",
-    "vrijheid",
-    "geloof",
-    "religie",
-    "filosofie",
-    "moreel",
-    "moraal",
-    "ethiek",
-    "ethisch",
-    "existentieel",
-    "betekenis",
-    "lijden",
-    "kwaad",
-    "rechtvaardigheid",
-    "aanraden",
-    "aanbevelen",
-    "archief",
+def normalize_corpus_items(items: List[Any]) -> List[Dict[str, Any]]:
+    normalized = []
+    for item in items[:CLARUS_CORPUS_ITEM_LIMIT]:
+        if isinstance(item, dict):
+            normalized_item = normalize_corpus_item(item)
+            if normalized_item:
+                normalized.append(normalized_item)
+    return normalized
+
+
+STOPWORDS = {
+    # English
+    "a", "about", "after", "all", "also", "an", "and", "any", "are", "as", "at", "be", "because",
+    "been", "but", "by", "can", "could", "did", "do", "does", "for", "from", "had", "has", "have",
+    "he", "her", "his", "how", "i", "if", "in", "into", "is", "it", "its", "me", "more", "my", "no",
+    "not", "of", "on", "or", "our", "so", "some", "than", "that", "the", "their", "them", "then",
+    "there", "these", "they", "this", "to", "us", "was", "we", "were", "what", "when", "where",
+    "which", "who", "why", "will", "with", "would", "you", "your",
+    # Dutch
+    "aan", "al", "als", "bij", "dan", "dat", "de", "deze", "die", "dit", "doen", "door", "een", "en",
+    "er", "had", "heb", "hebben", "heeft", "het", "hier", "hij", "hoe", "hun", "ik", "in", "is", "je",
+    "jij", "kan", "kun", "maar", "me", "mij", "met", "mijn", "na", "naar", "niet", "nog", "nu", "of",
+    "om", "onder", "ons", "ook", "op", "over", "te", "tegen", "toch", "tot", "u", "uit", "van", "veel",
+    "voor", "waar", "waarom", "was", "wat", "we", "wel", "welk", "welke", "werd", "wie", "wij", "wil",
+    "worden", "wordt", "zal", "ze", "zich", "zij", "zijn", "zo", "zou",
+    # Every corpus item is an essay, so these carry no ranking signal.
+    "essay", "essays",
 }
 
-OFF_TOPIC_PATTERNS = [
-    r"\bpython\b",
-    r"\bjavascript\b",
-    r"\btypescript\b",
-    r"\breact\b",
-    r"\bhtml\b",
-    r"\bcss\b",
-    r"\bcalculator\b",
-    r"\brekenmachine\b",
-    r"\bcode\b",
-    r"\bscript\b",
-    r"\bfunction\b",
-    r"\bdebug\b",
-    r"\binstall\b",
-    r"\bdeploy\b",
-    r"\brecipe\b",
-    r"\brecept\b",
-    r"\btravel\b",
-    r"\breis\b",
-    r"\bshopping\b",
-    r"\bkopen\b",
-    r"\bmarketing\b",
-    r"\bworkout\b",
-    r"\bfitness\b",
-    r"\bstock\b",
-    r"\bcrypto\b",
-    r"\bemail\b",
-    r"\bresume\b",
-    r"\bcv\b",
-    r"\bmake me\b",
-    r"\bbuild me\b",
-    r"\bwrite me\b",
-    r"\bmaak een\b",
-    r"\bschrijf een\b",
-    r"\bbouw een\b",
-]
+_TOKEN_PATTERN = re.compile(r"[0-9a-z]+")
+_STEM_SUFFIXES = ("heden", "ingen", "ische", "isch", "ing", "ies", "en", "es", "er", "e", "s")
 
 
-def is_off_topic(question: str) -> bool:
-    text = (question or "").lower()
-    if not text:
-        return False
+def fold_text(value: str) -> str:
+    value = (value or "").lower()
+    if value.isascii():
+        return value
+    return unicodedata.normalize("NFKD", value).encode("ascii", "ignore").decode("ascii")
 
-    words = set(re.findall(r"[a-zA-ZÀ-ÿ]+", text))
-    has_deep_context = bool(words & DEEP_TOPIC_TERMS)
-    if has_deep_context:
-        return False
 
-    if any(re.search(pattern, text) for pattern in OFF_TOPIC_PATTERNS):
-        return True
+@lru_cache(maxsize=65536)
+def stem_token(token: str) -> str:
+    for suffix in _STEM_SUFFIXES:
+        if len(token) - len(suffix) >= 4 and token.endswith(suffix):
+            return token[: -len(suffix)]
+    return token
 
-    practical_request = re.search(
-        r"\b(how do i|how to|can you|could you|please|maak|hoe maak|kun je|kan je)\b.*"
-        r"\b(make|build|write|create|fix|debug|install|deploy|cook|buy|earn|maak|bouw|schrijf|repareer|installeer)\b",
-        text,
-    )
-    return bool(practical_request)
 
+def tokenize(value: str) -> List[str]:
+    """Lowercase, accent-fold and lightly stem Dutch and English text for retrieval."""
+    return [
+        stem_token(token)
+        for token in _TOKEN_PATTERN.findall(fold_text(value))
+        if len(token) > 1 and token not in STOPWORDS
+    ]
 
-def scope_redirect(language: str) -> str:
-    if language == "nl":
-        return (
-            "Dat valt buiten mijn taak. Stel een vraag over het essay, een moreel begrip "
-            "of een existentieel bezwaar."
-        )
-    return (
-        "That falls outside my task. Ask about the essay, a moral concept or an existential objection."
-    )
 
+def split_passages(text: str, limit: int = CLARUS_PASSAGE_CHARS) -> List[str]:
+    sentences = re.split(r"(?<=[.!?])\s+", text or "")
+    passages: List[str] = []
+    current = ""
+    for sentence in sentences:
+        if not sentence:
+            continue
+        if current and len(current) + len(sentence) + 1 > limit:
+            passages.append(current)
+            current = ""
+        current = f"{current} {sentence}".strip() if current else trim_text(sentence, limit)
+    if current:
+        passages.append(current)
+    return passages
 
-def build_messages(data: Dict[str, Any]) -> List[Dict[str, str]]:
-    question = trim_text(data.get("vraag", ""), 1800)
-    language = normalize_language(data.get("language", ""), question)
-    context_type = trim_text(str(data.get("contextType", "essay")), 40)
-    essay_title = trim_text(data.get("essayTitle", ""), 240)
-    essay = trim_text(strip_html(data.get("essay", "")), 12000)
-    corpus_context = build_corpus_context(data.get("essayCorpus", []))
-    history = data.get("history", [])
 
-    language_instruction = (
-        "Antwoord in het Nederlands." if language == "nl" else "Answer in English."
-    )
+class BM25Index:
+    """Small in-process inverted index with Okapi BM25 scoring."""
 
-    messages: List[Dict[str, str]] = [
-        {"role": "system", "content": SYSTEM_PROMPT},
-        {"role": "system", "content": f"{language_instruction}\n\nProject context:\n{PROJECT_CONTEXT}"},
-        {
-            "role": "system",
-            "content": (
-                f"Frontend context type: {context_type}\n"
-                f"Current essay title: {essay_title or 'No single essay selected'}\n\n"
-                f"Current essay text supplied by the frontend:\n{essay or '(none)'}"
-            ),
-        },
-    ]
+    def __init__(self, documents: List[List[str]], k1: float = 1.4, b: float = 0.75) -> None:
+        self.k1 = k1
+        self.b = b
+        self.lengths = [len(tokens) for tokens in documents]
+        self.average_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        for doc_id, tokens in enumerate(documents):
+            counts: Dict[str, int] = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, count in counts.items():
+                self.postings.setdefault(token, []).append((doc_id, count))
+        total = len(documents)
+        self.idf = {
+            token: math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for token, postings in self.postings.items()
+        }
 
-    if corpus_context:
-        messages.append(
-            {
-                "role": "system",
-                "content": (
-                    "Public essay archive supplied by the frontend. Use this bounded corpus for archive "
-                    "navigation and essay recommendations. Recommend only essays listed here and include "
-                    "the supplied path when useful.\n\n"
-                    f"{corpus_context}"
-                ),
-            }
+    def scores(self, query: Dict[str, float]) -> Dict[int, float]:
+        scores: Dict[int, float] = {}
+        if not self.average_length:
+            return scores
+        for token, weight in query.items():
+            postings = self.postings.get(token)
+            if not postings:
+                continue
+            idf = self.idf[token] * weight
+            for doc_id, count in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[doc_id] / self.average_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * count * (self.k1 + 1) / (count + norm)
+        return scores
+
+    def top(self, query: Dict[str, float], k: int) -> List[Tuple[int, float]]:
+        ranked = sorted(self.scores(query).items(), key=lambda pair: (-pair[1], pair[0]))
+        return ranked[:k]
+
+
+def build_query(question: str, history: Any) -> Dict[str, float]:
+    """Weight question terms fully and terms from the two latest user turns at half weight."""
+    query: Dict[str, float] = {}
+    if isinstance(history, list):
+        recent = [
+            msg.get("content", "")
+            for msg in history[-4:]
+            if isinstance(msg, dict) and msg.get("role") == "user" and isinstance(msg.get("content"), str)
+        ]
+        for token in tokenize(" ".join(recent[-2:])):
+            query[token] = 0.5
+    for token in tokenize(question):
+        query[token] = 1.0
+    return query
+
+
+def build_corpus_index(items: List[Dict[str, Any]]) -> Dict[str, Any]:
+    item_documents = []
+    passages: List[Tuple[int, str]] = []
+    passage_documents: List[List[str]] = []
+    item_passages: List[List[int]] = []
+    for item_index, item in enumerate(items):
+        document = (
+            tokenize(item["title"]) * 3
+            + tokenize(" ".join(item["categories"])) * 2
+            + tokenize(item["excerpt"])
         )
+        item_passages.append([])
+        for passage in split_passages(item["body"]):
+            tokens = tokenize(passage)
+            document.extend(tokens)
+            item_passages[item_index].append(len(passages))
+            passages.append((item_index, passage))
+            passage_documents.append(tokens)
+        item_documents.append(document)
+    return {
+        "items": BM25Index(item_documents),
+        "passages": BM25Index(passage_documents),
+        "passageText": passages,
+        "itemPassages": item_passages,
+    }
 
-    for msg in history[-8:]:
-        role = msg.get("role")
-        content = msg.get("content")
-        if role in {"user", "assistant"} and isinstance(content, str):
-            messages.append({"role": role, "content": trim_text(content, 1400)})
 
-    messages.append({"role": "user", "content": question})
-    return messages
+def split_essay_passages(paragraphs: List[str]) -> List[str]:
+    """Merge short paragraphs and split long ones so passages stay near CLARUS_PASSAGE_CHARS."""
+    passages: List[str] = []
+    current = ""
+    for paragraph in paragraphs:
+        pieces = split_passages(paragraph) if len(paragraph) > 2 * CLARUS_PASSAGE_CHARS else [paragraph]
+        for piece in pieces:
+            if current and len(current) + len(piece) > CLARUS_PASSAGE_CHARS:
+                passages.append(current)
+                current = ""
+            current = f"{current}\n\n{piece}" if current else piece
+    if current:
+        passages.append(current)
+    return passages
 
 
-def create_completion(messages: List[Dict[str, str]]) -> Dict[str, Any]:
-    if client is None:
-        raise RuntimeError("OPENAI_API_KEY is not configured.")
+def rank_essay_passages(essay: Dict[str, Any], query: Dict[str, float]) -> List[Tuple[int, float]]:
+    """Return (passage, value) pairs: the opening first, then matches by score, then the rest in order."""
+    passages = essay["passages"]
+    ranked: List[Tuple[int, float]] = []
+    used = 0
+    for passage_id, passage in enumerate(passages):
+        if used and used + len(passage) > CLARUS_ESSAY_OPENING_CHARS:
+            break
+        ranked.append((passage_id, 1000.0))
+        used += len(passage)
 
-    last_error: Optional[Exception] = None
-    for model in [CLARUS_MODEL, CLARUS_FALLBACK_MODEL]:
-        if not model:
-            continue
-        try:
-            response = client.chat.completions.create(
-                model=model,
-                messages=messages,
-                max_completion_tokens=CLARUS_MAX_OUTPUT_TOKENS,
-            )
-            content = (response.choices[0].message.content or "").strip()
-            usage = response.usage.model_dump() if getattr(response, "usage", None) else {}
-            return {"answer": content, "model": model, "usage": usage}
-        except Exception as exc:  # Try the configured fallback before failing.
-            last_error = exc
-            logger.warning("Clarus model call failed for %s: %s", model, exc)
+    taken = {passage_id for passage_id, _ in ranked}
+    scores = essay["index"].scores(query) if query else {}
+    for rank, passage_id in enumerate(sorted(scores, key=lambda pid: (-scores[pid], pid))):
+        if passage_id not in taken:
+            ranked.append((passage_id, max(650.0 - 10 * rank, 300.0)))
+            taken.add(passage_id)
+    for passage_id in range(len(passages)):
+        if passage_id not in taken:
+            ranked.append((passage_id, 250.0 - passage_id / (len(passages) + 1)))
+    return ranked
 
-    raise last_error or RuntimeError("No model configured.")
 
+def render_essay_passages(essay: Dict[str, Any], chosen: List[int]) -> str:
+    passages = essay["passages"]
+    if len(chosen) == len(passages):
+        return essay["text"]
+    chosen = sorted(chosen)
+    parts: List[str] = []
+    for position, passage_id in enumerate(chosen):
+        if position and passage_id != chosen[position - 1] + 1:
+            parts.append("[...]")
+        parts.append(passages[passage_id])
+    if chosen and chosen[-1] != len(passages) - 1:
+        parts.append("[...]")
+    return "\n\n".join(parts)
 
-def sse(event: str, payload: Dict[str, Any]) -> str:
-    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
 
+def retrieve_corpus(corpus: Dict[str, Any], query: Dict[str, float], top_k: int = CLARUS_CORPUS_TOP_K) -> List[Dict[str, Any]]:
+    """Rank corpus items against the query and attach their best-matching passages as `body`."""
+    items = corpus["items"]
+    index = corpus["index"]
+    ranked = [item_index for item_index, _ in index["items"].top(query, top_k)] if query else []
+    if not ranked:
+        ranked = list(range(min(top_k, len(items))))
 
-def stream_completion(messages: List[Dict[str, str]]):
-    if client is None:
-        raise RuntimeError("OPENAI_API_KEY is not configured.")
+    passage_scores = index["passages"].scores(query) if query else {}
+    selected = []
+    for item_index in ranked:
+        chosen: List[int] = []
+        used = 0
+        candidates = index["itemPassages"][item_index]
+        for passage_id in sorted(candidates, key=lambda pid: (-passage_scores.get(pid, 0.0), pid)):
+            length = len(index["passageText"][passage_id][1])
+            if chosen and used + length > CLARUS_CORPUS_BODY_CHARS:
+                continue
+            chosen.append(passage_id)
+            used += length
+        body = " [...] ".join(index["passageText"][passage_id][1] for passage_id in sorted(chosen))
+        selected.append({**items[item_index], "body": trim_text(body, CLARUS_CORPUS_BODY_CHARS)})
+    return selected
 
-    last_error: Optional[Exception] = None
-    for model in [CLARUS_MODEL, CLARUS_FALLBACK_MODEL]:
-        if not model:
-            continue
-        answer_parts: List[str] = []
-        usage: Dict[str, Any] = {}
-        try:
-            stream = client.chat.completions.create(
-                model=model,
-                messages=messages,
-                max_completion_tokens=CLARUS_MAX_OUTPUT_TOKENS,
-                stream=True,
-                stream_options={"include_usage": True},
-            )
-            yield "model", {"model": model}
 
-            for chunk in stream:
-                if getattr(chunk, "usage", None):
-                    usage = chunk.usage.model_dump()
-                if not getattr(chunk, "choices", None):
-                    continue
-                delta = getattr(chunk.choices[0], "delta", None)
-                token = getattr(delta, "content", None)
-                if token:
-                    answer_parts.append(token)
-                    yield "token", {"token": token}
+SECONDS_BUCKETS = (0.001, 0.005, 0.025, 0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32, 64)
+RATE_BUCKETS = (5, 10, 20, 40, 80, 160, 320)
+METRIC_TYPES = {
+    "clarus_requests_total": ("counter", "Chat requests by outcome.", None),
+    "clarus_request_seconds": ("histogram", "Chat request latency.", SECONDS_BUCKETS),
+    "clarus_first_token_seconds": ("histogram", "Time from request to first streamed token.", SECONDS_BUCKETS),
+    "clarus_tokens_total": ("counter", "Model tokens by kind; cached tokens are part of prompt.", None),
+    "clarus_model_calls_total": ("counter", "Model call attempts by outcome.", None),
+    "clarus_model_call_seconds": ("histogram", "Duration of one model call attempt.", SECONDS_BUCKETS),
+    "clarus_model_tokens_per_second": ("histogram", "Completion tokens per second after the first token.", RATE_BUCKETS),
+    "clarus_stage_seconds": ("histogram", "Time spent in one pipeline stage.", SECONDS_BUCKETS),
+    "clarus_streams_active": ("gauge", "Open model streams.", None),
+    "clarus_streams_rejected_total": ("counter", "Streams refused by CLARUS_MAX_STREAMS.", None),
+    "clarus_streams_cancelled_total": ("counter", "Streams closed by a disconnected reader.", None),
+    "clarus_admission_rejected_total": ("counter", "Requests refused by admission control.", None),
+    "clarus_admission_slots": ("gauge", "Model-call slots in use or waited for.", None),
+    "clarus_log_queue_depth": ("gauge", "Log entries waiting for the writer thread.", None),
+    "clarus_log_entries_total": ("counter", "Log entries handled by the writer thread.", None),
+    "clarus_cache_operations_total": ("counter", "Cache operations by namespace and outcome.", None),
+    "clarus_breaker_open": ("gauge", "Workers whose circuit breaker for the model is open.", None),
+}
 
-            answer = "".join(answer_parts).strip()
-            return {"answer": answer, "model": model, "usage": usage}
-        except Exception as exc:
-            last_error = exc
-            logger.warning("Clarus streaming call failed for %s: %s", model, exc)
-            yield "status", {"message": "Clarus probeert een fallbackmodel."}
 
-    raise last_error or RuntimeError("No model configured.")
+def metric_key(name: str, labels: Dict[str, Any]) -> Tuple[str, Tuple[Tuple[str, str], ...]]:
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
 
 
-def get_ip_hash() -> Optional[str]:
-    if not IP_HASH_SALT:
-        return None
-    forwarded = request.headers.get("X-Forwarded-For", "")
-    ip = forwarded.split(",")[0].strip() or request.remote_addr or ""
-    return hashlib.sha256(f"{IP_HASH_SALT}:{ip}".encode("utf-8")).hexdigest()
+class Metrics:
+    """Counters and histograms for /metrics, kept per process and merged across workers.
 
+    Recording is a dict update under a lock. A background thread writes the totals of each
+    worker to CLARUS_METRICS_PATH every CLARUS_METRICS_FLUSH_SECONDS; a scrape writes its own
+    totals first and sums the rows of all workers. Rows of workers that have exited are folded
+    into one row, so their counts survive restarts without the table growing.
+    """
 
-def init_firebase_admin() -> bool:
-    if firebase_admin is None:
-        return False
-    if firebase_admin._apps:
-        return True
+    def __init__(self) -> None:
+        self.path = CLARUS_METRICS_PATH if CLARUS_METRICS_BACKEND == "sqlite" else None
+        self.collectors: List[Any] = []
+        self._counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        self._histograms: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], List[float]] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._pid: Optional[int] = None
+        self._process = ""
 
-    try:
-        service_account = os.getenv("FIREBASE_SERVICE_ACCOUNT_JSON")
-        if service_account:
-            firebase_admin.initialize_app(credentials.Certificate(json.loads(service_account)))
-        elif not os.getenv("GOOGLE_APPLICATION_CREDENTIALS"):
+    def _ensure_worker(self) -> None:
+        # Gunicorn forks after import; each worker starts from zero with its own flush thread.
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._counters.clear()
+                self._histograms.clear()
+                self._process = uuid.uuid4().hex
+                if self.path is not None:
+                    threading.Thread(target=self._run, name="clarus-metrics", daemon=True).start()
+                self._pid = os.getpid()
+
+    def inc(self, name: str, value: float = 1, **labels: Any) -> None:
+        if not CLARUS_METRICS:
+            return
+        self._ensure_worker()
+        key = metric_key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        if not CLARUS_METRICS:
+            return
+        self._ensure_worker()
+        key = metric_key(name, labels)
+        buckets = METRIC_TYPES[name][2]
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0.0] * (len(buckets) + 3)
+            histogram[bisect.bisect_left(buckets, value)] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def snapshot(self) -> Dict[str, Dict[Any, Any]]:
+        """Totals of this process, including the counters and gauges of the collectors."""
+        self._ensure_worker()
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: list(values) for key, values in self._histograms.items()}
+        gauges: Dict[Any, float] = {}
+        for collect in self.collectors:
+            try:
+                for name, labels, value in collect():
+                    target = gauges if METRIC_TYPES[name][0] == "gauge" else counters
+                    target[metric_key(name, labels)] = value
+            except Exception as exc:
+                logger.warning("Clarus metrics collector failed: %s", exc)
+        return {"counters": counters, "histograms": histograms, "gauges": gauges}
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None or getattr(self._local, "pid", None) != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(str(self.path), timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA busy_timeout=5000")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS metrics"
+                " (process TEXT PRIMARY KEY, pid INTEGER, updated REAL NOT NULL, snapshot TEXT NOT NULL)"
+            )
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    @staticmethod
+    def _encode(snapshot: Dict[str, Dict[Any, Any]]) -> str:
+        return json.dumps({kind: [[name, labels, value] for (name, labels), value in values.items()] for kind, values in snapshot.items()})
+
+    @staticmethod
+    def _decode(value: str) -> Dict[str, Dict[Any, Any]]:
+        return {
+            kind: {(name, tuple(tuple(label) for label in labels)): total for name, labels, total in rows}
+            for kind, rows in json.loads(value).items()
+        }
+
+    @staticmethod
+    def _merge(target: Dict[str, Dict[Any, Any]], snapshot: Dict[str, Dict[Any, Any]], gauges: bool = True) -> None:
+        for kind, values in snapshot.items():
+            if kind == "gauges" and not gauges:
+                continue
+            merged = target.setdefault(kind, {})
+            for key, value in values.items():
+                if kind == "histograms":
+                    previous = merged.get(key)
+                    merged[key] = [a + b for a, b in zip(previous, value)] if previous else list(value)
+                else:
+                    merged[key] = merged.get(key, 0) + value
+
+    @staticmethod
+    def _alive(pid: int) -> bool:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
             return False
-        else:
-            firebase_admin.initialize_app()
+        except OSError:
+            pass
         return True
-    except Exception as exc:
-        logger.warning("Firebase Admin SDK is not configured: %s", exc)
-        return False
 
+    def flush(self) -> None:
+        if self.path is None or self._pid != os.getpid():
+            return
+        snapshot = self.snapshot()
+        self._connect().execute(
+            "INSERT OR REPLACE INTO metrics VALUES (?, ?, ?, ?)",
+            (self._process, os.getpid(), time.time(), self._encode(snapshot)),
+        )
 
-def get_firestore_client() -> Optional[Any]:
-    if firebase_firestore is None or not init_firebase_admin():
-        return None
-    try:
-        return firebase_firestore.client()
-    except Exception as exc:
-        logger.warning("Firestore client is not available: %s", exc)
-        return None
+    def _run(self) -> None:
+        while True:
+            time.sleep(CLARUS_METRICS_FLUSH_SECONDS)
+            try:
+                self.flush()
+            except Exception as exc:
+                logger.warning("Could not write Clarus metrics: %s", exc)
 
+    def collect(self) -> Dict[str, Dict[Any, Any]]:
+        """Totals of every worker on the host, or of this process without a shared file."""
+        if self.path is None:
+            return self.snapshot()
+        try:
+            self._ensure_worker()
+            self.flush()
+            db = self._connect()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                totals: Dict[str, Dict[Any, Any]] = {}
+                retired: Dict[str, Dict[Any, Any]] = {}
+                exited = []
+                for process, pid, snapshot in db.execute("SELECT process, pid, snapshot FROM metrics").fetchall():
+                    decoded = self._decode(snapshot)
+                    if process == "retired" or self._alive(pid):
+                        self._merge(totals, decoded)
+                    else:
+                        exited.append(process)
+                        self._merge(totals, decoded, gauges=False)
+                        self._merge(retired, decoded, gauges=False)
+                if exited:
+                    row = db.execute("SELECT snapshot FROM metrics WHERE process = 'retired'").fetchone()
+                    if row:
+                        self._merge(retired, self._decode(row[0]))
+                    db.executemany("DELETE FROM metrics WHERE process = ?", [(process,) for process in exited])
+                    db.execute("INSERT OR REPLACE INTO metrics VALUES ('retired', 0, ?, ?)", (time.time(), self._encode(retired)))
+                db.execute("COMMIT")
+                return totals
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+        except Exception as exc:
+            logger.warning("Could not read shared Clarus metrics, reporting this worker only: %s", exc)
+            return self.snapshot()
 
-def write_firestore_log(entry: Dict[str, Any]) -> bool:
-    db = get_firestore_client()
-    if db is None:
-        return False
-    try:
-        db.collection(CLARUS_LOG_COLLECTION).document(entry["id"]).set(entry, merge=True)
-        return True
-    except Exception as exc:
-        logger.warning("Could not write Clarus log to Firestore: %s", exc)
-        return False
 
+metrics = Metrics()
+atexit.register(metrics.flush)
 
-def build_log_entry(
-    data: Dict[str, Any],
-    language: str,
-    question: str,
-    log_id: str,
-    **extra: Any,
-) -> Dict[str, Any]:
-    entry = {
-        "id": log_id,
-        "timestamp": datetime.now(timezone.utc).isoformat(),
-        "language": language,
-        "contextType": data.get("contextType", "essay"),
-        "essayId": data.get("essayId"),
-        "essayTitle": trim_text(data.get("essayTitle", ""), 240),
-        "corpusSize": len(data.get("essayCorpus", [])) if isinstance(data.get("essayCorpus"), list) else 0,
-        "question": trim_text(question, 2400),
-        "ipHash": get_ip_hash(),
-        "userAgent": trim_text(request.headers.get("User-Agent", ""), 300),
-    }
-    entry.update(extra)
-    return entry
 
+def timed(stage: str) -> Any:
+    """Record the duration of each call to the decorated function under clarus_stage_seconds."""
 
-def append_file_log(entry: Dict[str, Any]) -> None:
-    CLARUS_LOG_PATH.parent.mkdir(parents=True, exist_ok=True)
-    with CLARUS_LOG_PATH.open("a", encoding="utf-8") as handle:
-        handle.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    def decorate(function: Any) -> Any:
+        @wraps(function)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if not CLARUS_METRICS:
+                return function(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                metrics.observe("clarus_stage_seconds", time.perf_counter() - started, stage=stage)
 
+        return wrapper
+
+    return decorate
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def metric_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render_metrics(totals: Dict[str, Dict[Any, Any]]) -> str:
+    """Prometheus text exposition of merged totals; histogram buckets become cumulative."""
+    series: Dict[str, List[str]] = {}
+    for kind in ("counters", "gauges"):
+        for (name, labels), value in sorted(totals.get(kind, {}).items()):
+            rendered = ",".join(f'{label}="{escape_label(text)}"' for label, text in labels)
+            series.setdefault(name, []).append(f"{name}{{{rendered}}} {metric_value(value)}" if rendered else f"{name} {metric_value(value)}")
+    for (name, labels), values in sorted(totals.get("histograms", {}).items()):
+        lines = series.setdefault(name, [])
+        prefix = "".join(f'{label}="{escape_label(text)}",' for label, text in labels)
+        cumulative = 0.0
+        for bound, count in zip(list(METRIC_TYPES[name][2]) + ["+Inf"], values[:-2]):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {metric_value(cumulative)}')
+        suffix = f"{{{prefix[:-1]}}}" if prefix else ""
+        lines.append(f"{name}_sum{suffix} {metric_value(values[-2])}")
+        lines.append(f"{name}_count{suffix} {metric_value(values[-1])}")
+
+    output = []
+    for name in sorted(series):
+        kind, description, _ = METRIC_TYPES[name]
+        output.append(f"# HELP {name} {description}")
+        output.append(f"# TYPE {name} {kind}")
+        output.extend(series[name])
+    return "\n".join(output) + "\n"
+
+
+class CacheStats:
+    def __init__(self) -> None:
+        self.counts: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, namespace: str, outcome: str) -> None:
+        with self._lock:
+            bucket = self.counts.setdefault(namespace, {"hits": 0, "misses": 0, "sets": 0, "evictions": 0})
+            bucket[outcome] += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {namespace: dict(bucket) for namespace, bucket in self.counts.items()}
+
+
+class MemoryCache:
+    """Per-process cache: one LRU per namespace with optional TTL and tags for invalidation."""
+
+    shared = False
+
+    def __init__(self) -> None:
+        self.stats = CacheStats()
+        self._namespaces: Dict[str, "OrderedDict[str, Tuple[Any, float, Tuple[str, ...]]]"] = {}
+        self._lock = threading.Lock()
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        with self._lock:
+            entries = self._namespaces.get(namespace)
+            entry = entries.get(key) if entries else None
+            if entry is not None and entry[1] and entry[1] < time.time():
+                del entries[key]
+                entry = None
+            if entry is not None:
+                entries.move_to_end(key)
+        self.stats.record(namespace, "hits" if entry is not None else "misses")
+        return entry[0] if entry is not None else None
+
+    def set(
+        self,
+        namespace: str,
+        key: str,
+        value: Any,
+        max_entries: int,
+        ttl: Optional[int] = None,
+        tags: Tuple[str, ...] = (),
+    ) -> None:
+        evicted = 0
+        with self._lock:
+            entries = self._namespaces.setdefault(namespace, OrderedDict())
+            entries[key] = (value, time.time() + ttl if ttl else 0.0, tags)
+            entries.move_to_end(key)
+            while len(entries) > max_entries:
+                entries.popitem(last=False)
+                evicted += 1
+        self.stats.record(namespace, "sets")
+        for _ in range(evicted):
+            self.stats.record(namespace, "evictions")
+
+    def invalidate_tag(self, namespace: str, tag: str) -> None:
+        with self._lock:
+            entries = self._namespaces.get(namespace) or {}
+            for key in [key for key, entry in entries.items() if tag in entry[2]]:
+                del entries[key]
+
+
+class SQLiteCache:
+    """Host-wide cache shared by all gunicorn workers through one SQLite file in WAL mode.
+
+    Values are pickled. Each worker thread opens its own connection lazily, so the cache is
+    safe to create before gunicorn forks.
+    """
+
+    shared = True
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.stats = CacheStats()
+        self._local = threading.local()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL,"
+                " expires_at REAL NOT NULL, accessed_at REAL NOT NULL, tags TEXT NOT NULL,"
+                " PRIMARY KEY (namespace, key))"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS entries_lru ON entries (namespace, accessed_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None or getattr(self._local, "pid", None) != os.getpid():
+            connection = sqlite3.connect(str(self.path), timeout=5, isolation_level=None)
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA busy_timeout=5000")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        try:
+            db = self._connect()
+            row = db.execute(
+                "SELECT value, expires_at, accessed_at FROM entries WHERE namespace = ? AND key = ?",
+                (namespace, key),
+            ).fetchone()
+            now = time.time()
+            if row is not None and row[1] and row[1] < now:
+                db.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+                row = None
+            # Refresh recency at most once a minute to keep hot reads from turning into writes.
+            if row is not None and now - row[2] > 60:
+                db.execute(
+                    "UPDATE entries SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                    (now, namespace, key),
+                )
+            value = pickle.loads(row[0]) if row is not None else None
+        except Exception as exc:
+            logger.warning("Clarus cache read failed for %s: %s", namespace, exc)
+            value = None
+        self.stats.record(namespace, "hits" if value is not None else "misses")
+        return value
+
+    def set(
+        self,
+        namespace: str,
+        key: str,
+        value: Any,
+        max_entries: int,
+        ttl: Optional[int] = None,
+        tags: Tuple[str, ...] = (),
+    ) -> None:
+        now = time.time()
+        try:
+            db = self._connect()
+            db.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    namespace,
+                    key,
+                    pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL),
+                    now + ttl if ttl else 0.0,
+                    now,
+                    " ".join(tags),
+                ),
+            )
+            evicted = db.execute(
+                "DELETE FROM entries WHERE namespace = ? AND key IN ("
+                " SELECT key FROM entries WHERE namespace = ? ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (namespace, namespace, max_entries),
+            ).rowcount
+        except Exception as exc:
+            logger.warning("Clarus cache write failed for %s: %s", namespace, exc)
+            return
+        self.stats.record(namespace, "sets")
+        for _ in range(max(evicted, 0)):
+            self.stats.record(namespace, "evictions")
+
+    def invalidate_tag(self, namespace: str, tag: str) -> None:
+        try:
+            self._connect().execute(
+                "DELETE FROM entries WHERE namespace = ? AND (' ' || tags || ' ') LIKE ?",
+                (namespace, f"% {tag} %"),
+            )
+        except Exception as exc:
+            logger.warning("Clarus cache invalidation failed for %s: %s", namespace, exc)
+
+
+def create_cache_backend() -> Any:
+    if CLARUS_CACHE_BACKEND == "sqlite":
+        try:
+            return SQLiteCache(CLARUS_CACHE_PATH)
+        except Exception as exc:
+            logger.warning("Shared Clarus cache is not available, using memory: %s", exc)
+    return MemoryCache()
+
+
+cache = create_cache_backend()
+if CLARUS_WORKERS > 1 and not cache.shared:
+    logger.warning(
+        "Clarus keeps uploads in per-process memory with %s workers; requests that land on another "
+        "worker get 409 uploadRequired. Set CLARUS_CACHE_BACKEND=sqlite to share them.",
+        CLARUS_WORKERS,
+    )
+
+
+# Content-addressed registry. The frontend uploads an essay or the essay corpus once,
+# receives its version hash and afterwards sends only `essayVersion` / `corpusVersion`.
+# Inline payloads are registered under the same hash, so repeated inline requests also
+# skip HTML stripping and normalization. Records are kept in a per-process LRU in front
+# of the cache backend; with the shared backend every worker sees every upload.
+_registry_lock = threading.Lock()
+_essay_registry: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_corpus_registry: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+REGISTRY_LIMITS = {"essays": CLARUS_REGISTRY_ESSAYS, "corpora": CLARUS_REGISTRY_CORPORA}
+
+
+class UnknownContextVersion(Exception):
+    def __init__(self, kind: str, version: str) -> None:
+        super().__init__(f"Unknown {kind} version: {version}")
+        self.kind = kind
+        self.version = version
+
+
+def content_version(value: Any) -> str:
+    raw = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:24]
+
+
+def _registry_local(namespace: str) -> "OrderedDict[str, Dict[str, Any]]":
+    return _essay_registry if namespace == "essays" else _corpus_registry
+
+
+def _registry_get(namespace: str, version: str) -> Optional[Dict[str, Any]]:
+    registry = _registry_local(namespace)
+    with _registry_lock:
+        record = registry.get(version)
+        if record is not None:
+            registry.move_to_end(version)
+            return record
+    if not cache.shared:
+        return None
+    record = cache.get(namespace, version)
+    if record is not None:
+        _registry_put(namespace, version, record, share=False)
+    return record
+
+
+def _registry_put(namespace: str, version: str, record: Dict[str, Any], share: bool = True) -> None:
+    registry = _registry_local(namespace)
+    with _registry_lock:
+        registry[version] = record
+        registry.move_to_end(version)
+        while len(registry) > REGISTRY_LIMITS[namespace]:
+            registry.popitem(last=False)
+    if share and cache.shared:
+        cache.set(namespace, version, record, REGISTRY_LIMITS[namespace])
+
+
+def register_essay(title: Any, essay: Any) -> Dict[str, Any]:
+    title = str(title or "")
+    essay = str(essay or "")
+    version = content_version(f"{title}\x00{essay}")
+    record = _registry_get("essays", version)
+    if record is None:
+        passages = split_essay_passages(strip_html_paragraphs(essay))
+        record = {
+            "version": version,
+            "title": trim_text(title, 240),
+            "text": "\n\n".join(passages),
+            "passages": passages,
+            "passageTokens": [estimate_tokens(passage) + 1 for passage in passages],
+            "index": BM25Index([tokenize(passage) for passage in passages]),
+        }
+        _registry_put("essays", version, record)
+    return record
+
+
+def register_corpus(items: List[Any]) -> Dict[str, Any]:
+    version = content_version(items)
+    record = _registry_get("corpora", version)
+    if record is None:
+        normalized = normalize_corpus_items(items)
+        record = {
+            "version": version,
+            "items": normalized,
+            "index": build_corpus_index(normalized),
+        }
+        _registry_put("corpora", version, record)
+    return record
+
+
+def resolve_context(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Resolve the essay and corpus for a request, from inline text or by registry version."""
+    essay_version = str(data.get("essayVersion") or "")
+    if data.get("essay"):
+        essay = register_essay(data.get("essayTitle", ""), data.get("essay"))
+    elif essay_version:
+        essay = _registry_get("essays", essay_version)
+        if essay is None:
+            raise UnknownContextVersion("essay", essay_version)
+    elif data.get("essayId") and data.get("contextType") != "corpus":
+        # Essays resolve by content hash only; an id is a label any client can send.
+        raise UnknownContextVersion("essay", "")
+    else:
+        essay = None
+
+    corpus_version = str(data.get("corpusVersion") or "")
+    items = data.get("essayCorpus")
+    if isinstance(items, list) and items:
+        corpus = register_corpus(items)
+    elif corpus_version:
+        corpus = _registry_get("corpora", corpus_version)
+        if corpus is None:
+            raise UnknownContextVersion("corpus", corpus_version)
+    else:
+        corpus = None
+
+    return {
+        "essayTitle": (essay or {}).get("title") or trim_text(data.get("essayTitle", ""), 240),
+        "essay": essay,
+        "essayVersion": (essay or {}).get("version"),
+        "corpus": corpus,
+        "corpusVersion": (corpus or {}).get("version"),
+        "corpusSize": len(corpus["items"]) if corpus else 0,
+    }
+
+
+def unknown_version_response(exc: UnknownContextVersion):
+    return jsonify({
+        "error": "Onbekende contextversie. Upload de context opnieuw.",
+        "uploadRequired": exc.kind,
+        "version": exc.version,
+    }), 409
+
+
+class AnswerCache:
+    """TTL cache of completed answers to history-free questions, stored in the cache backend."""
+
+    namespace = "answers"
+
+    def __init__(self, max_entries: int, ttl_seconds: int) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.ttl_seconds > 0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return cache.get(self.namespace, key) if self.enabled else None
+
+    def put(self, key: str, versions: Tuple[Optional[str], Optional[str]], **entry: Any) -> None:
+        if self.enabled:
+            tags = tuple(version for version in versions if version)
+            cache.set(self.namespace, key, entry, self.max_entries, ttl=self.ttl_seconds, tags=tags)
+
+
+answer_cache = AnswerCache(CLARUS_ANSWER_CACHE_SIZE, CLARUS_ANSWER_CACHE_TTL)
+
+
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{16,64}$")
+
+
+def history_turns(history: Any) -> List[Dict[str, str]]:
+    if not isinstance(history, list):
+        return []
+    return [
+        {"role": msg["role"], "content": trim_text(msg["content"], 1400)}
+        for msg in history
+        if isinstance(msg, dict) and msg.get("role") in {"user", "assistant"} and isinstance(msg.get("content"), str)
+    ]
+
+
+class SessionStore:
+    """Conversation turns and context references per `sessionId`, stored in the cache backend.
+
+    Follow-up requests send `sessionId` and the new `vraag`; the stored turns and essay and
+    corpus versions fill in `history`, `essayVersion` and `corpusVersion` when the request
+    leaves them out. Sessions expire CLARUS_SESSION_TTL seconds after their last turn. With
+    more than one worker they need the shared cache backend, since a follow-up may land on
+    any worker; otherwise they stay off and clients keep sending `history`.
+    """
+
+    namespace = "sessions"
+
+    def __init__(self, max_entries: int, ttl_seconds: int) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+    @property
+    def enabled(self) -> bool:
+        if CLARUS_WORKERS > 1 and not getattr(cache, "shared", False):
+            return False
+        return self.max_entries > 0 and self.ttl_seconds > 0
+
+    def apply(self, data: Dict[str, Any]) -> Optional[str]:
+        """Fill the request from its session and return the session id, minting one if needed."""
+        if not self.enabled:
+            return None
+        session_id = data.get("sessionId")
+        if not isinstance(session_id, str) or not SESSION_ID_PATTERN.match(session_id):
+            data["sessionId"] = uuid.uuid4().hex
+            return data["sessionId"]
+        session = cache.get(self.namespace, session_id)
+        if session is None:
+            # A new or expired id starts a session with whatever history the request carries.
+            return session_id
+        if not has_history(data):
+            data["history"] = list(session["turns"])
+        if not data.get("essay") and not data.get("essayVersion") and session.get("essayVersion"):
+            data["essayVersion"] = session["essayVersion"]
+        if not data.get("essayCorpus") and not data.get("corpusVersion") and session.get("corpusVersion"):
+            data["corpusVersion"] = session["corpusVersion"]
+        for field in ("essayId", "contextType", "language"):
+            if not data.get(field) and session.get(field):
+                data[field] = session[field]
+        return session_id
+
+    def append(self, data: Dict[str, Any], context: Dict[str, Any], language: str, question: str, answer: str) -> None:
+        session_id = data.get("sessionId")
+        if not self.enabled or not session_id or not answer:
+            return
+        turns = history_turns(data.get("history")) + [
+            {"role": "user", "content": trim_text(question, 1400)},
+            {"role": "assistant", "content": trim_text(answer, 1400)},
+        ]
+        session = {
+            "turns": turns[-CLARUS_HISTORY_TURNS:] if CLARUS_HISTORY_TURNS else [],
+            "essayId": data.get("essayId"),
+            "essayVersion": context.get("essayVersion"),
+            "corpusVersion": context.get("corpusVersion"),
+            "contextType": data.get("contextType"),
+            "language": language,
+        }
+        cache.set(self.namespace, session_id, session, self.max_entries, ttl=self.ttl_seconds)
+
+
+sessions = SessionStore(CLARUS_SESSION_LIMIT, CLARUS_SESSION_TTL)
+if CLARUS_SESSION_LIMIT and CLARUS_WORKERS > 1 and not getattr(cache, "shared", False):
+    logger.warning("Clarus sessions are off: %s workers need CLARUS_CACHE_BACKEND=sqlite to share them.", CLARUS_WORKERS)
+
+
+SUMMARY_PROMPT = """
+You compress the earlier part of a conversation between a reader of degrondvraag.com and Clarus, its reflective assistant.
+Keep the reader's questions, positions and objections, the essays and concepts discussed and the distinctions Clarus drew.
+Drop greetings, repetition and style. Write at most 150 words in the language of the conversation. Output only the summary.
+""".strip()
+
+
+class HistorySummaries:
+    """Running summaries of older conversation turns, built off the request path.
+
+    Once a conversation's history passes CLARUS_SUMMARY_THRESHOLD estimated tokens, everything
+    but the last CLARUS_SUMMARY_KEEP_TURNS messages is replaced in the prompt by a cached
+    summary. A summary is keyed by the session id and a hash of the whole prefix it replaces,
+    so two conversations never share one. Prefixes come from the same window of
+    CLARUS_HISTORY_TURNS messages the session keeps. After each answer the summary for the
+    next turn is built in a background thread from the previous summary plus the messages
+    that follow the part of its prefix still in the window.
+    """
+
+    namespace = "summaries"
+
+    def __init__(self) -> None:
+        self._building: set = set()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return CLARUS_SUMMARY_THRESHOLD > 0 and sessions.enabled
+
+    @staticmethod
+    def key(session_id: str, prefix: List[Dict[str, str]]) -> str:
+        return content_version([session_id, [[msg["role"], msg["content"]] for msg in prefix]])
+
+    @staticmethod
+    def window(turns: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """The turns a session keeps, which is what the next request's history will be."""
+        return turns[-CLARUS_HISTORY_TURNS:] if CLARUS_HISTORY_TURNS else []
+
+    @staticmethod
+    def split(turns: List[Dict[str, str]]) -> Optional[List[Dict[str, str]]]:
+        """The prefix to summarize, or None while the history is under the threshold."""
+        if sum(estimate_tokens(msg["content"]) + MESSAGE_OVERHEAD_TOKENS for msg in turns) <= CLARUS_SUMMARY_THRESHOLD:
+            return None
+        prefix = turns[:-CLARUS_SUMMARY_KEEP_TURNS]
+        return prefix or None
+
+    def lookup(self, session_id: Any, turns: List[Dict[str, str]]) -> Optional[Tuple[List[Dict[str, str]], str]]:
+        if not self.enabled or not session_id:
+            return None
+        prefix = self.split(self.window(turns))
+        summary = cache.get(self.namespace, self.key(session_id, prefix)) if prefix else None
+        return (prefix, summary) if summary else None
+
+    def schedule(self, data: Dict[str, Any], question: str, answer: str) -> None:
+        """Build the summary the next turn will look up, unless it exists or is being built."""
+        session_id = data.get("sessionId")
+        if not self.enabled or not answer or not session_id:
+            return
+        current = history_turns(data.get("history"))
+        upcoming = current + [
+            {"role": "user", "content": trim_text(question, 1400)},
+            {"role": "assistant", "content": trim_text(answer, 1400)},
+        ]
+        prefix = self.split(self.window(upcoming))
+        if not prefix:
+            return
+        key = self.key(session_id, prefix)
+        with self._lock:
+            if key in self._building or cache.get(self.namespace, key) is not None:
+                return
+            self._building.add(key)
+        previous = self.lookup(session_id, current)
+        threading.Thread(
+            target=self._build,
+            args=(key, prefix, previous, session_id),
+            name="clarus-summary",
+            daemon=True,
+        ).start()
+
+    def _build(
+        self,
+        key: str,
+        prefix: List[Dict[str, str]],
+        previous: Optional[Tuple[List[Dict[str, str]], str]],
+        session_id: Optional[str],
+    ) -> None:
+        started = time.perf_counter()
+        try:
+            covered = 0
+            parts = []
+            if previous:
+                previous_prefix, previous_summary = previous
+                # The window may have slid: the new prefix starts somewhere inside the old one.
+                covered = next(
+                    (len(previous_prefix) - start for start in range(len(previous_prefix))
+                     if prefix[:len(previous_prefix) - start] == previous_prefix[start:]),
+                    0,
+                )
+                if covered:
+                    parts.append(f"Summary so far:\n{previous_summary}")
+            lines = [
+                f"{'Reader' if msg['role'] == 'user' else 'Clarus'}: {msg['content']}"
+                for msg in prefix[covered:]
+            ]
+            parts.append("Messages to add:\n" + "\n\n".join(lines))
+            result = create_completion(
+                [{"role": "system", "content": SUMMARY_PROMPT}, {"role": "user", "content": "\n\n".join(parts)}],
+                route=SUMMARY_ROUTE,
+            )
+            summary = (result.get("answer") or "").strip()
+            if summary:
+                cache.set(self.namespace, key, summary, max(CLARUS_SESSION_LIMIT, 1), ttl=CLARUS_SESSION_TTL)
+            append_log({
+                "id": str(uuid.uuid4()),
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "sessionId": session_id,
+                "model": result["model"],
+                "route": SUMMARY_ROUTE["name"],
+                "usage": result.get("usage", {}),
+                "cachedTokens": cached_tokens(result.get("usage", {})),
+                "summarizedTurns": len(prefix),
+                "latencyMs": elapsed_ms(started),
+                "status": "summarized",
+            })
+        except Exception as exc:
+            logger.warning("Could not summarize Clarus history: %s", exc)
+        finally:
+            with self._lock:
+                self._building.discard(key)
+
+
+summaries = HistorySummaries()
+
+
+def normalize_question(question: str) -> str:
+    return re.sub(r"\s+", " ", fold_text(question)).strip(" ?!.")
+
+
+def has_history(data: Dict[str, Any]) -> bool:
+    history = data.get("history")
+    return isinstance(history, list) and any(
+        isinstance(msg, dict) and msg.get("role") in {"user", "assistant"} for msg in history
+    )
+
+
+def request_fingerprint(data: Dict[str, Any], language: str, context: Dict[str, Any]) -> Optional[str]:
+    """Identify interchangeable first questions; follow-ups depend on the conversation."""
+    if has_history(data):
+        return None
+    return content_version([
+        normalize_question(data.get("vraag", "")),
+        language,
+        trim_text(str(data.get("contextType", "essay")), 40),
+        context.get("essayVersion"),
+        context.get("corpusVersion"),
+    ])
+
+
+def replay_tokens(answer: str) -> List[str]:
+    return re.findall(r"\S+\s*|\s+", answer)
+
+
+class InFlightCall:
+    """One upstream streaming call whose events are fanned out to every attached request.
+
+    The call runs in a background thread so it survives any single client going away. Each
+    attached request follows the shared event list from the start, so latecomers first catch
+    up on tokens already produced and then receive new ones as they arrive. Once every
+    attached request has detached before the call finished, the upstream stream is closed.
+    """
+
+    def __init__(self, key: str, leader_log_id: str) -> None:
+        self.key = key
+        self.leader_log_id = leader_log_id
+        self.events: List[Tuple[str, Dict[str, Any]]] = []
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[BaseException] = None
+        self.done = False
+        self.attached: set = set()
+        self.abandoned = False
+        self._condition = threading.Condition()
+
+    def start(self, factory: Any) -> None:
+        threading.Thread(target=self._run, args=(factory,), name="clarus-flight", daemon=True).start()
+
+    def _run(self, factory: Any) -> None:
+        result = None
+        error: Optional[BaseException] = None
+        try:
+            stream = factory()
+            while True:
+                if self.abandoned:
+                    stream.close()
+                    raise RuntimeError("Every client left before the answer was finished.")
+                try:
+                    event, payload = next(stream)
+                except StopIteration as done:
+                    result = done.value
+                    break
+                if event in {"heartbeat", "flush"}:
+                    continue  # Every follower paces its own reader.
+                with self._condition:
+                    self.events.append((event, payload))
+                    self._condition.notify_all()
+        except Exception as exc:
+            error = exc
+        finally:
+            flights.release(self)
+            with self._condition:
+                self.result = result
+                self.error = error
+                self.done = True
+                self._condition.notify_all()
+
+    def fail(self, error: BaseException) -> None:
+        """Finish a call that was never started, so requests that joined it stop waiting."""
+        with self._condition:
+            self.error = error
+            self.done = True
+            self._condition.notify_all()
+        flights.release(self)
+
+    def detach(self, log_id: str) -> None:
+        with self._condition:
+            self.attached.discard(log_id)
+            if self.attached or self.done:
+                return
+            self.abandoned = True
+        flights.release(self)
+
+    def follow(self, timeout: float = CLARUS_COALESCE_WAIT):
+        """Yield the call's events like stream_completion and return its result."""
+        deadline = time.monotonic() + timeout
+        flush_at: Optional[float] = None
+        index = 0
+        while True:
+            with self._condition:
+                while index >= len(self.events) and not self.done:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError("Coalesced Clarus call did not finish in time.")
+                    wait = min(remaining, CLARUS_HEARTBEAT_MS / 1000)
+                    if flush_at is not None:
+                        wait = min(wait, max(flush_at - time.monotonic(), 0.0))
+                    if not self._condition.wait(wait):
+                        break
+                pending = self.events[index:]
+                index += len(pending)
+                finished = self.done and index >= len(self.events)
+            if not pending and not finished:
+                yield idle_event(flush_at)
+                flush_at = None
+            for event in pending:
+                if event[0] == "token" and flush_at is None:
+                    flush_at = next_flush_at()
+                yield event
+            if finished:
+                if self.error is not None:
+                    raise self.error
+                return self.result
+
+
+class SingleFlight:
+    def __init__(self) -> None:
+        self._calls: Dict[str, InFlightCall] = {}
+        self._lock = threading.Lock()
+
+    def join(self, key: str, log_id: str) -> InFlightCall:
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None or call.abandoned:
+                call = self._calls[key] = InFlightCall(key, log_id)
+            with call._condition:
+                call.attached.add(log_id)
+            return call
+
+    def active(self, key: str) -> bool:
+        with self._lock:
+            call = self._calls.get(key)
+            return call is not None and not call.abandoned
+
+    def release(self, call: InFlightCall) -> None:
+        with self._lock:
+            if self._calls.get(call.key) is call:
+                del self._calls[call.key]
+
+
+flights = SingleFlight()
+
+
+class StreamSlots:
+    """Per-process cap on open model streams (CLARUS_MAX_STREAMS, 0 means unlimited).
+
+    Under the gevent profile threading primitives are cooperative, so this bounds how many
+    greenlets hold an upstream connection without blocking the others.
+    """
+
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self.active = 0
+        self.rejected = 0
+        self.cancelled = 0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> bool:
+        with self._lock:
+            if self.limit and self.active >= self.limit:
+                self.rejected += 1
+                return False
+            self.active += 1
+            return True
+
+    def release(self) -> None:
+        with self._lock:
+            self.active = max(self.active - 1, 0)
+
+    def record_cancel(self) -> None:
+        with self._lock:
+            self.cancelled += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"active": self.active, "limit": self.limit, "rejected": self.rejected, "cancelled": self.cancelled}
+
+
+stream_slots = StreamSlots(CLARUS_MAX_STREAMS)
+
+
+def refill_bucket(tokens: float, updated: float, now: float) -> float:
+    return min(float(CLARUS_RATE_BURST), tokens + (now - updated) * CLARUS_RATE_PER_MINUTE / 60)
+
+
+def bucket_wait(tokens: float) -> float:
+    """Seconds until a bucket holding `tokens` has a whole token again."""
+    return (1 - tokens) * 60 / CLARUS_RATE_PER_MINUTE
+
+
+class MemoryAdmission:
+    """Admission state for one process: model-call slots, their wait queue and rate buckets."""
+
+    shared = False
+    bucket_limit = 10000
+
+    def __init__(self) -> None:
+        self.active = 0
+        self.waiting = 0
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._condition = threading.Condition()
+
+    def take_token(self, key: str) -> float:
+        now = time.time()
+        with self._condition:
+            tokens, updated = self._buckets.pop(key, (float(CLARUS_RATE_BURST), now))
+            tokens = refill_bucket(tokens, updated, now)
+            wait = 0.0 if tokens >= 1 else bucket_wait(tokens)
+            self._buckets[key] = (tokens - 1 if not wait else tokens, now)
+            while len(self._buckets) > self.bucket_limit:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def acquire(self, timeout: float) -> Optional[str]:
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            if self.active >= CLARUS_MAX_INFLIGHT:
+                if self.waiting >= CLARUS_ADMISSION_QUEUE:
+                    return None
+                self.waiting += 1
+                try:
+                    while self.active >= CLARUS_MAX_INFLIGHT:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            return None
+                        self._condition.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            self.active += 1
+            return "slot"
+
+    def release(self, slot: str) -> None:
+        with self._condition:
+            self.active = max(self.active - 1, 0)
+            self._condition.notify()
+
+    def state(self) -> Dict[str, int]:
+        with self._condition:
+            return {"active": self.active, "waiting": self.waiting}
+
+
+class SQLiteAdmission:
+    """Admission state shared by every worker on the host through one SQLite file.
+
+    Slots and waiters are rows with a timestamp, so a worker that dies while holding one only
+    blocks it until the lease runs out. Waiters poll, since SQLite cannot notify them.
+    """
+
+    shared = True
+    poll_seconds = 0.05
+    lease_seconds = CLARUS_TOTAL_MS / 1000 + 60
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._local = threading.local()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        db = self._connect()
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)")
+        db.execute("CREATE TABLE IF NOT EXISTS slots (id TEXT PRIMARY KEY, kind TEXT NOT NULL, since REAL NOT NULL)")
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None or getattr(self._local, "pid", None) != os.getpid():
+            connection = sqlite3.connect(str(self.path), timeout=5, isolation_level=None)
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA busy_timeout=5000")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _transaction(self, work: Any) -> Any:
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            result = work(db)
+            db.execute("COMMIT")
+            return result
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+    def take_token(self, key: str) -> float:
+        now = time.time()
+
+        def take(db: sqlite3.Connection) -> float:
+            row = db.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens = refill_bucket(*(row or (float(CLARUS_RATE_BURST), now)), now)
+            wait = 0.0 if tokens >= 1 else bucket_wait(tokens)
+            db.execute(
+                "INSERT INTO buckets VALUES (?, ?, ?)"
+                " ON CONFLICT (key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                (key, tokens - 1 if not wait else tokens, now),
+            )
+            if not row:
+                # A full bucket carries no state, so old ones can go.
+                db.execute("DELETE FROM buckets WHERE updated < ?", (now - 60 * CLARUS_RATE_BURST / max(CLARUS_RATE_PER_MINUTE, 1) - 60,))
+            return wait
+
+        return self._transaction(take)
+
+    def acquire(self, timeout: float) -> Optional[str]:
+        slot_id = uuid.uuid4().hex
+        deadline = time.monotonic() + timeout
+        queued = False
+
+        def attempt(db: sqlite3.Connection) -> str:
+            now = time.time()
+            db.execute("DELETE FROM slots WHERE since < ?", (now - self.lease_seconds,))
+            active = db.execute("SELECT COUNT(*) FROM slots WHERE kind = 'active'").fetchone()[0]
+            if active < CLARUS_MAX_INFLIGHT:
+                db.execute("INSERT OR REPLACE INTO slots VALUES (?, 'active', ?)", (slot_id, now))
+                return "admitted"
+            if queued:
+                return "queued"
+            waiting = db.execute("SELECT COUNT(*) FROM slots WHERE kind = 'waiting'").fetchone()[0]
+            if waiting >= CLARUS_ADMISSION_QUEUE:
+                return "full"
+            db.execute("INSERT INTO slots VALUES (?, 'waiting', ?)", (slot_id, now))
+            return "queued"
+
+        while True:
+            outcome = self._transaction(attempt)
+            if outcome == "admitted":
+                return slot_id
+            if outcome == "full":
+                return None
+            queued = True
+            if time.monotonic() >= deadline:
+                self.release(slot_id)
+                return None
+            time.sleep(self.poll_seconds)
+
+    def release(self, slot: str) -> None:
+        self._connect().execute("DELETE FROM slots WHERE id = ?", (slot,))
+
+    def state(self) -> Dict[str, int]:
+        rows = dict(self._connect().execute("SELECT kind, COUNT(*) FROM slots GROUP BY kind").fetchall())
+        return {"active": rows.get("active", 0), "waiting": rows.get("waiting", 0)}
+
+
+class AdmissionController:
+    """Per-client rate limits and a host-wide cap on concurrent model calls.
+
+    Every chat request takes a token from the bucket of its client (`get_ip_hash`); requests
+    that reach the model also need one of CLARUS_MAX_INFLIGHT slots, waiting at most
+    CLARUS_ADMISSION_WAIT_MS in a queue of CLARUS_ADMISSION_QUEUE. Both limits answer at once
+    with the wait in Retry-After instead of letting requests pile up behind the workers.
+    """
+
+    def __init__(self) -> None:
+        self.backend = self._create_backend()
+        self.rate_limited = 0
+        self.shed = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _create_backend() -> Any:
+        if CLARUS_ADMISSION_BACKEND == "sqlite":
+            try:
+                return SQLiteAdmission(CLARUS_ADMISSION_PATH)
+            except Exception as exc:
+                logger.warning("Shared Clarus admission state is not available, using memory: %s", exc)
+        return MemoryAdmission()
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def check_rate(self) -> float:
+        """Seconds the client has to wait, or 0 when the request may proceed."""
+        if not CLARUS_RATE_PER_MINUTE:
+            return 0.0
+        try:
+            wait = self.backend.take_token(client_key())
+        except Exception as exc:  # Admission must never take the chat down with it.
+            logger.warning("Clarus rate limit check failed: %s", exc)
+            return 0.0
+        if wait:
+            self._count("rate_limited")
+        return wait
+
+    def acquire(self) -> Optional[str]:
+        """A slot for one model call; "" when the cap is off and None when the request is shed."""
+        if not CLARUS_MAX_INFLIGHT:
+            return ""
+        try:
+            slot = self.backend.acquire(CLARUS_ADMISSION_WAIT_MS / 1000)
+        except Exception as exc:
+            logger.warning("Clarus admission failed: %s", exc)
+            return ""
+        if slot is None:
+            self._count("shed")
+        return slot
+
+    def release(self, slot: Optional[str]) -> None:
+        if not slot:
+            return
+        try:
+            self.backend.release(slot)
+        except Exception as exc:
+            logger.warning("Could not release Clarus admission slot: %s", exc)
+
+    def stats(self) -> Dict[str, Any]:
+        try:
+            state = self.backend.state()
+        except Exception:
+            state = {}
+        return {
+            "backend": type(self.backend).__name__,
+            "limit": CLARUS_MAX_INFLIGHT,
+            **state,
+            "rateLimited": self.rate_limited,
+            "shed": self.shed,
+        }
+
+
+admission = AdmissionController()
+
+
+def rate_limited_response(wait: float):
+    seconds = max(int(math.ceil(wait)), 1)
+    response = jsonify({"error": f"Je stelt te snel vragen. Probeer het over {seconds} seconden opnieuw."})
+    response.headers["Retry-After"] = str(seconds)
+    return response, 429
+
+
+def busy_response():
+    response = jsonify({"error": "Clarus is even te druk. Probeer het zo opnieuw."})
+    response.headers["Retry-After"] = "5"
+    return response, 503
+
+
+class CallSlot:
+    """Capacity held by a request that opens an upstream model call.
+
+    That is one admission slot and, for streams, one of the CLARUS_MAX_STREAMS slots.
+    Coalesced followers open no call and hold nothing. release() may be called more than once.
+    """
+
+    def __init__(self, stream: bool) -> None:
+        self.stream = stream
+        self.slot: Optional[str] = None
+        self.held = False
+
+    def acquire(self) -> bool:
+        slot = admission.acquire()
+        if slot is None:
+            return False
+        if self.stream and not stream_slots.acquire():
+            admission.release(slot)
+            return False
+        self.slot = slot
+        self.held = True
+        return True
+
+    def release(self) -> None:
+        if not self.held:
+            return
+        self.held = False
+        if self.stream:
+            stream_slots.release()
+        admission.release(self.slot)
+
+
+def open_call(fingerprint: Optional[str], log_id: str, capacity: CallSlot) -> Optional[Tuple[Optional[InFlightCall], bool]]:
+    """Join the single-flight call for `fingerprint` or lead a new one; None when shed.
+
+    Capacity is taken only by the leader and by uncoalesced requests, so a spike of identical
+    questions costs one slot however many requests follow it.
+    """
+    coalesce = bool(CLARUS_COALESCE and fingerprint)
+    if not (coalesce and flights.active(fingerprint)) and not capacity.acquire():
+        return None
+    flight = flights.join(fingerprint, log_id) if coalesce else None
+    leader = flight is None or flight.leader_log_id == log_id
+    if not leader:
+        capacity.release()
+    elif not capacity.held and not capacity.acquire():
+        # The call this request meant to follow finished in between and it became the leader.
+        flight.fail(RuntimeError("Clarus was too busy to answer."))
+        return None
+    return flight, leader
+
+
+def drain(stream: Any) -> Any:
+    while True:
+        try:
+            next(stream)
+        except StopIteration as done:
+            return done.value
+
+
+DEEP_TOPIC_TERMS = {
+    "argument",
+    "archive",
+    "admin",
+    "assumption",
+    "begrijpen",
+    "belief",
+    "beheerder",
+    "conscience",
+    "clarus",
+    "degrondvraag",
+    "ethic",
+    "ethical",
+    "ethics",
+    "essay",
+    "essays",
+    "feedback",
+    "fits",
+    "evil",
+    "existential",
+    "faith",
+    "freedom",
+    "god",
+    "justice",
+    "meaning",
+    "moral",
+    "morality",
+    "philosophy",
+    "recommend",
+    "recommendation",
+    "religion",
+    "religious",
+    "site",
+    "responsibility",
+    "suffering",
+    "truth",
+    "value",
+    "website",
+    "understand",
+    "waarheid",
+    "waarde",
+    "waarden",
+    "verantwoordelijkheid",
+    "vrijheid",
+    "geloof",
+    "religie",
+    "filosofie",
+    "moreel",
+    "moraal",
+    "ethiek",
+    "ethisch",
+    "existentieel",
+    "betekenis",
+    "lijden",
+    "kwaad",
+    "rechtvaardigheid",
+    "aanraden",
+    "aanbevelen",
+    "archief",
+}
+
+OFF_TOPIC_PATTERNS = [
+    r"\bpython\b",
+    r"\bjavascript\b",
+    r"\btypescript\b",
+    r"\breact\b",
+    r"\bhtml\b",
+    r"\bcss\b",
+    r"\bcalculator\b",
+    r"\brekenmachine\b",
+    r"\bcode\b",
+    r"\bscript\b",
+    r"\bfunction\b",
+    r"\bdebug\b",
+    r"\binstall\b",
+    r"\bdeploy\b",
+    r"\brecipe\b",
+    r"\brecept\b",
+    r"\btravel\b",
+    r"\breis\b",
+    r"\bshopping\b",
+    r"\bkopen\b",
+    r"\bmarketing\b",
+    r"\bworkout\b",
+    r"\bfitness\b",
+    r"\bstock\b",
+    r"\bcrypto\b",
+    r"\bemail\b",
+    r"\bresume\b",
+    r"\bcv\b",
+    r"\bmake me\b",
+    r"\bbuild me\b",
+    r"\bwrite me\b",
+    r"\bmaak een\b",
+    r"\bschrijf een\b",
+    r"\bbouw een\b",
+]
+
+
+DUTCH_MARKERS = {"wat", "waarom", "hoe", "essay", "vraag", "bedoelt", "kun", "niet", "wel"}
+QUESTION_SCAN_CHARS = 1800
+
+# OFF_TOPIC_PATTERNS stays the readable source of truth; it is compiled once into keyword
+# and phrase sets so the guard scans the question's tokens a single time.
+OFF_TOPIC_KEYWORDS = {pattern[2:-2] for pattern in OFF_TOPIC_PATTERNS if " " not in pattern}
+OFF_TOPIC_PHRASES = {tuple(pattern[2:-2].split(" ")) for pattern in OFF_TOPIC_PATTERNS if " " in pattern}
+PRACTICAL_TRIGGERS = {
+    ("how", "do", "i"),
+    ("how", "to"),
+    ("can", "you"),
+    ("could", "you"),
+    ("please",),
+    ("maak",),
+    ("hoe", "maak"),
+    ("kun", "je"),
+    ("kan", "je"),
+}
+PRACTICAL_ACTIONS = {
+    "make", "build", "write", "create", "fix", "debug", "install", "deploy", "cook", "buy", "earn",
+    "maak", "bouw", "schrijf", "repareer", "installeer",
+}
+PHRASE_STARTS: Dict[str, List[Tuple[str, ...]]] = {}
+for _phrase in sorted(OFF_TOPIC_PHRASES | PRACTICAL_TRIGGERS, key=len):
+    PHRASE_STARTS.setdefault(_phrase[0], []).append(_phrase)
+_QUESTION_WORD_PATTERN = re.compile(r"\w+")
+
+
+@timed("classify_question")
+def classify_question(question: str, language_hint: str = "") -> Dict[str, Any]:
+    """Detect language and scope from one tokenization of the question.
+
+    Single keywords are set lookups. Phrases and the practical-request rule (a trigger phrase
+    followed anywhere later by an action verb) are checked in one linear pass that only
+    builds windows at tokens that can start a phrase, so there is no regex backtracking.
+    Only the first QUESTION_SCAN_CHARS characters are scanned (the model never sees more),
+    which bounds the worst case regardless of input.
+    """
+    text = (question or "")[:QUESTION_SCAN_CHARS].lower()
+    tokens = _QUESTION_WORD_PATTERN.findall(text)
+
+    words = set(tokens)
+    has_deep_context = not words.isdisjoint(DEEP_TOPIC_TERMS)
+    has_dutch_marker = not words.isdisjoint(DUTCH_MARKERS)
+    off_topic_keyword = not words.isdisjoint(OFF_TOPIC_KEYWORDS)
+    practical_request = False
+    if not has_deep_context and not off_topic_keyword and not words.isdisjoint(PHRASE_STARTS):
+        trigger_end: Optional[int] = None
+        for position, token in enumerate(tokens):
+            if trigger_end is not None and position >= trigger_end and token in PRACTICAL_ACTIONS:
+                practical_request = True
+                break
+            for phrase in PHRASE_STARTS.get(token, ()):
+                if tuple(tokens[position:position + len(phrase)]) != phrase:
+                    continue
+                if phrase in OFF_TOPIC_PHRASES:
+                    off_topic_keyword = True
+                if phrase in PRACTICAL_TRIGGERS and trigger_end is None:
+                    trigger_end = position + len(phrase)
+            if off_topic_keyword:
+                break
+
+    if language_hint in {"nl", "en"}:
+        language = language_hint
+    else:
+        language = "nl" if has_dutch_marker else "en"
+    return {
+        "language": language,
+        "offTopic": bool(text) and not has_deep_context and (off_topic_keyword or practical_request),
+        "hasDeepContext": has_deep_context,
+        "tokens": tokens,
+    }
+
+
+def is_off_topic(question: str) -> bool:
+    return classify_question(question)["offTopic"]
+
+
+def scope_redirect(language: str) -> str:
+    if language == "nl":
+        return (
+            "Dat valt buiten mijn taak. Stel een vraag over het essay, een moreel begrip "
+            "of een existentieel bezwaar."
+        )
+    return (
+        "That falls outside my task. Ask about the essay, a moral concept or an existential objection."
+    )
+
+
+# Fixed-rule questions from SYSTEM_PROMPT and ABOUT_CLARUS that can be answered without a model
+# call. Each intent lists cue phrases; a question only matches when a cue is present and the
+# cue plus filler words cover at least CLARUS_INTENT_THRESHOLD of its tokens.
+INTENT_CUES = {
+    "identity": {
+        "en": [
+            ("who", "made", "you"), ("who", "created", "you"), ("who", "built", "you"),
+            ("who", "programmed", "you"), ("who", "made", "this"), ("who", "built", "this"),
+            ("who", "created", "this"), ("who", "owns"), ("who", "runs"), ("who", "maintains"),
+            ("who", "is", "the", "admin"), ("who", "is", "the", "administrator"),
+            ("who", "is", "the", "author"), ("who", "is", "the", "owner"), ("who", "is", "the", "creator"),
+            ("who", "is", "behind"), ("who", "wrote", "the", "essays"),
+        ],
+        "nl": [
+            ("wie", "heeft", "je"), ("wie", "heeft", "jou"), ("wie", "heeft", "deze"), ("wie", "maakte"),
+            ("wie", "bouwde"), ("wie", "beheert"), ("wie", "schreef"), ("wie", "zit", "achter"),
+            ("wie", "is", "de", "beheerder"), ("wie", "is", "de", "maker"), ("wie", "is", "de", "auteur"),
+            ("wie", "is", "de", "eigenaar"), ("wie", "is", "de", "schrijver"),
+        ],
+    },
+    "about": {
+        "en": [
+            ("what", "is", "clarus"), ("who", "is", "clarus"), ("who", "are", "you"),
+            ("what", "are", "you"), ("what", "can", "you", "do"),
+        ],
+        "nl": [
+            ("wat", "is", "clarus"), ("wie", "is", "clarus"), ("wie", "ben", "je"), ("wie", "ben", "jij"),
+            ("wat", "ben", "je"), ("wat", "ben", "jij"), ("wat", "kun", "je"), ("wat", "kan", "je"),
+        ],
+    },
+    "feedback": {
+        "en": [
+            ("leave", "feedback"), ("give", "feedback"), ("send", "feedback"), ("report", "a", "bug"),
+            ("report", "an", "error"),
+        ],
+        "nl": [
+            ("feedback", "geven"), ("feedback", "achterlaten"), ("bug", "melden"), ("fout", "melden"),
+        ],
+    },
+}
+# Deliberately much smaller than STOPWORDS: "who made you and what about evil" must not match.
+INTENT_FILLER = {
+    "a", "an", "the", "this", "is", "i", "you", "can", "where", "made", "built", "created", "site",
+    "website", "clarus", "degrondvraag", "com", "s", "actually", "exactly", "really", "hi", "hello",
+    "hey", "please", "thanks", "ok",
+    "een", "de", "het", "deze", "dit", "ik", "je", "jij", "kan", "waar", "gemaakt", "gebouwd",
+    "eigenlijk", "precies", "hoi", "hallo", "graag", "bedankt", "oke",
+}
+INTENT_MAX_TOKENS = 14
+INTENT_ANSWERS = {
+    "identity": {
+        "nl": (
+            "De site is gebouwd en wordt beheerd door een private beheerder en auteur. Diens identiteit "
+            "is bewust geen deel van de publieke ervaring; ik mag die niet prijsgeven of afleiden. "
+            "Meestal is de vraag ook minder relevant dan de argumenten zelf: wat beweert het essay, "
+            "en overtuigt dat?"
+        ),
+        "en": (
+            "The site was built and is maintained by a private administrator and author. That identity "
+            "is intentionally not part of the public experience, and I am not permitted to disclose or "
+            "infer it. The question is usually less relevant than the arguments themselves: what does "
+            "the essay claim, and does it convince?"
+        ),
+    },
+    "about": {language: about["body"] for language, about in ABOUT_CLARUS.items()},
+    "feedback": {
+        "nl": (
+            "Dank voor het melden. Kritiek op de site, een fout, een ontwerpkeuze of een suggestie "
+            "kun je anoniem achterlaten op de feedbackpagina; daar wordt het daadwerkelijk gelezen."
+        ),
+        "en": (
+            "Thank you for raising it. Criticism of the site, a bug, a design choice or a suggestion "
+            "can be left anonymously on the feedback page, where it is actually read."
+        ),
+    },
+}
+
+
+def match_intent(tokens: List[str]) -> Optional[Dict[str, Any]]:
+    """Return the best fixed-rule intent for a tokenized question, or None if it is ambiguous."""
+    if not tokens or len(tokens) > INTENT_MAX_TOKENS:
+        return None
+    best: Optional[Dict[str, Any]] = None
+    for intent, languages in INTENT_CUES.items():
+        covered = set()
+        cue_language = None
+        for language, cues in languages.items():
+            for cue in cues:
+                width = len(cue)
+                for position in range(len(tokens) - width + 1):
+                    if tuple(tokens[position:position + width]) == cue:
+                        covered.update(range(position, position + width))
+                        cue_language = cue_language or language
+        if not covered:
+            continue
+        matched = sum(1 for position, token in enumerate(tokens) if position in covered or token in INTENT_FILLER)
+        confidence = round(matched / len(tokens), 2)
+        if best is None or confidence > best["confidence"]:
+            best = {"intent": intent, "language": cue_language, "confidence": confidence}
+        elif confidence == best["confidence"]:
+            # Two intents explain the question equally well; let the model decide.
+            best["intent"] = None
+    if best is None or best["intent"] is None or best["confidence"] < CLARUS_INTENT_THRESHOLD:
+        return None
+    return best
+
+
+def local_answer(verdict: Dict[str, Any], language_hint: str = "") -> Optional[Dict[str, Any]]:
+    """Answer without a model call when the scope guard refuses or a fixed-rule intent matches."""
+    if verdict["offTopic"]:
+        return {"answer": scope_redirect(verdict["language"]), "model": "scope-guard", "status": "refused_off_topic"}
+    if not CLARUS_INTENTS:
+        return None
+    match = match_intent(verdict["tokens"])
+    if match is None:
+        return None
+    # The matched cue is a better language signal than DUTCH_MARKERS for these short questions.
+    language = language_hint if language_hint in {"nl", "en"} else match["language"]
+    answers = INTENT_ANSWERS[match["intent"]]
+    return {
+        "answer": answers[language],
+        "model": "intent-router",
+        "status": "answered_intent",
+        "intent": match["intent"],
+        "intentConfidence": match["confidence"],
+    }
+
+
+
+# Output budgets per question depth. CLARUS_ROUTES can override any field of any route as JSON,
+# for example {"deep": {"models": ["gpt-5.4-mini"], "maxOutputTokens": 900}}.
+ROUTE_OUTPUT_CEILING = 1200
+DEFAULT_ROUTES: Dict[str, Dict[str, Any]] = {
+    "brief": {"models": [CLARUS_MODEL, CLARUS_FALLBACK_MODEL], "maxOutputTokens": min(CLARUS_MAX_OUTPUT_TOKENS, 220)},
+    "standard": {"models": [CLARUS_MODEL, CLARUS_FALLBACK_MODEL], "maxOutputTokens": CLARUS_MAX_OUTPUT_TOKENS},
+    "corpus": {"models": [CLARUS_MODEL, CLARUS_FALLBACK_MODEL], "maxOutputTokens": CLARUS_MAX_OUTPUT_TOKENS},
+    "deep": {"models": [CLARUS_FALLBACK_MODEL, CLARUS_MODEL], "maxOutputTokens": 900},
+}
+DEPTH_REQUEST_PHRASES = {
+    ("in", "depth"), ("in", "detail"), ("full", "analysis"), ("thorough",), ("thoroughly",),
+    ("elaborate",), ("comprehensive",), ("step", "by", "step"), ("long", "explanation"),
+    ("uitgebreid",), ("uitgebreide",), ("diepgaand",), ("diepgaande",), ("grondig",), ("grondige",),
+    ("uitvoerig",), ("uitvoerige",), ("volledige", "analyse"), ("stap", "voor", "stap"),
+}
+DEFINITION_STARTS = {
+    ("what", "is"), ("what", "are"), ("what", "does"), ("define",), ("definition",),
+    ("wat", "is"), ("wat", "zijn"), ("wat", "betekent"), ("wat", "bedoelt"), ("definieer",),
+}
+BRIEF_MAX_TOKENS = 10
+DEEP_MIN_TOKENS = 24
+DEEP_MIN_TERMS = 3
+
+
+def load_routes() -> Dict[str, Dict[str, Any]]:
+    routes = {}
+    for name, defaults in DEFAULT_ROUTES.items():
+        override = CLARUS_ROUTES.get(name) or {}
+        models = [model for model in override.get("models", defaults["models"]) if model]
+        tokens = int(override.get("maxOutputTokens", defaults["maxOutputTokens"]))
+        routes[name] = {
+            "name": name,
+            "models": list(dict.fromkeys(models)),
+            "maxOutputTokens": min(max(tokens, 16), ROUTE_OUTPUT_CEILING),
+        }
+    return routes
+
+
+ROUTES = load_routes()
+SUMMARY_ROUTE = {
+    "name": "summary",
+    "models": list(dict.fromkeys(model for model in [CLARUS_MODEL, CLARUS_FALLBACK_MODEL] if model)),
+    "maxOutputTokens": CLARUS_SUMMARY_MAX_TOKENS,
+}
+
+
+def route_question(verdict: Dict[str, Any], context: Dict[str, Any]) -> Dict[str, Any]:
+    """Pick a route from local signals: explicit depth requests, corpus context, question shape."""
+    tokens = verdict["tokens"]
+    for width in (1, 2, 3):
+        if any(tuple(tokens[i:i + width]) in DEPTH_REQUEST_PHRASES for i in range(len(tokens) - width + 1)):
+            return ROUTES["deep"]
+    if context.get("corpus"):
+        return ROUTES["corpus"]
+    if len(tokens) <= BRIEF_MAX_TOKENS and (tuple(tokens[:2]) in DEFINITION_STARTS or tuple(tokens[:1]) in DEFINITION_STARTS):
+        return ROUTES["brief"]
+    if len(tokens) >= DEEP_MIN_TOKENS and len(DEEP_TOPIC_TERMS.intersection(tokens)) >= DEEP_MIN_TERMS:
+        return ROUTES["deep"]
+    return ROUTES["standard"]
+
+
+MESSAGE_OVERHEAD_TOKENS = 4
+# Static instructions go first as one byte-stable message so the provider's prefix cache can
+# reuse them across every request; per-essay, per-corpus and per-conversation content follow.
+STATIC_PROMPT = f"{SYSTEM_PROMPT}\n\nProject context:\n{PROJECT_CONTEXT}"
+STATIC_PROMPT_TOKENS = estimate_tokens(STATIC_PROMPT) + MESSAGE_OVERHEAD_TOKENS
+CORPUS_HEADER = (
+    "Public essay archive supplied by the frontend, narrowed to the essays that best "
+    "match the question. Use this bounded corpus for archive navigation and essay "
+    "recommendations. Recommend only essays listed here and include the supplied path "
+    "when useful.\n\n"
+)
+
+
+def input_token_budget(model: str) -> int:
+    return int(CLARUS_MODEL_TOKEN_BUDGETS.get(model, CLARUS_INPUT_TOKEN_BUDGET))
+
+
+@timed("build_messages")
+def build_messages(
+    data: Dict[str, Any],
+    context: Optional[Dict[str, Any]] = None,
+    model: Optional[str] = None,
+    language: Optional[str] = None,
+) -> List[Dict[str, str]]:
+    """Assemble the prompt within the model's input-token budget.
+
+    The system prompt, project context and question are always sent. Essay passages, corpus
+    blocks and history turns compete for the remaining budget by value, so the least useful
+    pieces (unmatched essay passages, lower-ranked essays, older turns) are dropped first.
+    Routes pass the `language` their classification already found; without it the question
+    is classified here.
+    """
+    context = context if context is not None else resolve_context(data)
+    question = trim_text(data.get("vraag", ""), 1800)
+    language = language or normalize_language(data.get("language", ""), question)
+    context_type = trim_text(str(data.get("contextType", "essay")), 40)
+    essay_title = context["essayTitle"]
+    history = data.get("history", [])
+    query = build_query(question, history)
+    budget = input_token_budget(model or CLARUS_MODEL)
+
+    language_instruction = (
+        "Antwoord in het Nederlands." if language == "nl" else "Answer in English."
+    )
+    request_block = f"{language_instruction}\nFrontend context type: {context_type}"
+    essay_header = (
+        f"Current essay title: {essay_title or 'No single essay selected'}\n\n"
+        f"Current essay text supplied by the frontend:\n"
+    )
+
+    allocation = {
+        "system": STATIC_PROMPT_TOKENS + estimate_tokens(request_block) + MESSAGE_OVERHEAD_TOKENS,
+        "question": estimate_tokens(question) + MESSAGE_OVERHEAD_TOKENS,
+        "essay": estimate_tokens(essay_header) + MESSAGE_OVERHEAD_TOKENS,
+        "corpus": 0,
+        "history": 0,
+    }
+    dropped = {"essay": 0, "corpus": 0, "history": 0}
+
+    # Candidates are (value, section, key, tokens); higher value wins the remaining budget.
+    candidates: List[Tuple[float, str, int, int]] = []
+    essay = context["essay"]
+    if essay:
+        for passage_id, value in rank_essay_passages(essay, query):
+            candidates.append((value, "essay", passage_id, essay["passageTokens"][passage_id]))
+
+    retrieved = retrieve_corpus(context["corpus"], query) if context["corpus"] else []
+    corpus_header_tokens = estimate_tokens(CORPUS_HEADER) + MESSAGE_OVERHEAD_TOKENS
+    for rank, item in enumerate(retrieved):
+        tokens = estimate_tokens(render_corpus_context([item])) + 2
+        candidates.append((700.0 - 40 * rank, "corpus", rank, tokens + (corpus_header_tokens if rank == 0 else 0)))
+
+    turns = history_turns(history[-CLARUS_HISTORY_TURNS:] if isinstance(history, list) and CLARUS_HISTORY_TURNS else [])
+    summarized = summaries.lookup(data.get("sessionId"), history_turns(history)) if turns else None
+    summary_block = ""
+    if summarized:
+        prefix, summary = summarized
+        turns = turns[-CLARUS_SUMMARY_KEEP_TURNS:]
+        summary_block = f"Summary of the earlier conversation:\n{summary}"
+        summary_tokens = estimate_tokens(summary_block) + MESSAGE_OVERHEAD_TOKENS
+        allocation["history"] += summary_tokens
+        replaced = sum(estimate_tokens(msg["content"]) + MESSAGE_OVERHEAD_TOKENS for msg in prefix)
+        context["historySummary"] = {
+            "summarizedTurns": len(prefix),
+            "replacedTokens": replaced,
+            "summaryTokens": summary_tokens,
+            "savedTokens": replaced - summary_tokens,
+        }
+    for age, msg in enumerate(reversed(turns)):
+        tokens = estimate_tokens(msg["content"]) + MESSAGE_OVERHEAD_TOKENS
+        candidates.append((max(950.0 - 100 * age, 150.0), "history", len(turns) - 1 - age, tokens))
+
+    remaining = budget - sum(allocation.values())
+    chosen: Dict[str, List[int]] = {"essay": [], "corpus": [], "history": []}
+    history_closed = False
+    for _, section, key, tokens in sorted(candidates, key=lambda candidate: -candidate[0]):
+        fits = tokens <= remaining and not (section == "history" and history_closed)
+        if section == "corpus" and chosen["corpus"] != list(range(key)):
+            fits = False
+        if not fits:
+            dropped[section] += 1
+            history_closed = history_closed or section == "history"
+            continue
+        chosen[section].append(key)
+        allocation[section] += tokens
+        remaining -= tokens
+
+    essay_text = render_essay_passages(essay, chosen["essay"]) if essay else ""
+    if essay and dropped["essay"]:
+        context["essayPassages"] = sorted(chosen["essay"])
+    included = [retrieved[rank] for rank in sorted(chosen["corpus"])]
+    context["corpusRetrieved"] = [item["id"] or item["title"] for item in included] if retrieved else None
+    context["promptTokens"] = {
+        **allocation,
+        "total": sum(allocation.values()),
+        "budget": budget,
+        "dropped": dropped,
+    }
+
+    messages: List[Dict[str, str]] = [
+        {"role": "system", "content": STATIC_PROMPT},
+        {"role": "system", "content": f"{essay_header}{essay_text or '(none)'}"},
+    ]
+
+    if included:
+        messages.append({"role": "system", "content": f"{CORPUS_HEADER}{render_corpus_context(included)}"})
+
+    if summary_block:
+        messages.append({"role": "system", "content": summary_block})
+    for index in sorted(chosen["history"]):
+        messages.append(turns[index])
+
+    messages.append({"role": "system", "content": request_block})
+    messages.append({"role": "user", "content": question})
+    return messages
+
+
+def prompt_cache_key(context: Dict[str, Any]) -> Optional[str]:
+    """Route requests that share an essay and corpus version to the same provider cache shard."""
+    if CLARUS_PROMPT_CACHE_KEY.lower() in {"", "off", "0", "false"}:
+        return None
+    if CLARUS_PROMPT_CACHE_KEY.lower() != "auto":
+        return CLARUS_PROMPT_CACHE_KEY
+    return "clarus:" + content_version(f"{context.get('essayVersion')}:{context.get('corpusVersion')}")[:16]
+
+
+def cached_tokens(usage: Dict[str, Any]) -> int:
+    details = (usage or {}).get("prompt_tokens_details") or {}
+    return int(details.get("cached_tokens") or 0)
+
+
+def completion_log_fields(result: Dict[str, Any], flight: Optional[Any], leader: bool) -> Dict[str, Any]:
+    """Usage belongs to the request that opened the upstream call; coalesced followers point to it."""
+    if not leader:
+        return {"usage": {}, "cachedTokens": 0, "coalescedWith": flight.leader_log_id}
+    usage = result.get("usage", {})
+    fields = {"usage": usage, "cachedTokens": cached_tokens(usage)}
+    if result.get("attempts"):
+        fields["modelAttempts"] = result["attempts"]
+    return fields
+
+
+def partial_log_fields(context: Dict[str, Any], partial: str, flight: Optional[Any], leader: bool) -> Dict[str, Any]:
+    """Usage for a cancelled stream. The provider sends usage only at the end, so it is estimated."""
+    if not leader:
+        return {"usage": {}, "cachedTokens": 0, "coalescedWith": flight.leader_log_id}
+    usage = {
+        "prompt_tokens": (context.get("promptTokens") or {}).get("total", 0),
+        "completion_tokens": estimate_tokens(partial),
+        "estimated": True,
+    }
+    return {"usage": usage, "cachedTokens": 0}
+
+
+def log_usage(model: str, usage: Dict[str, Any]) -> None:
+    if usage:
+        logger.info(
+            "Clarus usage model=%s prompt=%s cached=%s completion=%s",
+            model,
+            usage.get("prompt_tokens"),
+            cached_tokens(usage),
+            usage.get("completion_tokens"),
+        )
+
+
+def completion_options(cache_key: Optional[str]) -> Dict[str, Any]:
+    return {"prompt_cache_key": cache_key} if cache_key else {}
+
+
+def record_model_call(model: str, route: Dict[str, Any], outcome: str, seconds: float) -> None:
+    metrics.inc("clarus_model_calls_total", model=model, route=route["name"], outcome=outcome)
+    metrics.observe("clarus_model_call_seconds", seconds, model=model, route=route["name"], outcome=outcome)
+
+
+class ModelBreaker:
+    """Circuit breaker for one model over a rolling window of recent calls.
+
+    Closed: calls go through and are recorded. When at least CLARUS_BREAKER_MIN_CALLS calls in
+    the window fail at CLARUS_BREAKER_ERROR_RATE or more, the breaker opens and the model is
+    skipped. After CLARUS_BREAKER_COOLDOWN_SECONDS the next lookup starts one background probe
+    (half-open); a successful probe closes the breaker with a fresh window, a failed one opens
+    it for another cooldown. Lost hedges are not recorded, they say nothing about health.
+    """
+
+    def __init__(self, model: str) -> None:
+        self.model = model
+        self.state = "closed"
+        self.opened_at = 0.0
+        self.calls: "deque[Tuple[float, bool, int]]" = deque()
+        self._lock = threading.Lock()
+
+    def _trim(self, now: float) -> None:
+        while self.calls and self.calls[0][0] < now - CLARUS_BREAKER_WINDOW_SECONDS:
+            self.calls.popleft()
+
+    def record(self, ok: bool, latency_ms: int) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self.calls.append((now, ok, latency_ms))
+            self._trim(now)
+            if self.state != "closed" or len(self.calls) < CLARUS_BREAKER_MIN_CALLS:
+                return
+            failures = sum(1 for _, call_ok, _ in self.calls if not call_ok)
+            if failures / len(self.calls) >= CLARUS_BREAKER_ERROR_RATE:
+                self.state = "open"
+                self.opened_at = now
+                logger.warning("Clarus circuit opened for %s after %s/%s failures", self.model, failures, len(self.calls))
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= CLARUS_BREAKER_COOLDOWN_SECONDS:
+                self.state = "half-open"
+                threading.Thread(target=self._probe, name=f"clarus-probe-{self.model}", daemon=True).start()
+            return False
+
+    def _probe(self) -> None:
+        started = time.monotonic()
+        try:
+            client.chat.completions.create(
+                model=self.model,
+                messages=[{"role": "user", "content": "ping"}],
+                max_completion_tokens=16,
+                timeout=request_timeout(self.model),
+            )
+            ok = True
+        except Exception as exc:
+            logger.warning("Clarus probe for %s failed: %s", self.model, exc)
+            ok = False
+        now = time.monotonic()
+        with self._lock:
+            if ok:
+                self.state = "closed"
+                self.calls.clear()
+                self.calls.append((now, True, int((now - started) * 1000)))
+                logger.info("Clarus circuit closed for %s", self.model)
+            else:
+                self.state = "open"
+                self.opened_at = now
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            self._trim(time.monotonic())
+            latencies = sorted(latency for _, ok, latency in self.calls if ok)
+            failures = sum(1 for _, ok, _ in self.calls if not ok)
+        return {
+            "state": self.state,
+            "calls": len(self.calls),
+            "errorRate": round(failures / len(self.calls), 3) if self.calls else None,
+            "latencyMs": {
+                "p50": latencies[len(latencies) // 2] if latencies else None,
+                "p90": latencies[min(int(len(latencies) * 0.9), len(latencies) - 1)] if latencies else None,
+            },
+        }
+
+
+class BreakerRegistry:
+    def __init__(self) -> None:
+        self._breakers: Dict[str, ModelBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, model: str) -> ModelBreaker:
+        with self._lock:
+            breaker = self._breakers.get(model)
+            if breaker is None:
+                breaker = self._breakers[model] = ModelBreaker(model)
+            return breaker
+
+    def record(self, model: str, ok: bool, latency_ms: int) -> None:
+        if CLARUS_BREAKER:
+            self.get(model).record(ok, latency_ms)
+
+    def healthy(self, models: List[str]) -> List[str]:
+        """Models whose breaker lets calls through; all of them if none does, rather than failing."""
+        if not CLARUS_BREAKER:
+            return list(models)
+        allowed = [model for model in models if self.get(model).allow()]
+        return allowed or list(models)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return {breaker.model: breaker.snapshot() for breaker in breakers}
+
+
+breakers = BreakerRegistry()
+
+
+def create_completion(
+    messages: List[Dict[str, str]],
+    cache_key: Optional[str] = None,
+    route: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    if client is None:
+        raise RuntimeError("OPENAI_API_KEY is not configured.")
+
+    route = route or ROUTES["standard"]
+    last_error: Optional[Exception] = None
+    for model in breakers.healthy(route["models"]):
+        started = time.monotonic()
+        try:
+            response = client.chat.completions.create(
+                model=model,
+                messages=messages,
+                max_completion_tokens=route["maxOutputTokens"],
+                timeout=request_timeout(model),
+                **completion_options(cache_key),
+            )
+            content = (response.choices[0].message.content or "").strip()
+            usage = response.usage.model_dump() if getattr(response, "usage", None) else {}
+            breakers.record(model, True, int((time.monotonic() - started) * 1000))
+            record_model_call(model, route, "won", time.monotonic() - started)
+            log_usage(model, usage)
+            return {"answer": content, "model": model, "usage": usage}
+        except Exception as exc:  # Try the configured fallback before failing.
+            breakers.record(model, False, int((time.monotonic() - started) * 1000))
+            record_model_call(model, route, "error", time.monotonic() - started)
+            last_error = exc
+            logger.warning("Clarus model call failed for %s: %s", model, exc)
+
+    raise last_error or RuntimeError("No model configured.")
+
+
+def sse(event: str, payload: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+def next_flush_at() -> Optional[float]:
+    """The latest time a token yielded now may still be held by an SseFramer."""
+    return time.monotonic() + CLARUS_SSE_FLUSH_MS / 1000 if CLARUS_SSE_FLUSH_MS else None
+
+
+def idle_event(flush_at: Optional[float]) -> Tuple[str, Dict[str, Any]]:
+    """Event for a wait that timed out: `flush` once held tokens are due, else `heartbeat`."""
+    if flush_at is not None and time.monotonic() >= flush_at:
+        return "flush", {}
+    return "heartbeat", {}
+
+
+class SseFramer:
+    """Coalesces token deltas into fewer SSE frames for one reader.
+
+    The first token is sent at once to keep time to first token low; later tokens are held
+    until CLARUS_SSE_FLUSH_MS has passed since the last frame or CLARUS_SSE_FLUSH_CHARS have
+    accumulated. Any other event flushes held tokens first, so ordering is unchanged. The
+    compact encoding sends tokens as `event: t` with the raw text as data lines instead of JSON.
+    """
+
+    def __init__(self, compact: bool = False) -> None:
+        self.compact = compact
+        self.pending: List[str] = []
+        self.pending_chars = 0
+        self.last_flush = 0.0
+        self.started = False
+        self.frames = 0
+        self.bytes = 0
+
+    def _emit(self, frame: str) -> str:
+        self.frames += 1
+        self.bytes += len(frame.encode("utf-8"))
+        return frame
+
+    def token(self, text: str) -> str:
+        self.pending.append(text)
+        self.pending_chars += len(text)
+        if (
+            not self.started
+            or self.pending_chars >= CLARUS_SSE_FLUSH_CHARS
+            or (time.monotonic() - self.last_flush) * 1000 >= CLARUS_SSE_FLUSH_MS
+        ):
+            return self.flush()
+        return ""
+
+    def flush(self) -> str:
+        if not self.pending:
+            return ""
+        text = "".join(self.pending)
+        self.pending = []
+        self.pending_chars = 0
+        self.last_flush = time.monotonic()
+        self.started = True
+        if self.compact:
+            lines = text.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+            return self._emit("event: t\n" + "".join(f"data: {line}\n" for line in lines) + "\n")
+        return self._emit(sse("token", {"token": text}))
+
+    def discard(self) -> None:
+        """Drop held tokens of an answer the reader is about to be told to discard."""
+        self.pending = []
+        self.pending_chars = 0
+
+    def event(self, event: str, payload: Dict[str, Any]) -> str:
+        return self.flush() + self._emit(sse(event, payload))
+
+    def comment(self, text: str) -> str:
+        return self.flush() + self._emit(f": {text}\n\n")
+
+    def stats(self) -> Dict[str, int]:
+        return {"sseFrames": self.frames, "sseBytes": self.bytes}
+
+
+class ModelAttempt:
+    """One streaming call to one model, pumped into a shared queue by a background thread.
+
+    Reading the upstream stream on its own thread lets stream_completion enforce first-token
+    and total deadlines, and run a hedged attempt next to it, without blocking on a stalled
+    socket. cancel() closes the upstream response so a losing or expired call stops billing.
+    """
+
+    def __init__(self, model: str, events: "queue.Queue[Tuple[ModelAttempt, str, Any]]") -> None:
+        self.model = model
+        self.deadlines = model_deadlines(model)
+        self.started = time.monotonic()
+        self.first_token_at: Optional[float] = None
+        self.parts: List[str] = []
+        self.usage: Dict[str, Any] = {}
+        self.cancelled = False
+        self._events = events
+        self._stream: Any = None
+
+    def start(self, messages: List[Dict[str, str]], cache_key: Optional[str], max_tokens: int) -> "ModelAttempt":
+        threading.Thread(
+            target=self._run,
+            args=(messages, cache_key, max_tokens),
+            name=f"clarus-model-{self.model}",
+            daemon=True,
+        ).start()
+        return self
+
+    def _run(self, messages: List[Dict[str, str]], cache_key: Optional[str], max_tokens: int) -> None:
+        try:
+            self._stream = client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                max_completion_tokens=max_tokens,
+                stream=True,
+                stream_options={"include_usage": True},
+                timeout=request_timeout(self.model),
+                **completion_options(cache_key),
+            )
+            for chunk in self._stream:
+                if self.cancelled:
+                    break
+                if getattr(chunk, "usage", None):
+                    self.usage = chunk.usage.model_dump()
+                if not getattr(chunk, "choices", None):
+                    continue
+                delta = getattr(chunk.choices[0], "delta", None)
+                token = getattr(delta, "content", None)
+                if token:
+                    self._events.put((self, "token", token))
+            self._events.put((self, "done", None))
+        except Exception as exc:
+            self._events.put((self, "error", exc))
+        finally:
+            if self.cancelled:
+                self._close()
+
+    def expires_at(self) -> float:
+        if self.first_token_at is None:
+            return self.started + self.deadlines["firstTokenMs"] / 1000
+        return self.started + self.deadlines["totalMs"] / 1000
+
+    def cancel(self) -> None:
+        self.cancelled = True
+        self._close()
+
+    def _close(self) -> None:
+        close = getattr(self._stream, "close", None)
+        if close is not None:
+            try:
+                close()
+            except Exception:
+                pass
+
+
+def model_deadlines(model: str) -> Dict[str, int]:
+    deadlines = {"connectMs": CLARUS_CONNECT_MS, "firstTokenMs": CLARUS_FIRST_TOKEN_MS, "totalMs": CLARUS_TOTAL_MS}
+    deadlines.update(CLARUS_MODEL_DEADLINES.get(model) or {})
+    return deadlines
+
+
+def request_timeout(model: str) -> Timeout:
+    deadlines = model_deadlines(model)
+    return Timeout(deadlines["totalMs"] / 1000, connect=deadlines["connectMs"] / 1000)
+
+
+def stream_completion(
+    messages: List[Dict[str, str]],
+    cache_key: Optional[str] = None,
+    route: Optional[Dict[str, Any]] = None,
+):
+    """Stream from the route's models with deadlines and optional hedging.
+
+    The first model gets CLARUS_FIRST_TOKEN_MS to produce a token and CLARUS_TOTAL_MS to finish;
+    when it fails or misses a deadline the next model takes over. With CLARUS_HEDGE_MS set, the
+    next model is also started when the first has produced nothing after that many milliseconds,
+    and whichever streams a token first wins; the other call is cancelled. The `model` event is
+    sent once a winner is known. When a model fails after it has streamed tokens, a `reset` event
+    precedes the next model's answer so readers discard the partial one. A `heartbeat` event is
+    yielded after CLARUS_HEARTBEAT_MS without other events, and a `flush` event
+    CLARUS_SSE_FLUSH_MS after a token when no other event came, so tokens held by the framer go
+    out without waiting for the next one. Closing the generator cancels every running call.
+    """
+    if client is None:
+        raise RuntimeError("OPENAI_API_KEY is not configured.")
+
+    route = route or ROUTES["standard"]
+    events: "queue.Queue[Tuple[ModelAttempt, str, Any]]" = queue.Queue()
+    waiting = breakers.healthy(route["models"])
+    running: List[ModelAttempt] = []
+    outcomes: List[Dict[str, Any]] = []
+    winner: Optional[ModelAttempt] = None
+    hedged = False
+    streamed = False
+    flush_at: Optional[float] = None
+    last_error: Optional[Exception] = None
+
+    def launch() -> ModelAttempt:
+        attempt = ModelAttempt(waiting.pop(0), events).start(messages, cache_key, route["maxOutputTokens"])
+        running.append(attempt)
+        return attempt
+
+    def retire(attempt: ModelAttempt, outcome: str) -> None:
+        attempt.cancel()
+        running.remove(attempt)
+        elapsed = int((time.monotonic() - attempt.started) * 1000)
+        outcomes.append({"model": attempt.model, "outcome": outcome, "ms": elapsed})
+        record_model_call(attempt.model, route, outcome, elapsed / 1000)
+        if outcome != "lost":
+            breakers.record(attempt.model, outcome == "won", elapsed)
+
+    if not waiting:
+        raise RuntimeError("No model configured.")
+    launch()
+    try:
+        while True:
+            if not running:
+                if not waiting:
+                    raise last_error or RuntimeError("No model configured.")
+                launch()
+                yield "status", {"message": "Clarus probeert een fallbackmodel."}
+
+            now = time.monotonic()
+            expired = [attempt for attempt in running if attempt.expires_at() <= now]
+            for attempt in expired:
+                stage = "first token" if attempt.first_token_at is None else "total"
+                last_error = TimeoutError(f"{attempt.model} missed its {stage} deadline.")
+                logger.warning("Clarus streaming call for %s missed its %s deadline", attempt.model, stage)
+                if attempt is winner:
+                    winner = None
+                retire(attempt, "timeout")
+            if expired:
+                continue
+            hedge_at = None
+            if CLARUS_HEDGE_MS and winner is None and waiting and len(running) == 1:
+                hedge_at = running[0].started + CLARUS_HEDGE_MS / 1000
+                if now >= hedge_at:
+                    hedged = True
+                    yield "status", {"message": "Clarus probeert ook een tweede model.", "hedge": launch().model}
+                    continue
+
+            wake = min([attempt.expires_at() for attempt in running] + [at for at in (hedge_at, flush_at) if at])
+            try:
+                attempt, kind, payload = events.get(timeout=min(max(wake - now, 0.0), CLARUS_HEARTBEAT_MS / 1000))
+            except queue.Empty:
+                # Gives the caller a chance to write held tokens and to notice a disconnect.
+                yield idle_event(flush_at)
+                flush_at = None
+                continue
+
+            if attempt not in running:
+                continue  # Late event from a cancelled call.
+            if kind == "token":
+                if winner is None:
+                    winner = attempt
+                    for other in [other for other in running if other is not attempt]:
+                        retire(other, "lost")
+                    if streamed:
+                        yield "reset", {"message": "Clarus begint opnieuw met een ander model."}
+                    yield "model", {"model": attempt.model, "hedged": hedged}
+                if attempt.first_token_at is None:
+                    attempt.first_token_at = time.monotonic()
+                attempt.parts.append(payload)
+                streamed = True
+                if flush_at is None:
+                    flush_at = next_flush_at()
+                yield "token", {"token": payload}
+                continue
+
+            if kind == "done" and attempt.parts:
+                retire(attempt, "won")
+                log_usage(attempt.model, attempt.usage)
+                generating = time.monotonic() - attempt.first_token_at
+                if generating > 0:
+                    completion = attempt.usage.get("completion_tokens") or estimate_tokens("".join(attempt.parts))
+                    metrics.observe("clarus_model_tokens_per_second", completion / generating, model=attempt.model, route=route["name"])
+                result = {"answer": "".join(attempt.parts).strip(), "model": attempt.model, "usage": attempt.usage}
+                if len(outcomes) > 1:
+                    result["attempts"] = outcomes
+                return result
+
+            last_error = payload if kind == "error" else RuntimeError(f"{attempt.model} returned an empty answer.")
+            logger.warning("Clarus streaming call failed for %s: %s", attempt.model, last_error)
+            if attempt is winner:
+                winner = None
+            retire(attempt, "error")
+    finally:
+        for attempt in list(running):
+            attempt.cancel()
+
+
+def client_ip() -> str:
+    """The address seen by the outermost trusted proxy.
+
+    Each proxy appends the address it received the request from to X-Forwarded-For, so only
+    the last CLARUS_TRUSTED_PROXIES values were written by our own proxies; anything before
+    them is whatever the client chose to send.
+    """
+    if CLARUS_TRUSTED_PROXIES:
+        hops = [hop.strip() for hop in request.headers.get("X-Forwarded-For", "").split(",") if hop.strip()]
+        if len(hops) >= CLARUS_TRUSTED_PROXIES:
+            return hops[-CLARUS_TRUSTED_PROXIES]
+    return request.remote_addr or ""
+
+
+def get_ip_hash() -> Optional[str]:
+    if not IP_HASH_SALT:
+        return None
+    return hashlib.sha256(f"{IP_HASH_SALT}:{client_ip()}".encode("utf-8")).hexdigest()
+
+
+def client_key() -> str:
+    """Rate-limit key: the logged ipHash, or an unsalted hash when no salt is configured."""
+    return get_ip_hash() or hashlib.sha256(client_ip().encode("utf-8")).hexdigest()
+
+
+class FirebaseConnection:
+    """Process-wide Firebase Admin state.
+
+    `firebase_admin` is imported on first use, the app is initialized once and the Firestore
+    client is reused. Clients are rebuilt after a fork because gRPC channels do not survive
+    it. A failed setup is remembered and retried with exponential backoff instead of on
+    every request.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._modules: Optional[Dict[str, Any]] = None
+        self._import_failed = False
+        self._initialized = False
+        self._client: Optional[Any] = None
+        self._client_pid: Optional[int] = None
+        self._retry_at = 0.0
+        self._retry_delay = CLARUS_FIREBASE_RETRY_SECONDS
+
+    def modules(self) -> Optional[Dict[str, Any]]:
+        if self._modules is None and not self._import_failed:
+            try:
+                import firebase_admin
+                from firebase_admin import auth, credentials, firestore
+
+                self._modules = {
+                    "firebase_admin": firebase_admin,
+                    "auth": auth,
+                    "credentials": credentials,
+                    "firestore": firestore,
+                }
+            except Exception as exc:  # firebase-admin is optional until admin logs are enabled.
+                self._import_failed = True
+                logger.warning("Firebase Admin SDK is not installed: %s", exc)
+        return self._modules
+
+    def _fail(self, message: str, exc: Any) -> None:
+        logger.warning(message, exc)
+        self._retry_at = time.monotonic() + self._retry_delay
+        self._retry_delay = min(self._retry_delay * 2, 600.0)
+
+    def initialize(self) -> bool:
+        if self._initialized:
+            return True
+        if time.monotonic() < self._retry_at:
+            return False
+        modules = self.modules()
+        if modules is None:
+            return False
+
+        with self._lock:
+            if self._initialized:
+                return True
+            firebase_admin = modules["firebase_admin"]
+            try:
+                if not firebase_admin._apps:
+                    service_account = os.getenv("FIREBASE_SERVICE_ACCOUNT_JSON")
+                    if service_account:
+                        firebase_admin.initialize_app(
+                            modules["credentials"].Certificate(json.loads(service_account))
+                        )
+                    elif not os.getenv("GOOGLE_APPLICATION_CREDENTIALS"):
+                        self._fail("Firebase Admin SDK is not configured: %s", "no credentials")
+                        return False
+                    else:
+                        firebase_admin.initialize_app()
+            except Exception as exc:
+                self._fail("Firebase Admin SDK is not configured: %s", exc)
+                return False
+            self._initialized = True
+            self._retry_delay = CLARUS_FIREBASE_RETRY_SECONDS
+            return True
+
+    def firestore_client(self) -> Optional[Any]:
+        if self._client is not None and self._client_pid == os.getpid():
+            return self._client
+        if not self.initialize():
+            return None
+        with self._lock:
+            if self._client is None or self._client_pid != os.getpid():
+                try:
+                    self._client = self._modules["firestore"].client()
+                    self._client_pid = os.getpid()
+                except Exception as exc:
+                    self._client = None
+                    self._fail("Firestore client is not available: %s", exc)
+            return self._client
+
+
+firebase = FirebaseConnection()
+
+
+def init_firebase_admin() -> bool:
+    return firebase.initialize()
+
+
+def get_firestore_client() -> Optional[Any]:
+    return firebase.firestore_client()
+
+
+def firestore_where(query: Any, field: str, op: str, value: Any) -> Any:
+    field_filter = getattr(firebase.modules()["firestore"], "FieldFilter", None)
+    if field_filter is not None:
+        return query.where(filter=field_filter(field, op, value))
+    return query.where(field, op, value)
+
+
+def write_firestore_log(entry: Dict[str, Any]) -> bool:
+    return write_firestore_logs([entry])
+
+
+@timed("write_firestore_logs")
+def write_firestore_logs(entries: List[Dict[str, Any]]) -> bool:
+    """Write entries in batched commits of at most 500 documents, merging repeated ids first."""
+    db = get_firestore_client()
+    if db is None:
+        return False
+
+    merged: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+    for entry in entries:
+        merged.setdefault(entry["id"], {}).update(entry)
+
+    try:
+        documents = list(merged.values())
+        collection = db.collection(CLARUS_LOG_COLLECTION)
+        for start in range(0, len(documents), 500):
+            batch = db.batch()
+            for entry in documents[start:start + 500]:
+                batch.set(collection.document(entry["id"]), entry, merge=True)
+            batch.commit()
+        return True
+    except Exception as exc:
+        logger.warning("Could not write Clarus log to Firestore: %s", exc)
+        return False
+
+
+def elapsed_ms(started: float) -> int:
+    return int((time.perf_counter() - started) * 1000)
+
+
+def build_log_entry(
+    data: Dict[str, Any],
+    language: str,
+    question: str,
+    log_id: str,
+    context: Optional[Dict[str, Any]] = None,
+    **extra: Any,
+) -> Dict[str, Any]:
+    context = context or {}
+    entry = {
+        "id": log_id,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "language": language,
+        "contextType": data.get("contextType", "essay"),
+        "essayId": data.get("essayId"),
+        "sessionId": data.get("sessionId"),
+        "essayTitle": context.get("essayTitle") or trim_text(data.get("essayTitle", ""), 240),
+        "essayVersion": context.get("essayVersion"),
+        "corpusVersion": context.get("corpusVersion"),
+        "corpusSize": context.get("corpusSize", 0),
+        "corpusRetrieved": context.get("corpusRetrieved"),
+        "essayPassages": context.get("essayPassages"),
+        "promptTokens": context.get("promptTokens"),
+        "historySummary": context.get("historySummary"),
+        "question": trim_text(question, 2400),
+        "ipHash": get_ip_hash(),
+        "userAgent": trim_text(request.headers.get("User-Agent", ""), 300),
+    }
+    entry.update(extra)
+    return entry
+
+
+class JsonlLogStore:
+    """Append-only JSONL log with rotation into compressed, indexed segments.
+
+    The active file is rotated by size or by UTC day. A rotated file becomes a gzip segment
+    made of independent members of CLARUS_LOG_INDEX_LINES lines each, and the sidecar index
+    records every segment's time range and the byte offset, first line and time range of each
+    member. Tail reads seek backwards through the active file and then decompress only the
+    newest members they need, so their cost follows the requested limit rather than the size
+    of the history on disk. Writers hold a shared file lock and rotation an exclusive one, so
+    several gunicorn workers can append to the same store.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.index_path = path.with_name(f"{path.stem}.index.json")
+        self.lock_path = path.with_name(f"{path.stem}.lock")
+        self._handle: Optional[Any] = None
+        self._pid: Optional[int] = None
+        self._last_fsync = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _file_lock(self, exclusive: bool) -> Any:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        handle = self.lock_path.open("a")
+        if fcntl is not None:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        return handle
+
+    def _open(self) -> Any:
+        # Reopen after a fork or after another worker rotated the file away from our handle.
+        if self._handle is not None and self._pid == os.getpid():
+            try:
+                if os.fstat(self._handle.fileno()).st_ino == os.stat(self.path).st_ino:
+                    return self._handle
+            except OSError:
+                pass
+            self._handle.close()
+        self._handle = self.path.open("a", encoding="utf-8")
+        self._pid = os.getpid()
+        return self._handle
+
+    def _needs_rotation(self) -> bool:
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False
+        if not stat.st_size:
+            return False
+        if CLARUS_LOG_ROTATE == "daily":
+            modified = datetime.fromtimestamp(stat.st_mtime, timezone.utc).date()
+            return modified != datetime.now(timezone.utc).date()
+        return stat.st_size >= CLARUS_LOG_ROTATE_BYTES
+
+    def append(self, entries: List[Dict[str, Any]]) -> None:
+        if not entries:
+            return
+        payload = "".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries)
+        with self._lock:
+            if self._needs_rotation():
+                self.rotate()
+            lock = self._file_lock(exclusive=False)
+            try:
+                handle = self._open()
+                handle.write(payload)
+                handle.flush()
+                if CLARUS_LOG_FSYNC_SECONDS and time.monotonic() - self._last_fsync >= CLARUS_LOG_FSYNC_SECONDS:
+                    os.fsync(handle.fileno())
+                    self._last_fsync = time.monotonic()
+            finally:
+                lock.close()
+
+    def load_index(self) -> Dict[str, Any]:
+        try:
+            return json.loads(self.index_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {"segments": []}
+
+    def rotate(self) -> None:
+        lock = self._file_lock(exclusive=True)
+        try:
+            if not self._needs_rotation():
+                return  # Another worker rotated while we waited for the lock.
+            stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+            pending = self.path.with_name(f"{self.path.stem}.{stamp}.rotating")
+            os.replace(self.path, pending)
+            segment = self.path.with_name(f"{self.path.stem}.{stamp}.jsonl.gz")
+            members = self._compress(pending, segment)
+            index = self.load_index()
+            if members:
+                index["segments"].append({
+                    "file": segment.name,
+                    "first": members[0]["first"],
+                    "last": members[-1]["last"],
+                    "lines": members[-1]["line"] + members[-1]["lines"],
+                    "members": members,
+                })
+            temporary = self.index_path.with_suffix(".tmp")
+            temporary.write_text(json.dumps(index), encoding="utf-8")
+            os.replace(temporary, self.index_path)
+            pending.unlink()
+        finally:
+            lock.close()
+
+    @staticmethod
+    def _compress(source: Path, target: Path) -> List[Dict[str, Any]]:
+        members: List[Dict[str, Any]] = []
+        lines: List[str] = []
+
+        def timestamp(line: str) -> Optional[str]:
+            try:
+                return json.loads(line).get("timestamp")
+            except ValueError:
+                return None
+
+        with source.open("r", encoding="utf-8") as reader, target.open("wb") as writer:
+            line_number = 0
+
+            def flush() -> None:
+                members.append({
+                    "offset": writer.tell(),
+                    "line": line_number - len(lines),
+                    "lines": len(lines),
+                    "first": timestamp(lines[0]),
+                    "last": timestamp(lines[-1]),
+                })
+                writer.write(gzip.compress("".join(lines).encode("utf-8")))
+                lines.clear()
+
+            for line in reader:
+                if not line.endswith("\n"):
+                    line += "\n"
+                lines.append(line)
+                line_number += 1
+                if len(lines) >= CLARUS_LOG_INDEX_LINES:
+                    flush()
+            if lines:
+                flush()
+        return members
+
+    @staticmethod
+    def _reverse_file_lines(handle: Any, block_size: int = 64 * 1024):
+        with handle:
+            position = handle.seek(0, os.SEEK_END)
+            remainder = b""
+            while position > 0:
+                step = min(block_size, position)
+                position -= step
+                handle.seek(position)
+                chunk = handle.read(step) + remainder
+                lines = chunk.split(b"\n")
+                remainder = lines.pop(0)
+                for line in reversed(lines):
+                    if line.strip():
+                        yield line.decode("utf-8", errors="replace")
+            if remainder.strip():
+                yield remainder.decode("utf-8", errors="replace")
+
+    @staticmethod
+    def _outside(span: Dict[str, Any], before: Optional[str], since: Optional[str]) -> bool:
+        """True when every line in the span is at or after `before`, or older than `since`."""
+        if before and span.get("first") and span["first"] >= before:
+            return True
+        return bool(since and span.get("last") and span["last"] < since)
+
+    def _reverse_segment_lines(
+        self,
+        segment: Dict[str, Any],
+        before: Optional[str] = None,
+        since: Optional[str] = None,
+    ):
+        try:
+            handle = self.path.with_name(segment["file"]).open("rb")
+        except OSError:
+            return
+        with handle:
+            members = segment["members"]
+            for position in reversed(range(len(members))):
+                if self._outside(members[position], before, since):
+                    continue
+                start = members[position]["offset"]
+                handle.seek(start)
+                if position + 1 < len(members):
+                    raw = handle.read(members[position + 1]["offset"] - start)
+                else:
+                    raw = handle.read()
+                for line in reversed(gzip.decompress(raw).decode("utf-8").splitlines()):
+                    if line.strip():
+                        yield line
+
+    def reverse_lines(self, before: Optional[str] = None, since: Optional[str] = None):
+        """Yield raw lines newest first across the active file and all segments.
+
+        `before` and `since` are ISO timestamps used to skip whole segments and blocks from the
+        index; lines inside the active file and inside read blocks are not filtered here.
+        """
+        # Take a consistent snapshot of the active file and the index; an open handle stays
+        # valid even if another worker rotates the file while we read.
+        lock = self._file_lock(exclusive=False)
+        try:
+            segments = self.load_index()["segments"]
+            try:
+                active = self.path.open("rb")
+            except OSError:
+                active = None
+        finally:
+            lock.close()
+        if active is not None:
+            yield from self._reverse_file_lines(active)
+        for segment in reversed(segments):
+            if since and segment.get("last") and segment["last"] < since:
+                break
+            if not self._outside(segment, before, since):
+                yield from self._reverse_segment_lines(segment, before, since)
+
+    def tail(self, limit: int = 100) -> List[Dict[str, Any]]:
+        entries: List[Dict[str, Any]] = []
+        for line in self.reverse_lines():
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+            if len(entries) >= limit:
+                break
+        return entries
+
+
+log_store = JsonlLogStore(CLARUS_LOG_PATH)
+
+
+def append_file_log(entry: Dict[str, Any]) -> None:
+    log_store.append([entry])
+
+
+# Usage rollups are maintained incrementally as log entries are written: one row per
+# (day, model, status, language, contextType, route) with summed counters and a latency histogram.
+ROLLUP_DIMENSIONS = ("day", "model", "status", "language", "contextType", "route")
+LATENCY_BUCKETS_MS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000)
+
+
+def latency_bucket(latency_ms: float) -> str:
+    for bound in LATENCY_BUCKETS_MS:
+        if latency_ms <= bound:
+            return f"latencyLe{bound}"
+    return "latencyLeInf"
+
+
+def rollup_entries(entries: List[Dict[str, Any]]) -> Dict[Tuple[str, ...], Dict[str, float]]:
+    rollups: Dict[Tuple[str, ...], Dict[str, float]] = {}
+    for entry in entries:
+        if entry.get("status") in {None, "started"}:
+            continue
+        dimensions = (
+            str(entry.get("timestamp", ""))[:10],
+            str(entry.get("model") or "none"),
+            str(entry.get("status")),
+            str(entry.get("language") or "unknown"),
+            str(entry.get("contextType") or "unknown"),
+            str(entry.get("route") or "none"),
+        )
+        counters = rollups.setdefault(dimensions, {})
+        usage = entry.get("usage") or {}
+        increments = {
+            "requests": 1,
+            "promptTokens": usage.get("prompt_tokens") or 0,
+            "completionTokens": usage.get("completion_tokens") or 0,
+            "cachedTokens": entry.get("cachedTokens") or 0,
+        }
+        if isinstance(entry.get("latencyMs"), (int, float)):
+            increments["latencyCount"] = 1
+            increments["latencySumMs"] = entry["latencyMs"]
+            increments[latency_bucket(entry["latencyMs"])] = 1
+        for metric, value in increments.items():
+            counters[metric] = counters.get(metric, 0) + value
+    return rollups
+
+
+def rollup_document_id(dimensions: Tuple[str, ...]) -> str:
+    return "|".join(dimensions).replace("/", "_")
+
+
+def write_firestore_rollups(rollups: Dict[Tuple[str, ...], Dict[str, float]]) -> bool:
+    db = get_firestore_client() if rollups else None
+    if db is None:
+        return False
+    try:
+        increment = firebase.modules()["firestore"].Increment
+        collection = db.collection(CLARUS_ROLLUP_COLLECTION)
+        batch = db.batch()
+        for dimensions, counters in rollups.items():
+            document = dict(zip(ROLLUP_DIMENSIONS, dimensions))
+            document.update({metric: increment(value) for metric, value in counters.items()})
+            batch.set(collection.document(rollup_document_id(dimensions)), document, merge=True)
+        batch.commit()
+        return True
+    except Exception as exc:
+        logger.warning("Could not update Clarus rollups in Firestore: %s", exc)
+        return False
+
+
+class RollupStore:
+    """Local rollup table in SQLite, updated with upserts so every worker can add to it."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None or getattr(self._local, "pid", None) != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(str(self.path), timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA busy_timeout=5000")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS rollups ("
+                " day TEXT, model TEXT, status TEXT, language TEXT, context_type TEXT, route TEXT,"
+                " metric TEXT, value REAL NOT NULL,"
+                " PRIMARY KEY (day, model, status, language, context_type, route, metric))"
+            )
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def add(self, rollups: Dict[Tuple[str, ...], Dict[str, float]]) -> None:
+        rows = [
+            (*dimensions, metric, value)
+            for dimensions, counters in rollups.items()
+            for metric, value in counters.items()
+        ]
+        if not rows:
+            return
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.executemany(
+                "INSERT INTO rollups VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (day, model, status, language, context_type, route, metric)"
+                " DO UPDATE SET value = value + excluded.value",
+                rows,
+            )
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+    def read(self, since: str, until: str) -> List[Dict[str, Any]]:
+        documents: Dict[Tuple[str, ...], Dict[str, Any]] = {}
+        for *dimensions, metric, value in self._connect().execute(
+            "SELECT day, model, status, language, context_type, route, metric, value FROM rollups"
+            " WHERE day >= ? AND day <= ?",
+            (since, until),
+        ):
+            document = documents.setdefault(tuple(dimensions), dict(zip(ROLLUP_DIMENSIONS, dimensions)))
+            document[metric] = value
+        return list(documents.values())
+
+
+rollup_store = RollupStore(CLARUS_ROLLUP_PATH)
+
+
+def update_rollups(entries: List[Dict[str, Any]]) -> None:
+    """Add entries to the Firestore and local rollups.
+
+    The increments do not depend on the log write: analytics reads Firestore whenever it is
+    configured, so a batch whose log commit failed still has to be counted there.
+    """
+    rollups = rollup_entries(entries)
+    if not rollups:
+        return
+    write_firestore_rollups(rollups)
+    try:
+        rollup_store.add(rollups)
+    except Exception as exc:
+        logger.warning("Could not update local Clarus rollups: %s", exc)
+
+
+def read_rollups(since: str, until: str) -> List[Dict[str, Any]]:
+    db = get_firestore_client()
+    if db is not None:
+        try:
+            query = firestore_where(db.collection(CLARUS_ROLLUP_COLLECTION), "day", ">=", since)
+            query = firestore_where(query, "day", "<=", until)
+            return [doc.to_dict() for doc in query.stream()]
+        except Exception as exc:
+            logger.warning("Could not read Clarus rollups from Firestore: %s", exc)
+    return rollup_store.read(since, until)
+
+
+def estimate_cost(model: str, prompt: float, cached: float, completion: float) -> Optional[float]:
+    """USD cost from CLARUS_PRICES, given per million tokens as input/cachedInput/output."""
+    prices = CLARUS_PRICES.get(model)
+    if not prices:
+        return None
+    cached_price = prices.get("cachedInput", prices.get("input", 0))
+    cost = (
+        (prompt - cached) * prices.get("input", 0)
+        + cached * cached_price
+        + completion * prices.get("output", 0)
+    ) / 1_000_000
+    return round(cost, 6)
+
+
+def latency_percentile(counters: Dict[str, float], fraction: float) -> Optional[int]:
+    total = counters.get("latencyCount", 0)
+    if not total:
+        return None
+    seen = 0.0
+    for bound in LATENCY_BUCKETS_MS:
+        seen += counters.get(f"latencyLe{bound}", 0)
+        if seen >= fraction * total:
+            return bound
+    return None
+
+
+def summarize_rollups(documents: List[Dict[str, Any]], group_by: List[str]) -> List[Dict[str, Any]]:
+    groups: Dict[Tuple[str, ...], Dict[str, Any]] = {}
+    for document in documents:
+        key = tuple(str(document.get(dimension)) for dimension in group_by)
+        group = groups.setdefault(key, {"counters": {}, "cost": 0.0, "priced": True})
+        for metric, value in document.items():
+            if metric not in ROLLUP_DIMENSIONS and isinstance(value, (int, float)):
+                group["counters"][metric] = group["counters"].get(metric, 0) + value
+        cost = estimate_cost(
+            str(document.get("model")),
+            document.get("promptTokens", 0),
+            document.get("cachedTokens", 0),
+            document.get("completionTokens", 0),
+        )
+        if cost is None and document.get("promptTokens", 0) + document.get("completionTokens", 0):
+            group["priced"] = False
+        group["cost"] += cost or 0.0
+
+    rows = []
+    for key, group in sorted(groups.items()):
+        counters = group["counters"]
+        count = counters.get("latencyCount", 0)
+        rows.append({
+            **dict(zip(group_by, key)),
+            "requests": int(counters.get("requests", 0)),
+            "promptTokens": int(counters.get("promptTokens", 0)),
+            "completionTokens": int(counters.get("completionTokens", 0)),
+            "cachedTokens": int(counters.get("cachedTokens", 0)),
+            "estimatedCostUsd": round(group["cost"], 6) if group["priced"] else None,
+            "latencyMs": {
+                "mean": int(counters.get("latencySumMs", 0) / count) if count else None,
+                "p50": latency_percentile(counters, 0.5),
+                "p90": latency_percentile(counters, 0.9),
+                "p99": latency_percentile(counters, 0.99),
+            },
+        })
+    return rows
+
+
+class LogPipeline:
+    """Background log writer that keeps Firestore and JSONL writes off the request path.
+
+    Entries go into a bounded queue. One worker thread per process drains it in batches,
+    commits them to Firestore with batched writes and appends them to the JSONL file through
+    a single open handle that is flushed per batch and fsynced periodically. When the queue
+    is full the `block` policy waits up to CLARUS_LOG_BLOCK_MS before dropping the entry and
+    the `drop` policy drops it at once.
+    """
+
+    def __init__(self) -> None:
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=CLARUS_LOG_QUEUE_SIZE)
+        self._lock = threading.Lock()
+        self._pid: Optional[int] = None
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.latency_ms = {"firestore": 0.0, "file": 0.0}
+
+    def _ensure_worker(self) -> None:
+        # Gunicorn forks after import; each worker process starts its own writer thread.
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                threading.Thread(target=self._run, name="clarus-log-writer", daemon=True).start()
+                self._pid = os.getpid()
+
+    def submit(self, entry: Dict[str, Any], to_file: bool = True) -> bool:
+        self._ensure_worker()
+        try:
+            if CLARUS_LOG_DROP_POLICY == "drop" or not CLARUS_LOG_BLOCK_MS:
+                self._queue.put_nowait((entry, to_file))
+            else:
+                self._queue.put((entry, to_file), timeout=CLARUS_LOG_BLOCK_MS / 1000)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped % 100 == 1:
+                logger.warning("Clarus log queue is full; %s entries dropped so far.", self.dropped)
+            return False
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Wait until everything queued before this call has been written."""
+        if self._pid != os.getpid():
+            return True
+        marker = threading.Event()
+        try:
+            self._queue.put(marker, timeout=timeout)
+        except queue.Full:
+            return False
+        return marker.wait(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queueDepth": self._queue.qsize(),
+            "queueSize": CLARUS_LOG_QUEUE_SIZE,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "latencyMs": {sink: round(value, 2) for sink, value in self.latency_ms.items()},
+        }
+
+    def _run(self) -> None:
+        while True:
+            items = [self._queue.get()]
+            deadline = time.monotonic() + CLARUS_LOG_FLUSH_SECONDS
+            while len(items) < CLARUS_LOG_BATCH_SIZE and not isinstance(items[-1], threading.Event):
+                remaining = deadline - time.monotonic()
+                try:
+                    items.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            entries = [item for item in items if not isinstance(item, threading.Event)]
+            if entries:
+                try:
+                    self._write(entries)
+                except Exception as exc:  # Never let a bad batch stop the writer thread.
+                    self.failed += len(entries)
+                    logger.warning("Could not write Clarus log batch: %s", exc)
+            for item in items:
+                if isinstance(item, threading.Event):
+                    item.set()
+
+    def _write(self, entries: List[Tuple[Dict[str, Any], bool]]) -> None:
+        started = time.perf_counter()
+        firestore_ok = write_firestore_logs([entry for entry, _ in entries])
+        self._observe("firestore", started)
+        update_rollups([entry for entry, _ in entries])
+
+        started = time.perf_counter()
+        file_ok = True
+        try:
+            log_store.append([entry for entry, to_file in entries if to_file])
+            self._observe("file", started)
+        except Exception as exc:
+            file_ok = False
+            if firestore_ok:
+                logger.warning("Could not write Clarus JSONL fallback log: %s", exc)
+            else:
+                logger.warning("Could not write Clarus log anywhere: %s", exc)
+        # An entry counts as written once a sink has committed it; Firestore-only entries
+        # are lost when Firestore fails even if the file append succeeded.
+        committed = sum(1 for _, to_file in entries if firestore_ok or (to_file and file_ok))
+        self.written += committed
+        self.failed += len(entries) - committed
+
+    def _observe(self, sink: str, started: float) -> None:
+        elapsed = (time.perf_counter() - started) * 1000
+        previous = self.latency_ms[sink]
+        self.latency_ms[sink] = elapsed if not previous else previous * 0.8 + elapsed * 0.2
+
+
+log_pipeline = LogPipeline()
+atexit.register(log_pipeline.flush)
+
+
+def record_request(entry: Dict[str, Any]) -> None:
+    """Request metrics from a finished log entry, labelled like the rollups."""
+    if not CLARUS_METRICS or entry.get("status") in {None, "started"}:
+        return
+    labels = {
+        "model": entry.get("model") or "none",
+        "route": entry.get("route") or "none",
+        "status": entry["status"],
+        "language": entry.get("language") or "unknown",
+    }
+    metrics.inc("clarus_requests_total", **labels)
+    if isinstance(entry.get("latencyMs"), (int, float)):
+        metrics.observe("clarus_request_seconds", entry["latencyMs"] / 1000, **labels)
+    if isinstance(entry.get("firstTokenMs"), (int, float)):
+        metrics.observe("clarus_first_token_seconds", entry["firstTokenMs"] / 1000, **labels)
+    usage = entry.get("usage") or {}
+    tokens = {
+        "prompt": usage.get("prompt_tokens") or 0,
+        "cached": entry.get("cachedTokens") or 0,
+        "completion": usage.get("completion_tokens") or 0,
+    }
+    for kind, value in tokens.items():
+        if value:
+            metrics.inc("clarus_tokens_total", value, model=labels["model"], route=labels["route"], kind=kind)
+
+
+@timed("append_log")
+def append_log(entry: Dict[str, Any], to_file: bool = True) -> None:
+    record_request(entry)
+    if CLARUS_LOG_ASYNC:
+        log_pipeline.submit(entry, to_file)
+        return
 
-def append_log(entry: Dict[str, Any]) -> None:
     firestore_ok = write_firestore_log(entry)
+    update_rollups([entry])
+    if not to_file:
+        return
     try:
         append_file_log(entry)
     except Exception as exc:
@@ -571,46 +3697,189 @@ def append_log(entry: Dict[str, Any]) -> None:
             logger.warning("Could not write Clarus log anywhere: %s", exc)
 
 
-def read_firestore_logs(limit: int = 100) -> Optional[List[Dict[str, Any]]]:
+LOG_FILTER_FIELDS = ("status", "model", "route", "language", "contextType", "essayId")
+LOG_SUMMARY_FIELDS = [
+    "id",
+    "timestamp",
+    "language",
+    "contextType",
+    "essayId",
+    "essayTitle",
+    "model",
+    "route",
+    "status",
+    "usage",
+    "cachedTokens",
+    "error",
+]
+
+
+def encode_log_cursor(entry: Dict[str, Any]) -> str:
+    raw = json.dumps({"t": entry.get("timestamp"), "id": entry.get("id")}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_log_cursor(value: str) -> Dict[str, Any]:
+    raw = base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+    cursor = json.loads(raw)
+    if not isinstance(cursor, dict) or not isinstance(cursor.get("t"), str) or not isinstance(cursor.get("id"), str):
+        raise ValueError("Invalid cursor.")
+    return {"t": parse_log_timestamp(cursor["t"]), "id": cursor["id"]}
+
+
+def parse_log_timestamp(value: str) -> str:
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc).isoformat()
+
+
+def parse_log_query(args: Any) -> Dict[str, Any]:
+    """Translate admin query parameters; raises ValueError on malformed input."""
+    fields = None
+    if args.get("view") == "summary":
+        fields = LOG_SUMMARY_FIELDS
+    elif args.get("fields"):
+        fields = sorted({"id", "timestamp", *[field.strip() for field in args["fields"].split(",") if field.strip()]})
+    return {
+        "limit": min(max(int(args.get("limit", "100")), 1), 500),
+        "filters": {field: args[field] for field in LOG_FILTER_FIELDS if args.get(field)},
+        "since": parse_log_timestamp(args["since"]) if args.get("since") else None,
+        "until": parse_log_timestamp(args["until"]) if args.get("until") else None,
+        "cursor": decode_log_cursor(args["cursor"]) if args.get("cursor") else None,
+        "fields": fields,
+    }
+
+
+def log_page(entries: List[Dict[str, Any]], query: Dict[str, Any]) -> Dict[str, Any]:
+    has_more = len(entries) > query["limit"]
+    entries = entries[: query["limit"]]
+    if query["fields"]:
+        entries = [{field: entry.get(field) for field in query["fields"]} for entry in entries]
+    return {
+        "logs": entries,
+        "nextCursor": encode_log_cursor(entries[-1]) if has_more and entries else None,
+    }
+
+
+def read_firestore_logs(query: Dict[str, Any]) -> Optional[Dict[str, Any]]:
     db = get_firestore_client()
     if db is None:
         return None
     try:
-        query = (
-            db.collection(CLARUS_LOG_COLLECTION)
-            .order_by("timestamp", direction=firebase_firestore.Query.DESCENDING)
-            .limit(limit)
-        )
-        return [doc.to_dict() for doc in query.stream()]
+        firestore = firebase.modules()["firestore"]
+        # Equality filters combined with the (timestamp, id) order need composite indexes in Firestore.
+        collection_query = db.collection(CLARUS_LOG_COLLECTION)
+        for field, value in query["filters"].items():
+            collection_query = firestore_where(collection_query, field, "==", value)
+        if query["since"]:
+            collection_query = firestore_where(collection_query, "timestamp", ">=", query["since"])
+        if query["until"]:
+            collection_query = firestore_where(collection_query, "timestamp", "<", query["until"])
+        # The id breaks timestamp ties, so a page boundary inside equal timestamps skips nothing.
+        collection_query = collection_query.order_by("timestamp", direction=firestore.Query.DESCENDING)
+        collection_query = collection_query.order_by("id", direction=firestore.Query.DESCENDING)
+        if query["fields"]:
+            collection_query = collection_query.select(query["fields"])
+        if query["cursor"]:
+            collection_query = collection_query.start_after({"timestamp": query["cursor"]["t"], "id": query["cursor"]["id"]})
+        collection_query = collection_query.limit(query["limit"] + 1)
+        return log_page([doc.to_dict() for doc in collection_query.stream()], query)
     except Exception as exc:
         logger.warning("Could not read Clarus logs from Firestore: %s", exc)
         return None
 
 
+def shift_timestamp(value: str, seconds: int) -> str:
+    return (datetime.fromisoformat(value) + timedelta(seconds=seconds)).isoformat()
+
+
+def read_file_logs(query: Dict[str, Any]) -> Dict[str, Any]:
+    """Stream the JSONL store newest first, keeping only one page of matches in memory.
+
+    The cursor is positional: entries are skipped until the cursor's entry id has been seen,
+    so concurrent appends and small timestamp reorderings between workers cannot skip or
+    repeat entries. The index skips blocks well outside the requested window; the slack covers
+    entries that were written slightly out of timestamp order.
+    """
+    slack = CLARUS_LOG_ORDER_SLACK_SECONDS
+    cursor = query["cursor"]
+    since = query["since"]
+    before = cursor["t"] if cursor else query["until"]
+    matches: List[Dict[str, Any]] = []
+    seen_cursor = cursor is None
+    lines = log_store.reverse_lines(
+        before=shift_timestamp(before, slack) if before else None,
+        since=shift_timestamp(since, -slack) if since else None,
+    )
+    try:
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            timestamp = entry.get("timestamp") or ""
+            if not seen_cursor:
+                if entry.get("id") == cursor.get("id"):
+                    seen_cursor = True
+                    continue
+                if not timestamp or timestamp >= shift_timestamp(cursor["t"], -slack):
+                    continue
+                seen_cursor = True
+            if since and timestamp < since:
+                if timestamp and timestamp < shift_timestamp(since, -slack):
+                    break
+                continue
+            if query["until"] and timestamp >= query["until"]:
+                continue
+            if any(entry.get(field) != value for field, value in query["filters"].items()):
+                continue
+            matches.append(entry)
+            if len(matches) > query["limit"]:
+                break
+    finally:
+        lines.close()
+    return log_page(matches, query)
+
+
 def read_log_tail(limit: int = 100) -> List[Dict[str, Any]]:
-    if not CLARUS_LOG_PATH.exists():
-        return []
-    lines = CLARUS_LOG_PATH.read_text(encoding="utf-8").splitlines()
-    entries = []
-    for line in lines[-limit:]:
-        try:
-            entries.append(json.loads(line))
-        except json.JSONDecodeError:
-            continue
-    return list(reversed(entries))
+    return log_store.tail(limit)
 
 
-def require_admin() -> Optional[Any]:
-    if not init_firebase_admin():
-        return None
+_admin_tokens: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_admin_tokens_lock = threading.Lock()
+
+
+def verify_admin_token(token: str) -> Dict[str, Any]:
+    key = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    now = time.time()
+    with _admin_tokens_lock:
+        decoded = _admin_tokens.get(key)
+        if decoded is not None and decoded.get("exp", 0) > now:
+            _admin_tokens.move_to_end(key)
+            return decoded
+        _admin_tokens.pop(key, None)
+
+    decoded = firebase.modules()["auth"].verify_id_token(token)
+    if CLARUS_ADMIN_TOKEN_CACHE and decoded.get("exp", 0) > now:
+        with _admin_tokens_lock:
+            _admin_tokens[key] = decoded
+            while len(_admin_tokens) > CLARUS_ADMIN_TOKEN_CACHE:
+                _admin_tokens.popitem(last=False)
+    return decoded
 
+
+def require_admin() -> Optional[Any]:
     header = request.headers.get("Authorization", "")
     if not header.startswith("Bearer "):
         return None
 
+    if not init_firebase_admin():
+        return None
+
     token = header.removeprefix("Bearer ").strip()
     try:
-        decoded = auth.verify_id_token(token)
+        decoded = verify_admin_token(token)
     except Exception as exc:
         logger.warning("Invalid Firebase token for Clarus logs: %s", exc)
         return None
@@ -623,7 +3892,51 @@ def require_admin() -> Optional[Any]:
 
 @app.route("/health", methods=["GET"])
 def health():
-    return jsonify({"ok": True, "model": CLARUS_MODEL})
+    return jsonify({
+        "ok": True,
+        "model": CLARUS_MODEL,
+        "cache": {"backend": type(cache).__name__, "stats": cache.stats.snapshot()},
+        "logs": log_pipeline.stats(),
+        "models": breakers.snapshot(),
+        "streams": stream_slots.stats(),
+        "admission": admission.stats(),
+    })
+
+
+def runtime_metrics() -> Iterable[Tuple[str, Dict[str, Any], float]]:
+    """Counters and gauges this process already keeps for /health."""
+    streams = stream_slots.stats()
+    yield "clarus_streams_active", {}, streams["active"]
+    yield "clarus_streams_rejected_total", {}, streams["rejected"]
+    yield "clarus_streams_cancelled_total", {}, streams["cancelled"]
+    yield "clarus_admission_rejected_total", {"reason": "rate_limited"}, admission.rate_limited
+    yield "clarus_admission_rejected_total", {"reason": "shed"}, admission.shed
+    if not getattr(admission.backend, "shared", False):
+        # A shared backend already counts for the whole host, so summing workers would overcount.
+        for kind, value in admission.backend.state().items():
+            yield "clarus_admission_slots", {"kind": kind}, value
+    logs = log_pipeline.stats()
+    yield "clarus_log_queue_depth", {}, logs["queueDepth"]
+    for outcome in ("written", "dropped", "failed"):
+        yield "clarus_log_entries_total", {"outcome": outcome}, logs[outcome]
+    for namespace, counts in cache.stats.snapshot().items():
+        for outcome, value in counts.items():
+            yield "clarus_cache_operations_total", {"namespace": namespace, "outcome": outcome}, value
+    for model, breaker in breakers.snapshot().items():
+        yield "clarus_breaker_open", {"model": model}, int(breaker["state"] == "open")
+
+
+metrics.collectors.append(runtime_metrics)
+
+
+@app.route("/metrics", methods=["GET"])
+def clarus_metrics():
+    if not CLARUS_METRICS:
+        return jsonify({"error": "Metrics staan uit."}), 404
+    supplied = request.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+    if CLARUS_METRICS_TOKEN and not hmac.compare_digest(supplied, CLARUS_METRICS_TOKEN):
+        return jsonify({"error": "Niet bevoegd."}), 403
+    return Response(render_metrics(metrics.collect()), mimetype="text/plain; version=0.0.4")
 
 
 @app.route("/clarus/about", methods=["GET"])
@@ -632,6 +3945,36 @@ def clarus_about():
     return jsonify(ABOUT_CLARUS.get(language, ABOUT_CLARUS["nl"]))
 
 
+@app.errorhandler(413)
+def body_too_large(_exc: Any):
+    return jsonify({"error": "Het verzoek is te groot."}), 413
+
+
+@app.route("/clarus/essays", methods=["POST"])
+def clarus_register_essay():
+    wait = admission.check_rate()
+    if wait:
+        return rate_limited_response(wait)
+    data = request.get_json(force=True, silent=True) or {}
+    if not data.get("essay"):
+        return jsonify({"error": "Geen essay ontvangen."}), 400
+    record = register_essay(data.get("essayTitle", ""), data.get("essay"))
+    return jsonify({"essayId": data.get("essayId"), "essayVersion": record["version"]})
+
+
+@app.route("/clarus/corpus", methods=["POST"])
+def clarus_register_corpus():
+    wait = admission.check_rate()
+    if wait:
+        return rate_limited_response(wait)
+    data = request.get_json(force=True, silent=True) or {}
+    items = data.get("essayCorpus")
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "Geen essaycorpus ontvangen."}), 400
+    record = register_corpus(items)
+    return jsonify({"corpusVersion": record["version"], "corpusSize": len(record["items"])})
+
+
 @app.route("/chat", methods=["POST"])
 def clarus_chat():
     data = request.get_json(force=True, silent=True) or {}
@@ -639,41 +3982,120 @@ def clarus_chat():
     if not question:
         return jsonify({"error": "Geen vraag ontvangen."}), 400
 
-    language = normalize_language(data.get("language", ""), question)
     log_id = str(uuid.uuid4())
+    started = time.perf_counter()
+    wait = admission.check_rate()
+    if wait:
+        append_log(build_log_entry(
+            data,
+            normalize_language(data.get("language", ""), question),
+            question,
+            log_id,
+            latencyMs=elapsed_ms(started),
+            status="rate_limited",
+        ))
+        return rate_limited_response(wait)
+
+    try:
+        session_id = sessions.apply(data)
+        context = resolve_context(data)
+    except UnknownContextVersion as exc:
+        return unknown_version_response(exc)
+    verdict = classify_question(question, data.get("language", ""))
+    language = verdict["language"]
+
+    local = local_answer(verdict, data.get("language", ""))
+    if local:
+        sessions.append(data, context, language, question, local["answer"])
+        summaries.schedule(data, question, local["answer"])
+        append_log(build_log_entry(
+            data,
+            language,
+            question,
+            log_id,
+            context,
+            **local,
+            latencyMs=elapsed_ms(started),
+        ))
+        return jsonify({"antwoord": local["answer"], "logId": log_id, "model": local["model"], "sessionId": session_id})
 
-    if is_off_topic(question):
-        answer = scope_redirect(language)
+    route = route_question(verdict, context)
+    fingerprint = request_fingerprint(data, language, context)
+    cache_key = fingerprint if answer_cache.enabled else None
+    cached = answer_cache.get(cache_key) if cache_key else None
+    if cached:
+        sessions.append(data, context, language, question, cached["answer"])
+        summaries.schedule(data, question, cached["answer"])
         append_log(build_log_entry(
             data,
             language,
             question,
             log_id,
-            model="scope-guard",
-            answer=answer,
-            status="refused_off_topic",
+            context,
+            model=cached["model"],
+            answer=trim_text(cached["answer"], 5000),
+            sourceLogId=cached["sourceLogId"],
+            route=route["name"],
+            latencyMs=elapsed_ms(started),
+            status="cached",
         ))
-        return jsonify({"antwoord": answer, "logId": log_id, "model": "scope-guard"})
+        return jsonify({"antwoord": cached["answer"], "logId": log_id, "model": cached["model"], "sessionId": session_id})
 
-    messages = build_messages(data)
+    capacity = CallSlot(stream=False)
+    call = open_call(fingerprint, log_id, capacity)
+    if call is None:
+        append_log(build_log_entry(
+            data,
+            language,
+            question,
+            log_id,
+            context,
+            route=route["name"],
+            latencyMs=elapsed_ms(started),
+            status="busy",
+        ))
+        return busy_response()
 
+    flight, leader = call
     try:
-        result = create_completion(messages)
-        answer = result["answer"]
+        if flight is None:
+            result = create_completion(build_messages(data, context, route["models"][0], language), prompt_cache_key(context), route)
+        else:
+            if leader:
+                flight.start(lambda: stream_completion(build_messages(data, context, route["models"][0], language), prompt_cache_key(context), route))
+            try:
+                result = drain(flight.follow())
+            finally:
+                flight.detach(log_id)
+        answer = (result or {}).get("answer", "")
         if not answer:
             raise RuntimeError("Model returned an empty answer.")
 
+        if cache_key and leader:
+            answer_cache.put(
+                cache_key,
+                (context.get("essayVersion"), context.get("corpusVersion")),
+                answer=answer,
+                model=result["model"],
+                sourceLogId=log_id,
+            )
+
+        sessions.append(data, context, language, question, answer)
+        summaries.schedule(data, question, answer)
         append_log(build_log_entry(
             data,
             language,
             question,
             log_id,
+            context,
             model=result["model"],
             answer=trim_text(answer, 5000),
-            usage=result.get("usage", {}),
+            **completion_log_fields(result, flight, leader),
+            route=route["name"],
+            latencyMs=elapsed_ms(started),
             status="completed",
         ))
-        return jsonify({"antwoord": answer, "logId": log_id, "model": result["model"]})
+        return jsonify({"antwoord": answer, "logId": log_id, "model": result["model"], "sessionId": session_id})
 
     except Exception as exc:
         logger.exception("Clarus error")
@@ -682,10 +4104,15 @@ def clarus_chat():
             language,
             question,
             log_id,
+            context,
             error=str(exc),
+            route=route["name"],
+            latencyMs=elapsed_ms(started),
             status="error",
         ))
         return jsonify({"error": "Er ging iets mis met Clarus."}), 500
+    finally:
+        capacity.release()
 
 
 @app.route("/chat-stream", methods=["POST"])
@@ -695,28 +4122,52 @@ def clarus_chat_stream():
     if not question:
         return jsonify({"error": "Geen vraag ontvangen."}), 400
 
-    language = normalize_language(data.get("language", ""), question)
     log_id = str(uuid.uuid4())
+    started = time.perf_counter()
+    wait = admission.check_rate()
+    if wait:
+        append_log(build_log_entry(
+            data,
+            normalize_language(data.get("language", ""), question),
+            question,
+            log_id,
+            latencyMs=elapsed_ms(started),
+            status="rate_limited",
+        ))
+        return rate_limited_response(wait)
+
+    try:
+        session_id = sessions.apply(data)
+        context = resolve_context(data)
+    except UnknownContextVersion as exc:
+        return unknown_version_response(exc)
+    verdict = classify_question(question, data.get("language", ""))
+    language = verdict["language"]
 
-    if is_off_topic(question):
-        answer = scope_redirect(language)
+    framer = SseFramer(compact=data.get("streamFormat") == "compact")
+    local = local_answer(verdict, data.get("language", ""))
+    if local:
 
         @stream_with_context
-        def generate_off_topic():
-            yield sse("token", {"token": answer})
+        def generate_local():
+            yield framer.token(local["answer"])
+            closing = framer.event("done", {"logId": log_id, "model": local["model"], "sessionId": session_id})
+            sessions.append(data, context, language, question, local["answer"])
+            summaries.schedule(data, question, local["answer"])
             append_log(build_log_entry(
                 data,
                 language,
                 question,
                 log_id,
-                model="scope-guard",
-                answer=answer,
-                status="refused_off_topic",
+                context,
+                **local,
+                **framer.stats(),
+                latencyMs=elapsed_ms(started),
             ))
-            yield sse("done", {"logId": log_id, "model": "scope-guard"})
+            yield closing
 
         return Response(
-            generate_off_topic(),
+            generate_local(),
             mimetype="text/event-stream",
             headers={
                 "Cache-Control": "no-cache",
@@ -724,27 +4175,124 @@ def clarus_chat_stream():
             },
         )
 
-    messages = build_messages(data)
-    write_firestore_log(build_log_entry(
-        data,
-        language,
-        question,
-        log_id,
-        status="started",
-    ))
+    route = route_question(verdict, context)
+    fingerprint = request_fingerprint(data, language, context)
+    cache_key = fingerprint if answer_cache.enabled else None
+    cached = answer_cache.get(cache_key) if cache_key else None
+    if cached:
+
+        @stream_with_context
+        def generate_cached():
+            yield framer.event("model", {"model": cached["model"]})
+            for token in replay_tokens(cached["answer"]):
+                frame = framer.token(token)
+                if frame:
+                    yield frame
+            closing = framer.event("done", {"logId": log_id, "model": cached["model"], "sessionId": session_id})
+            sessions.append(data, context, language, question, cached["answer"])
+            summaries.schedule(data, question, cached["answer"])
+            append_log(build_log_entry(
+                data,
+                language,
+                question,
+                log_id,
+                context,
+                model=cached["model"],
+                answer=trim_text(cached["answer"], 5000),
+                sourceLogId=cached["sourceLogId"],
+                route=route["name"],
+                **framer.stats(),
+                latencyMs=elapsed_ms(started),
+                status="cached",
+            ))
+            yield closing
+
+        return Response(
+            generate_cached(),
+            mimetype="text/event-stream",
+            headers={
+                "Cache-Control": "no-cache",
+                "X-Accel-Buffering": "no",
+            },
+        )
+
+    capacity = CallSlot(stream=True)
+    call = open_call(fingerprint, log_id, capacity)
+    if call is None:
+        append_log(build_log_entry(
+            data,
+            language,
+            question,
+            log_id,
+            context,
+            route=route["name"],
+            latencyMs=elapsed_ms(started),
+            status="busy",
+        ))
+        return busy_response()
+
+    flight, leader = call
+    try:
+        if flight is None:
+            messages = build_messages(data, context, route["models"][0], language)
+        elif leader:
+            flight.start(lambda: stream_completion(build_messages(data, context, route["models"][0], language), prompt_cache_key(context), route))
+        append_log(build_log_entry(
+            data,
+            language,
+            question,
+            log_id,
+            context,
+            route=route["name"],
+            status="started",
+        ), to_file=False)
+    except BaseException:
+        capacity.release()
+        if flight is not None:
+            flight.detach(log_id)
+        raise
 
     @stream_with_context
     def generate():
+        first_token_ms = None
+        completion_stream = None
+        model = None
+        parts: List[str] = []
+        logged = False  # Set once the final entry is written; a later disconnect must not overwrite it.
         try:
-            yield sse("status", {"message": "Clarus heeft de vraag ontvangen."})
-            completion_stream = stream_completion(messages)
+            yield framer.event("status", {"message": "Clarus heeft de vraag ontvangen."})
+            if flight is None:
+                completion_stream = stream_completion(messages, prompt_cache_key(context), route)
+            else:
+                completion_stream = flight.follow()
             while True:
                 try:
                     event, payload = next(completion_stream)
-                    yield sse(event, payload)
                 except StopIteration as done:
                     result = done.value
                     break
+                if event == "flush":
+                    frame = framer.flush()
+                    if frame:
+                        yield frame
+                    continue
+                if event == "heartbeat":
+                    yield framer.flush() or framer.comment("heartbeat")
+                    continue
+                if event == "token":
+                    parts.append(payload["token"])
+                    if first_token_ms is None:
+                        first_token_ms = elapsed_ms(started)
+                    frame = framer.token(payload["token"])
+                    if frame:
+                        yield frame
+                    continue
+                if event == "model":
+                    model = payload["model"]
+                elif event == "reset":
+                    framer.discard()
+                    parts = []
+                yield framer.event(event, payload)
 
             if not result:
                 raise RuntimeError("Model returned no result.")
@@ -753,17 +4301,61 @@ def clarus_chat_stream():
             if not answer:
                 raise RuntimeError("Model returned an empty answer.")
 
+            if cache_key and leader:
+                answer_cache.put(
+                    cache_key,
+                    (context.get("essayVersion"), context.get("corpusVersion")),
+                    answer=answer,
+                    model=result["model"],
+                    sourceLogId=log_id,
+                )
+
+            closing = framer.event("done", {"logId": log_id, "model": result["model"], "sessionId": session_id})
+            sessions.append(data, context, language, question, answer)
+            summaries.schedule(data, question, answer)
             append_log(build_log_entry(
                 data,
                 language,
                 question,
                 log_id,
+                context,
                 model=result["model"],
                 answer=trim_text(answer, 5000),
-                usage=result.get("usage", {}),
+                **completion_log_fields(result, flight, leader),
+                route=route["name"],
+                **framer.stats(),
+                latencyMs=elapsed_ms(started),
+                firstTokenMs=first_token_ms,
                 status="completed",
             ))
-            yield sse("done", {"logId": log_id, "model": result["model"]})
+            logged = True
+            yield closing
+        except GeneratorExit:
+            # The client went away; the server closes this generator on its next failed write.
+            if completion_stream is not None:
+                completion_stream.close()
+            if flight is not None:
+                flight.detach(log_id)
+            if logged:
+                raise
+            stream_slots.record_cancel()
+            partial = "".join(parts).strip()
+            append_log(build_log_entry(
+                data,
+                language,
+                question,
+                log_id,
+                context,
+                model=model,
+                answer=trim_text(partial, 5000),
+                **partial_log_fields(context, partial, flight, leader),
+                route=route["name"],
+                **framer.stats(),
+                latencyMs=elapsed_ms(started),
+                firstTokenMs=first_token_ms,
+                status="cancelled",
+            ))
+            raise
         except Exception as exc:
             logger.exception("Clarus streaming error")
             append_log(build_log_entry(
@@ -771,12 +4363,17 @@ def clarus_chat_stream():
                 language,
                 question,
                 log_id,
+                context,
                 error=str(exc),
+                route=route["name"],
+                **framer.stats(),
+                latencyMs=elapsed_ms(started),
                 status="error",
             ))
-            yield sse("error", {"error": "Er ging iets mis met Clarus."})
+            logged = True
+            yield framer.event("error", {"error": "Er ging iets mis met Clarus."})
 
-    return Response(
+    response = Response(
         generate(),
         mimetype="text/event-stream",
         headers={
@@ -784,6 +4381,11 @@ def clarus_chat_stream():
             "X-Accel-Buffering": "no",
         },
     )
+    # call_on_close also runs when the client leaves before the generator starts.
+    response.call_on_close(capacity.release)
+    if flight is not None:
+        response.call_on_close(lambda: flight.detach(log_id))
+    return response
 
 
 @app.route("/admin/clarus/logs", methods=["GET"])
@@ -791,9 +4393,44 @@ def clarus_logs():
     if require_admin() is None:
         return jsonify({"error": "Niet bevoegd."}), 403
 
-    limit = min(max(int(request.args.get("limit", "100")), 1), 500)
-    logs = read_firestore_logs(limit)
-    return jsonify({"logs": logs if logs is not None else read_log_tail(limit)})
+    try:
+        query = parse_log_query(request.args)
+    except (ValueError, TypeError):
+        return jsonify({"error": "Ongeldige logfilter."}), 400
+
+    page = read_firestore_logs(query)
+    if page is None:
+        page = read_file_logs(query)
+    return jsonify(page)
+
+
+@app.route("/admin/clarus/analytics", methods=["GET"])
+def clarus_analytics():
+    if require_admin() is None:
+        return jsonify({"error": "Niet bevoegd."}), 403
+
+    today = datetime.now(timezone.utc).date()
+    try:
+        since = datetime.fromisoformat(request.args.get("since", (today - timedelta(days=6)).isoformat())).date()
+        until = datetime.fromisoformat(request.args.get("until", today.isoformat())).date()
+    except ValueError:
+        return jsonify({"error": "Ongeldige periode."}), 400
+    group_by = [
+        dimension
+        for dimension in request.args.get("groupBy", "day,model").split(",")
+        if dimension in ROLLUP_DIMENSIONS
+    ] or ["day"]
+
+    documents = read_rollups(since.isoformat(), until.isoformat())
+    rows = summarize_rollups(documents, group_by)
+    totals = summarize_rollups(documents, [])
+    return jsonify({
+        "since": since.isoformat(),
+        "until": until.isoformat(),
+        "groupBy": group_by,
+        "rows": rows,
+        "totals": totals[0] if totals else None,
+    })
 
 
 if __name__ == "__main__":
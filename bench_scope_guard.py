@@ -0,0 +1,88 @@
+"""Micro-benchmark for the compiled scope guard against the previous regex implementation.
+
+Run with `python bench_scope_guard.py`. It first checks that both implementations agree on a
+set of sample questions and then times them on ordinary and adversarial 1800-character inputs.
+"""
+
+import re
+import timeit
+
+from app import DEEP_TOPIC_TERMS, OFF_TOPIC_PATTERNS, classify_question
+
+
+def legacy_normalize_language(value: str, question: str) -> str:
+    if value in {"nl", "en"}:
+        return value
+    dutch_markers = {"wat", "waarom", "hoe", "essay", "vraag", "bedoelt", "kun", "niet", "wel"}
+    words = set(re.findall(r"[a-zA-Z]+", (question or "").lower()))
+    return "nl" if words & dutch_markers else "en"
+
+
+def legacy_is_off_topic(question: str) -> bool:
+    text = (question or "").lower()
+    if not text:
+        return False
+
+    words = set(re.findall(r"[a-zA-ZÀ-ÿ]+", text))
+    if words & DEEP_TOPIC_TERMS:
+        return False
+
+    if any(re.search(pattern, text) for pattern in OFF_TOPIC_PATTERNS):
+        return True
+
+    practical_request = re.search(
+        r"\b(how do i|how to|can you|could you|please|maak|hoe maak|kun je|kan je)\b.*"
+        r"\b(make|build|write|create|fix|debug|install|deploy|cook|buy|earn|maak|bouw|schrijf|repareer|installeer)\b",
+        text,
+    )
+    return bool(practical_request)
+
+
+SAMPLES = [
+    "Wat bedoelt het essay met verantwoordelijkheid?",
+    "What is the main argument about suffering?",
+    "Can you write me a python script?",
+    "Hoe maak ik een rekenmachine in javascript?",
+    "Please help me cook pasta tonight",
+    "Kun je een recept voor soep geven?",
+    "How to fix my bike",
+    "Is God compatible with evil?",
+    "Make me a workout plan",
+    "Could you explain what freedom means here?",
+    "Schrijf een email aan mijn baas",
+    "Why does the author reject moral relativism?",
+    "",
+]
+
+ORDINARY = "Wat bedoelt het essay precies met de verhouding tussen vrijheid en verantwoordelijkheid?"
+ADVERSARIAL_TRIGGERS = ("how to " * 300)[:1800]
+ADVERSARIAL_WORDS = ("please could you kun je " * 100)[:1800]
+ADVERSARIAL_LONG_WORD = "a" * 1800
+
+
+def check_agreement() -> None:
+    for sample in SAMPLES:
+        verdict = classify_question(sample)
+        assert verdict["offTopic"] == legacy_is_off_topic(sample), sample
+        assert verdict["language"] == legacy_normalize_language("", sample), sample
+
+
+def bench(label: str, question: str, number: int = 2000) -> None:
+    legacy = timeit.timeit(
+        lambda: (legacy_normalize_language("", question), legacy_is_off_topic(question)),
+        number=number,
+    )
+    compiled = timeit.timeit(lambda: classify_question(question), number=number)
+    print(
+        f"{label:<22} legacy {legacy / number * 1e6:9.1f} us   "
+        f"compiled {compiled / number * 1e6:9.1f} us"
+    )
+
+
+if __name__ == "__main__":
+    check_agreement()
+    print("Both implementations agree on the sample questions.")
+    bench("ordinary", ORDINARY)
+    bench("adversarial triggers", ADVERSARIAL_TRIGGERS, number=200)
+    bench("adversarial phrases", ADVERSARIAL_WORDS, number=200)
+    bench("single long word", ADVERSARIAL_LONG_WORD, number=200)
@@ -0,0 +1,34 @@
+"""Gunicorn profile for serving many concurrent /chat-stream readers per process.
+
+    gunicorn -c gunicorn_gevent.conf.py app:app
+
+gevent patches sockets, threads and queues before the app is imported, so the OpenAI client,
+the background model and log threads and the coalescing waits all become cooperative
+greenlets. One worker can then hold hundreds of open streams while /chat and /health stay
+responsive. Requires `pip install gevent`.
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+worker_class = "gevent"
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+# The app reads the worker count to decide whether per-process state can be trusted.
+os.environ["WEB_CONCURRENCY"] = str(workers)
+if workers > 1:
+    # Uploads, answers and sessions must be visible to every worker a follow-up may land on.
+    os.environ.setdefault("CLARUS_CACHE_BACKEND", "sqlite")
+worker_connections = int(os.getenv("CLARUS_WORKER_CONNECTIONS", "1000"))
+# A stream may legitimately stay open for the full model deadline.
+timeout = int(os.getenv("CLARUS_WORKER_TIMEOUT", "120"))
+graceful_timeout = 30
+keepalive = 75
+
+
+def post_fork(server, worker):
+    # Firestore talks gRPC, whose C core needs to be told about gevent.
+    try:
+        from grpc.experimental import gevent as grpc_gevent
+    except ImportError:
+        return
+    grpc_gevent.init_gevent()
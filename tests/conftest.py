@@ -0,0 +1,320 @@
+"""Shared fixtures for the Clarus tests.
+
+The app reads its configuration at import, so the environment is pinned here before the first
+import: logs, rollups and caches go to a temporary directory, everything runs in memory and
+synchronously, and no OpenAI or Firebase credentials are used. Each test gets fresh process
+state and a stub OpenAI client.
+"""
+
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+TMP = Path(tempfile.mkdtemp(prefix="clarus-tests-"))
+os.environ.update({
+    "OPENAI_API_KEY": "",
+    "FIREBASE_SERVICE_ACCOUNT_JSON": "",
+    "GOOGLE_APPLICATION_CREDENTIALS": "",
+    "CLARUS_LOG_PATH": str(TMP / "logs" / "clarus.jsonl"),
+    "CLARUS_ROLLUP_PATH": str(TMP / "logs" / "rollups.sqlite3"),
+    "CLARUS_CACHE_BACKEND": "memory",
+    "CLARUS_METRICS_BACKEND": "memory",
+    "CLARUS_LOG_ASYNC": "0",
+    "CLARUS_RATE_PER_MINUTE": "0",
+    "CLARUS_HEDGE_MS": "0",
+})
+sys.path.insert(0, str(ROOT))
+
+import app as clarus  # noqa: E402
+
+
+class Obj:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+    def model_dump(self):
+        return {key: value.model_dump() if isinstance(value, Obj) else value for key, value in self.__dict__.items()}
+
+
+def usage(prompt=100, completion=3, cached=64):
+    return Obj(
+        prompt_tokens=prompt,
+        completion_tokens=completion,
+        total_tokens=prompt + completion,
+        prompt_tokens_details=Obj(cached_tokens=cached),
+    )
+
+
+class FakeStream:
+    def __init__(self, tokens, delay=0.0):
+        self.tokens = tokens
+        self.delay = delay
+        self.closed = False
+
+    def __iter__(self):
+        for index, token in enumerate(self.tokens):
+            if self.closed:
+                return
+            time.sleep(self.delay[index] if isinstance(self.delay, list) else self.delay)
+            yield Obj(choices=[Obj(delta=Obj(content=token))], usage=None)
+        yield Obj(choices=[], usage=usage(completion=len(self.tokens)))
+
+    def close(self):
+        self.closed = True
+
+
+class FakeOpenAI:
+    """Stands in for `OpenAI()`: records calls and answers every model with fixed text.
+
+    `delay` slows every streamed token, or each token when it is a list; `delays` overrides it
+    per model.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.streams = []
+        self.failing = set()
+        self.tokens = ["Vrijheid", " is", " verantwoordelijkheid", "."]
+        self.delay = 0.0
+        self.delays = {}
+        self.chat = Obj(completions=self)
+
+    def create(self, model, messages, stream=False, **options):
+        self.calls.append({"model": model, "messages": messages, "stream": stream, **options})
+        if model in self.failing:
+            raise RuntimeError(f"{model} is down")
+        if stream:
+            response = FakeStream(list(self.tokens), self.delays.get(model, self.delay))
+            self.streams.append(response)
+            return response
+        return Obj(choices=[Obj(message=Obj(content="".join(self.tokens)))], usage=usage(completion=len(self.tokens)))
+
+
+@pytest.fixture
+def openai(monkeypatch):
+    fake = FakeOpenAI()
+    monkeypatch.setattr(clarus, "client", fake)
+    return fake
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch, tmp_path):
+    """Give every test its own caches, registries, limits and log files."""
+    monkeypatch.setattr(clarus, "cache", clarus.MemoryCache())
+    monkeypatch.setattr(clarus, "_essay_registry", clarus.OrderedDict())
+    monkeypatch.setattr(clarus, "_corpus_registry", clarus.OrderedDict())
+    monkeypatch.setattr(clarus, "flights", clarus.SingleFlight())
+    monkeypatch.setattr(clarus, "stream_slots", clarus.StreamSlots(0))
+    monkeypatch.setattr(clarus, "admission", clarus.AdmissionController())
+    monkeypatch.setattr(clarus, "breakers", clarus.BreakerRegistry())
+    monkeypatch.setattr(clarus, "summaries", clarus.HistorySummaries())
+    monkeypatch.setattr(clarus, "metrics", clarus.Metrics())
+    clarus.metrics.collectors.append(clarus.runtime_metrics)
+    monkeypatch.setattr(clarus, "log_store", clarus.JsonlLogStore(tmp_path / "logs" / "clarus.jsonl"))
+    monkeypatch.setattr(clarus, "rollup_store", clarus.RollupStore(tmp_path / "logs" / "rollups.sqlite3"))
+    monkeypatch.setattr(clarus, "_admin_tokens", clarus.OrderedDict())
+    monkeypatch.setattr(clarus.firebase, "initialize", lambda: False)
+    monkeypatch.setattr(clarus.firebase, "firestore_client", lambda: None)
+    monkeypatch.setattr(clarus, "client", None)
+
+
+class Increment:
+    def __init__(self, value):
+        self.value = value
+
+
+class FakeDocument:
+    def __init__(self, collection, document_id):
+        self.collection = collection
+        self.id = document_id
+
+    def to_dict(self):
+        return dict(self.collection.documents[self.id])
+
+
+class FakeQuery:
+    def __init__(self, collection, conditions=(), orders=(), start=None, count=None):
+        self.collection = collection
+        self.conditions = list(conditions)
+        self.orders = list(orders)
+        self.start = start
+        self.count = count
+
+    def _copy(self, **changes):
+        fields = {"conditions": self.conditions, "orders": self.orders, "start": self.start, "count": self.count}
+        return FakeQuery(self.collection, **{**fields, **changes})
+
+    def where(self, field, op, value):
+        return self._copy(conditions=self.conditions + [(field, op, value)])
+
+    def order_by(self, field, direction="ASCENDING"):
+        return self._copy(orders=self.orders + [(field, direction)])
+
+    def start_after(self, values):
+        return self._copy(start=values)
+
+    def select(self, fields):
+        return self
+
+    def limit(self, count):
+        return self._copy(count=count)
+
+    def stream(self):
+        checks = {"==": lambda a, b: a == b, ">=": lambda a, b: a >= b, "<=": lambda a, b: a <= b, "<": lambda a, b: a < b}
+        matches = [
+            (document_id, document)
+            for document_id, document in list(self.collection.documents.items())
+            if all(field in document and checks[op](document[field], value) for field, op, value in self.conditions)
+        ]
+        descending = any(direction == "DESCENDING" for _, direction in self.orders)
+
+        def key(document):
+            return tuple(document.get(field) for field, _ in self.orders)
+
+        if self.orders:
+            matches.sort(key=lambda match: key(match[1]), reverse=descending)
+        if self.start is not None:
+            cursor = tuple(self.start.get(field) for field, _ in self.orders)
+            matches = [match for match in matches if (key(match[1]) < cursor if descending else key(match[1]) > cursor)]
+        for document_id, _ in matches[: self.count]:
+            yield FakeDocument(self.collection, document_id)
+
+
+class FakeCollection(FakeQuery):
+    def __init__(self, name):
+        super().__init__(self)
+        self.name = name
+        self.documents = {}
+
+    def document(self, document_id):
+        return FakeDocument(self, document_id)
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db = db
+        self.writes = []
+
+    def set(self, reference, fields, merge=False):
+        self.writes.append((reference, fields))
+
+    def commit(self):
+        for reference, _ in self.writes:
+            if reference.collection.name in self.db.failing:
+                raise RuntimeError(f"{reference.collection.name} is unavailable")
+        for reference, fields in self.writes:
+            document = reference.collection.documents.setdefault(reference.id, {})
+            for field, value in fields.items():
+                document[field] = document.get(field, 0) + value.value if isinstance(value, Increment) else value
+
+
+class FakeFirestore:
+    """In-memory Firestore with batched merges, Increment and simple ordered queries.
+
+    Queries order in one direction only, which is all the app asks for.
+    """
+
+    def __init__(self):
+        self.collections = {}
+        self.failing = set()
+
+    def collection(self, name):
+        return self.collections.setdefault(name, FakeCollection(name))
+
+    def batch(self):
+        return FakeBatch(self)
+
+
+@pytest.fixture
+def firestore(monkeypatch):
+    db = FakeFirestore()
+    monkeypatch.setattr(clarus.firebase, "initialize", lambda: True)
+    monkeypatch.setattr(clarus.firebase, "firestore_client", lambda: db)
+    monkeypatch.setattr(clarus.firebase, "modules", lambda: {"firestore": Obj(Increment=Increment, Query=Obj(DESCENDING="DESCENDING"))})
+    return db
+
+
+class FakeAuth:
+    """Firebase Admin `auth` module that accepts one token."""
+
+    def __init__(self, decoded):
+        self.decoded = decoded
+        self.verified = []
+
+    def verify_id_token(self, token):
+        self.verified.append(token)
+        if token != "valid-token":
+            raise ValueError("invalid token")
+        return dict(self.decoded)
+
+
+@pytest.fixture
+def firebase_auth(monkeypatch):
+    auth = FakeAuth({"email": clarus.ADMIN_EMAIL, "exp": time.time() + 3600})
+    monkeypatch.setattr(clarus.firebase, "initialize", lambda: True)
+    modules = clarus.firebase.modules() or {}
+    monkeypatch.setattr(clarus.firebase, "modules", lambda: {**modules, "auth": auth})
+    return auth
+
+
+@pytest.fixture
+def admin_headers(firebase_auth):
+    return {"Authorization": "Bearer valid-token"}
+
+
+@pytest.fixture
+def client():
+    return clarus.app.test_client()
+
+
+def wait_for(predicate, timeout=2.0):
+    """Poll for work that finishes on a background thread."""
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def post_in_background(path, payload, results, address="10.0.0.1"):
+    """POST from another thread with its own client address and collect (status, body)."""
+    def run():
+        with clarus.app.test_client() as client:
+            response = client.post(path, json=payload, environ_base={"REMOTE_ADDR": address})
+            results.append((response.status_code, response.get_data(as_text=True)))
+            response.close()
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def read_log(limit=100):
+    """Log entries written so far, oldest first, with repeated ids merged like Firestore does."""
+    merged = {}
+    for entry in reversed(clarus.read_log_tail(limit)):
+        merged.setdefault(entry["id"], {}).update(entry)
+    return list(merged.values())
+
+
+def sse_events(body):
+    """Parse an SSE body into (event, data) pairs, skipping comments."""
+    events = []
+    for frame in body.strip().split("\n\n"):
+        event, data = None, None
+        for line in frame.splitlines():
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                data = json.loads(line[len("data: "):])
+        if event:
+            events.append((event, data))
+    return events
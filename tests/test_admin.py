@@ -0,0 +1,35 @@
+import time
+
+from conftest import clarus
+
+
+def test_admin_token_is_accepted_and_cached(client, firebase_auth, admin_headers):
+    first = client.get("/admin/clarus/logs", headers=admin_headers)
+    second = client.get("/admin/clarus/analytics", headers=admin_headers)
+
+    assert first.status_code == 200
+    assert second.status_code == 200
+    assert firebase_auth.verified == ["valid-token"]
+
+
+def test_admin_routes_reject_missing_invalid_and_non_admin_tokens(client, firebase_auth, admin_headers):
+    firebase_auth.decoded = {"email": "someone@example.com", "exp": time.time() + 3600}
+
+    assert client.get("/admin/clarus/logs").status_code == 403
+    assert client.get("/admin/clarus/logs", headers={"Authorization": "Bearer forged"}).status_code == 403
+    assert client.get("/admin/clarus/logs", headers=admin_headers).status_code == 403
+
+
+def test_expired_cached_token_is_verified_again(client, firebase_auth, admin_headers):
+    firebase_auth.decoded["exp"] = time.time() - 1
+
+    client.get("/admin/clarus/logs", headers=admin_headers)
+    client.get("/admin/clarus/logs", headers=admin_headers)
+
+    assert firebase_auth.verified == ["valid-token", "valid-token"]
+
+
+def test_admin_email_match_ignores_case(client, firebase_auth, admin_headers):
+    firebase_auth.decoded["email"] = clarus.ADMIN_EMAIL.upper()
+
+    assert client.get("/admin/clarus/logs", headers=admin_headers).status_code == 200
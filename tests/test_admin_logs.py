@@ -0,0 +1,131 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from conftest import clarus
+
+BASE = datetime(2026, 3, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def log_entry(number):
+    # Pairs of entries share a timestamp, so pages must be cut by position and not by time.
+    return {
+        "id": f"log-{number:02d}",
+        "timestamp": (BASE + timedelta(minutes=5 * (number // 2))).isoformat(),
+        "status": "error" if number % 5 == 0 else "completed",
+        "model": "gpt-5.4-nano",
+        "language": "nl",
+        "question": f"Vraag {number}",
+        "answer": f"Antwoord {number}",
+    }
+
+
+@pytest.fixture
+def segmented_log(monkeypatch):
+    """21 entries: two gzip segments of 7 lines in blocks of 3, and 7 lines in the active file."""
+    monkeypatch.setattr(clarus, "CLARUS_LOG_ROTATE_BYTES", 1)
+    monkeypatch.setattr(clarus, "CLARUS_LOG_INDEX_LINES", 3)
+    entries = [log_entry(number) for number in range(21)]
+    for start in range(0, 21, 7):
+        clarus.log_store.append(entries[start:start + 7])
+    segments = clarus.log_store.load_index()["segments"]
+    assert [segment["lines"] for segment in segments] == [7, 7]
+    assert [len(segment["members"]) for segment in segments] == [3, 3]
+    return entries
+
+
+def read_all_pages(client, headers, **params):
+    ids, cursor, pages = [], None, 0
+    while True:
+        query = dict(params, **({"cursor": cursor} if cursor else {}))
+        response = client.get("/admin/clarus/logs", headers=headers, query_string=query)
+        assert response.status_code == 200
+        page = response.get_json()
+        ids.extend(entry["id"] for entry in page["logs"])
+        pages += 1
+        cursor = page["nextCursor"]
+        if not cursor:
+            return ids, pages
+
+
+def test_cursor_pages_cover_every_entry_across_segments(client, admin_headers, segmented_log):
+    ids, pages = read_all_pages(client, admin_headers, limit=4)
+
+    assert ids == [entry["id"] for entry in reversed(segmented_log)]
+    assert pages == 6
+
+
+@pytest.mark.parametrize("limit", [1, 2, 3, 7])
+def test_page_boundaries_inside_equal_timestamps(client, admin_headers, segmented_log, limit):
+    ids, _ = read_all_pages(client, admin_headers, limit=limit)
+
+    assert ids == [entry["id"] for entry in reversed(segmented_log)]
+
+
+def test_status_filter_pages_across_segments(client, admin_headers, segmented_log):
+    ids, _ = read_all_pages(client, admin_headers, limit=2, status="error")
+
+    assert ids == ["log-20", "log-15", "log-10", "log-05", "log-00"]
+
+
+def test_since_is_inclusive_and_until_exclusive(client, admin_headers, segmented_log):
+    since = (BASE + timedelta(minutes=15)).isoformat()
+    until = (BASE + timedelta(minutes=40)).isoformat()
+
+    ids, _ = read_all_pages(client, admin_headers, limit=3, since=since, until=until)
+
+    expected = [entry["id"] for entry in reversed(segmented_log) if since <= entry["timestamp"] < until]
+    assert ids == expected
+    assert ids[0] == "log-15" and ids[-1] == "log-06"
+
+
+def test_filters_combine_with_time_window(client, admin_headers, segmented_log):
+    response = client.get(
+        "/admin/clarus/logs",
+        headers=admin_headers,
+        query_string={"status": "completed", "since": "2026-03-01T12:40:00Z"},
+    )
+
+    assert [entry["id"] for entry in response.get_json()["logs"]] == [
+        "log-19", "log-18", "log-17", "log-16",
+    ]
+
+
+def test_summary_view_drops_question_and_answer(client, admin_headers, segmented_log):
+    page = client.get("/admin/clarus/logs", headers=admin_headers, query_string={"view": "summary", "limit": 2}).get_json()
+
+    assert [entry["id"] for entry in page["logs"]] == ["log-20", "log-19"]
+    for entry in page["logs"]:
+        assert set(entry) == set(clarus.LOG_SUMMARY_FIELDS)
+        assert entry["status"] in {"completed", "error"}
+
+
+def test_field_selection_keeps_id_and_timestamp(client, admin_headers, segmented_log):
+    page = client.get("/admin/clarus/logs", headers=admin_headers, query_string={"fields": "model", "limit": 1}).get_json()
+
+    assert page["logs"] == [{"id": "log-20", "model": "gpt-5.4-nano", "timestamp": segmented_log[20]["timestamp"]}]
+
+
+def test_tail_reads_newest_first_across_segments(segmented_log):
+    assert [entry["id"] for entry in clarus.log_store.tail(9)] == [f"log-{number:02d}" for number in range(20, 11, -1)]
+
+
+def test_firestore_pages_break_timestamp_ties_by_id(client, firestore, admin_headers):
+    entries = [log_entry(number) for number in range(21)]
+    firestore.collection(clarus.CLARUS_LOG_COLLECTION).documents.update({entry["id"]: entry for entry in entries})
+
+    ids, pages = read_all_pages(client, admin_headers, limit=3)
+
+    assert ids == [entry["id"] for entry in reversed(entries)]
+    assert pages == 7
+
+
+@pytest.mark.parametrize("params", [
+    {"cursor": "not-a-cursor"},
+    {"cursor": clarus.encode_log_cursor({"timestamp": "yesterday", "id": "log-01"})},
+    {"cursor": clarus.encode_log_cursor({"timestamp": BASE.isoformat()})},
+    {"since": "yesterday"},
+    {"limit": "many"},
+])
+def test_malformed_queries_are_rejected(client, admin_headers, params):
+    assert client.get("/admin/clarus/logs", headers=admin_headers, query_string=params).status_code == 400
@@ -0,0 +1,126 @@
+import pytest
+
+from conftest import clarus, post_in_background, read_log, sse_events, wait_for
+
+QUESTION = {"vraag": "Waarom is vrijheid zonder verantwoordelijkheid leeg?"}
+
+
+@pytest.fixture
+def one_slot(monkeypatch):
+    monkeypatch.setattr(clarus, "CLARUS_MAX_INFLIGHT", 1)
+    monkeypatch.setattr(clarus, "CLARUS_ADMISSION_QUEUE", 0)
+    monkeypatch.setattr(clarus, "CLARUS_ADMISSION_WAIT_MS", 0)
+
+
+def test_rate_limit_answers_429_with_retry_after(client, openai, monkeypatch):
+    monkeypatch.setattr(clarus, "CLARUS_RATE_PER_MINUTE", 60.0)
+    monkeypatch.setattr(clarus, "CLARUS_RATE_BURST", 2)
+
+    codes = [client.post("/chat", json={"vraag": "Wie heeft je gemaakt?"}).status_code for _ in range(3)]
+    other = client.post("/chat", json={"vraag": "Wie heeft je gemaakt?"}, environ_base={"REMOTE_ADDR": "10.9.9.9"})
+    limited = client.post("/chat", json={"vraag": "Wie heeft je gemaakt?"})
+
+    assert codes == [200, 200, 429]
+    assert other.status_code == 200
+    assert limited.headers["Retry-After"] == "1"
+    assert [entry["status"] for entry in read_log()].count("rate_limited") == 2
+
+
+def test_rate_limit_ignores_client_supplied_forwarded_addresses(client, openai, monkeypatch):
+    monkeypatch.setattr(clarus, "CLARUS_RATE_PER_MINUTE", 60.0)
+    monkeypatch.setattr(clarus, "CLARUS_RATE_BURST", 2)
+
+    codes = [
+        client.post(
+            "/chat",
+            json={"vraag": "Wie heeft je gemaakt?"},
+            headers={"X-Forwarded-For": f"198.51.100.{attempt}, 203.0.113.7"},
+        ).status_code
+        for attempt in range(3)
+    ]
+    other = client.post("/chat", json={"vraag": "Wie heeft je gemaakt?"}, headers={"X-Forwarded-For": "203.0.113.8"})
+
+    assert codes == [200, 200, 429]
+    assert other.status_code == 200
+
+
+@pytest.mark.parametrize("proxies, forwarded, expected", [
+    (0, "198.51.100.1, 203.0.113.7", "10.0.0.9"),
+    (1, "198.51.100.1, 203.0.113.7", "203.0.113.7"),
+    (2, "198.51.100.1, 203.0.113.7", "198.51.100.1"),
+    (2, "203.0.113.7", "10.0.0.9"),
+    (1, "", "10.0.0.9"),
+])
+def test_client_address_comes_from_the_trusted_proxies(monkeypatch, proxies, forwarded, expected):
+    monkeypatch.setattr(clarus, "CLARUS_TRUSTED_PROXIES", proxies)
+    headers = {"X-Forwarded-For": forwarded} if forwarded else {}
+
+    with clarus.app.test_request_context(headers=headers, environ_base={"REMOTE_ADDR": "10.0.0.9"}):
+        assert clarus.client_ip() == expected
+
+
+def test_distinct_questions_over_the_cap_are_shed(client, openai, one_slot):
+    openai.delay = 0.05
+    results = []
+    thread = post_in_background("/chat", QUESTION, results)
+    assert wait_for(lambda: openai.calls)
+
+    response = client.post("/chat", json={"vraag": "Wat bedoelt het essay met schuld?"})
+    thread.join()
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "5"
+    assert results[0][0] == 200
+    assert clarus.admission.stats()["shed"] == 1
+
+
+def test_coalesced_followers_need_no_slot(openai, one_slot):
+    openai.delay = 0.05
+    results = []
+    leader = post_in_background("/chat", QUESTION, results)
+    assert wait_for(lambda: openai.calls)
+
+    followers = [post_in_background("/chat", QUESTION, results, f"10.0.1.{number}") for number in range(3)]
+    for thread in [leader, *followers]:
+        thread.join()
+
+    assert [code for code, _ in results] == [200] * 4
+    assert len(openai.calls) == 1
+    assert clarus.admission.stats()["shed"] == 0
+    assert clarus.admission.stats()["active"] == 0
+
+
+def test_coalesced_stream_followers_need_no_stream_slot(client, openai, monkeypatch):
+    monkeypatch.setattr(clarus, "stream_slots", clarus.StreamSlots(1))
+    openai.delay = 0.05
+    results = []
+    leader = post_in_background("/chat-stream", QUESTION, results)
+    assert wait_for(lambda: openai.calls)
+
+    follower = post_in_background("/chat-stream", QUESTION, results, "10.0.1.1")
+    other = client.post("/chat-stream", json={"vraag": "Wat bedoelt het essay met schuld?"})
+    leader.join()
+    follower.join()
+
+    assert other.status_code == 503
+    for code, body in results:
+        assert code == 200
+        assert sse_events(body)[-1][0] == "done"
+    assert len(openai.calls) == 1
+    assert clarus.stream_slots.stats() == {"active": 0, "limit": 1, "rejected": 1, "cancelled": 0}
+
+
+def test_slot_is_released_after_a_failed_call(client, openai, one_slot):
+    openai.failing = {clarus.CLARUS_MODEL, clarus.CLARUS_FALLBACK_MODEL}
+
+    assert client.post("/chat", json=QUESTION).status_code == 500
+    openai.failing = set()
+    assert client.post("/chat", json=QUESTION).status_code == 200
+    assert clarus.admission.stats()["active"] == 0
+
+
+def test_local_answers_skip_the_slot(client, openai, one_slot):
+    clarus.admission.backend.active = 1
+
+    assert client.post("/chat", json={"vraag": "Wie heeft je gemaakt?"}).status_code == 200
+    assert client.post("/chat", json={"vraag": "Can you write me a python script?"}).status_code == 200
@@ -0,0 +1,55 @@
+from conftest import clarus
+
+QUESTION = {"vraag": "Waarom is vrijheid zonder verantwoordelijkheid leeg?"}
+
+
+def analytics(client, headers, **params):
+    response = client.get("/admin/clarus/analytics", headers=headers, query_string=params)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_rollups_count_batches_whose_log_commit_failed(client, openai, firestore, admin_headers):
+    firestore.failing.add(clarus.CLARUS_LOG_COLLECTION)
+
+    assert client.post("/chat", json=QUESTION).status_code == 200
+
+    assert firestore.collection(clarus.CLARUS_LOG_COLLECTION).documents == {}
+    report = analytics(client, admin_headers)
+    assert report["totals"]["requests"] == 1
+    assert report["totals"]["promptTokens"] == 100
+    assert report["totals"]["cachedTokens"] == 64
+
+
+def test_firestore_and_local_rollups_agree(client, openai, firestore, admin_headers):
+    client.post("/chat", json=QUESTION)
+    client.post("/chat-stream", json={"vraag": "Wat bedoelt het essay met schuld?"}).get_data()
+
+    from_firestore = analytics(client, admin_headers, groupBy="status")
+    documents = clarus.rollup_store.read("2000-01-01", "2999-12-31")
+    local = clarus.summarize_rollups(documents, ["status"])
+
+    assert from_firestore["rows"] == local
+    assert from_firestore["totals"]["requests"] == 2
+
+
+def test_analytics_reads_local_rollups_without_firestore(client, openai, admin_headers):
+    client.post("/chat", json=QUESTION)
+    client.post("/chat", json={"vraag": "Can you write me a python script?"})
+
+    report = analytics(client, admin_headers, groupBy="model,status")
+
+    rows = {(row["model"], row["status"]): row["requests"] for row in report["rows"]}
+    assert rows == {(clarus.CLARUS_MODEL, "completed"): 1, ("scope-guard", "refused_off_topic"): 1}
+
+
+def test_stream_started_entries_are_not_counted(client, openai, admin_headers):
+    client.post("/chat-stream", json=QUESTION).get_data()
+
+    assert analytics(client, admin_headers)["totals"]["requests"] == 1
+
+
+def test_invalid_period_is_rejected(client, admin_headers):
+    response = client.get("/admin/clarus/analytics", headers=admin_headers, query_string={"since": "last week"})
+
+    assert response.status_code == 400
@@ -0,0 +1,88 @@
+from conftest import read_log, sse_events
+
+ESSAY = {"essayId": "essay-vrijheid", "essayTitle": "Vrijheid", "essay": "<p>Vrijheid zonder verantwoordelijkheid is leeg.</p>"}
+REVISED = {**ESSAY, "essay": "<p>Vrijheid vraagt om verantwoordelijkheid.</p>"}
+QUESTION = "Wat bedoelt de auteur met vrijheid?"
+
+
+def test_repeated_first_question_is_served_from_the_cache(client, openai):
+    first = client.post("/chat", json={"vraag": QUESTION, **ESSAY})
+    second = client.post("/chat", json={"vraag": "  wat bedoelt de auteur met VRIJHEID? ", **ESSAY})
+
+    assert len(openai.calls) == 1
+    assert second.get_json()["antwoord"] == first.get_json()["antwoord"]
+    cached = read_log()[-1]
+    assert cached["status"] == "cached"
+    assert cached["sourceLogId"] == first.get_json()["logId"]
+
+
+def test_revised_text_gets_its_own_answers(client, openai):
+    old = client.post("/clarus/essays", json=ESSAY).get_json()["essayVersion"]
+    client.post("/chat", json={"vraag": QUESTION, "essayVersion": old})
+    client.post("/chat", json={"vraag": QUESTION, "essayVersion": old})
+    assert len(openai.calls) == 1
+
+    new = client.post("/clarus/essays", json=REVISED).get_json()["essayVersion"]
+    client.post("/chat", json={"vraag": QUESTION, "essayVersion": new})
+
+    assert new != old
+    assert len(openai.calls) == 2
+    assert "verantwoordelijkheid." in "\n".join(message["content"] for message in openai.calls[-1]["messages"])
+
+
+def test_an_essay_id_cannot_be_pointed_at_other_text(client, openai):
+    version = client.post("/clarus/essays", json=ESSAY).get_json()["essayVersion"]
+    client.post("/chat", json={"vraag": QUESTION, "essayVersion": version})
+
+    client.post("/clarus/essays", json=REVISED)
+    cached = client.post("/chat", json={"vraag": QUESTION, "essayVersion": version})
+    by_id = client.post("/chat", json={"vraag": QUESTION, "essayId": ESSAY["essayId"]})
+
+    assert len(openai.calls) == 1
+    assert read_log()[-1]["status"] == "cached"
+    assert cached.status_code == 200
+    assert by_id.status_code == 409
+    assert by_id.get_json()["uploadRequired"] == "essay"
+
+
+def test_question_with_history_bypasses_the_cache(client, openai):
+    history = [{"role": "user", "content": "Wat is vrijheid?"}, {"role": "assistant", "content": "Kiezen."}]
+    client.post("/chat", json={"vraag": QUESTION, "essay": ESSAY["essay"]})
+
+    follow_up = client.post("/chat", json={"vraag": QUESTION, "essay": ESSAY["essay"], "history": history})
+    again = client.post("/chat", json={"vraag": QUESTION, "essay": ESSAY["essay"], "history": history})
+
+    assert follow_up.status_code == again.status_code == 200
+    assert len(openai.calls) == 3
+    assert [entry["status"] for entry in read_log()] == ["completed"] * 3
+
+
+def test_session_follow_up_bypasses_the_cache(client, openai):
+    session_id = client.post("/chat", json={"vraag": "Wat is vrijheid?", "essay": ESSAY["essay"]}).get_json()["sessionId"]
+    client.post("/chat", json={"vraag": QUESTION, "essay": ESSAY["essay"]})
+
+    client.post("/chat", json={"vraag": QUESTION, "essay": ESSAY["essay"], "sessionId": session_id})
+
+    assert len(openai.calls) == 3
+
+
+def test_stream_replays_a_cached_answer(client, openai):
+    answer = client.post("/chat", json={"vraag": QUESTION, "essay": ESSAY["essay"]}).get_json()["antwoord"]
+
+    with client.post("/chat-stream", json={"vraag": QUESTION, "essay": ESSAY["essay"]}) as response:
+        events = sse_events(response.get_data(as_text=True))
+
+    assert len(openai.calls) == 1
+    assert "".join(data["token"] for event, data in events if event == "token") == answer
+    assert events[-1][0] == "done"
+    assert read_log()[-1]["status"] == "cached"
+
+
+def test_streamed_answer_is_cached_for_chat(client, openai):
+    with client.post("/chat-stream", json={"vraag": QUESTION, "essay": ESSAY["essay"]}) as response:
+        response.get_data()
+
+    cached = client.post("/chat", json={"vraag": QUESTION, "essay": ESSAY["essay"]}).get_json()
+
+    assert len(openai.calls) == 1
+    assert cached["antwoord"] == "".join(openai.tokens)
@@ -0,0 +1,89 @@
+import pytest
+
+from conftest import clarus, wait_for
+
+
+@pytest.fixture
+def breaker_limits(monkeypatch):
+    monkeypatch.setattr(clarus, "CLARUS_BREAKER_MIN_CALLS", 4)
+    monkeypatch.setattr(clarus, "CLARUS_BREAKER_ERROR_RATE", 0.5)
+
+
+def trip(model, failures=4):
+    for _ in range(failures):
+        clarus.breakers.record(model, False, 100)
+
+
+def test_breaker_opens_at_the_error_rate(breaker_limits):
+    for ok in (True, False, True):
+        clarus.breakers.record("primary", ok, 100)
+    assert clarus.breakers.get("primary").state == "closed"
+
+    clarus.breakers.record("primary", False, 100)
+
+    assert clarus.breakers.get("primary").state == "open"
+    assert clarus.breakers.healthy(["primary", "fallback"]) == ["fallback"]
+
+
+def test_all_models_open_still_tries_them_all(breaker_limits):
+    trip("primary")
+    trip("fallback")
+
+    assert clarus.breakers.healthy(["primary", "fallback"]) == ["primary", "fallback"]
+
+
+def test_old_calls_leave_the_window(breaker_limits, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(clarus.time, "monotonic", lambda: now[0])
+    trip("primary", 3)
+
+    now[0] += clarus.CLARUS_BREAKER_WINDOW_SECONDS + 1
+    clarus.breakers.record("primary", False, 100)
+
+    assert clarus.breakers.get("primary").state == "closed"
+    assert clarus.breakers.get("primary").snapshot()["calls"] == 1
+
+
+def test_successful_probe_closes_the_breaker(openai, breaker_limits, monkeypatch):
+    monkeypatch.setattr(clarus, "CLARUS_BREAKER_COOLDOWN_SECONDS", 0)
+    trip("primary")
+
+    assert not clarus.breakers.get("primary").allow()
+    assert wait_for(lambda: clarus.breakers.get("primary").state == "closed")
+    assert openai.calls[-1]["model"] == "primary"
+    assert clarus.breakers.get("primary").snapshot()["errorRate"] == 0
+
+
+def test_failed_probe_reopens_the_breaker(openai, breaker_limits, monkeypatch):
+    monkeypatch.setattr(clarus, "CLARUS_BREAKER_COOLDOWN_SECONDS", 0)
+    openai.failing = {"primary"}
+    trip("primary")
+
+    clarus.breakers.get("primary").allow()
+
+    assert wait_for(lambda: openai.calls and clarus.breakers.get("primary").state == "open")
+    assert len(openai.calls) == 1
+
+
+def test_open_breaker_sends_requests_to_the_fallback(client, openai, breaker_limits):
+    primary, fallback = clarus.ROUTES["standard"]["models"]
+    openai.failing = {primary}
+    for number in range(4):
+        client.post("/chat", json={"vraag": f"Waarom vraagt vrijheid om verantwoordelijkheid, deel {number}?"})
+    calls = len(openai.calls)
+
+    response = client.post("/chat", json={"vraag": "Waarom vraagt schuld om vergeving?"})
+
+    assert response.get_json()["model"] == fallback
+    assert [call["model"] for call in openai.calls[calls:]] == [fallback]
+    health = client.get("/health").get_json()["models"]
+    assert health[primary]["state"] == "open"
+    assert health[fallback]["errorRate"] == 0
+
+
+def test_breakers_can_be_turned_off(breaker_limits, monkeypatch):
+    monkeypatch.setattr(clarus, "CLARUS_BREAKER", False)
+    trip("primary")
+
+    assert clarus.breakers.healthy(["primary", "fallback"]) == ["primary", "fallback"]
+    assert clarus.breakers.snapshot() == {}
@@ -0,0 +1,86 @@
+import time
+
+import pytest
+
+from conftest import clarus
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    return clarus.MemoryCache() if request.param == "memory" else clarus.SQLiteCache(tmp_path / "cache.sqlite3")
+
+
+def test_values_round_trip_per_namespace(backend):
+    backend.set("answers", "key", {"answer": "Ja."}, 10)
+
+    assert backend.get("answers", "key") == {"answer": "Ja."}
+    assert backend.get("sessions", "key") is None
+    assert backend.stats.snapshot()["answers"] == {"hits": 1, "misses": 0, "sets": 1, "evictions": 0}
+
+
+def test_oldest_entries_are_evicted_over_the_limit(backend):
+    for number in range(4):
+        backend.set("answers", f"key-{number}", number, 2)
+        time.sleep(0.002)
+
+    assert [backend.get("answers", f"key-{number}") for number in range(4)] == [None, None, 2, 3]
+    assert backend.stats.snapshot()["answers"]["evictions"] == 2
+
+
+def test_entries_expire_after_their_ttl(backend, monkeypatch):
+    backend.set("answers", "short", "kort", 10, ttl=60)
+    backend.set("answers", "forever", "altijd", 10)
+    later = time.time() + 120
+    monkeypatch.setattr(clarus.time, "time", lambda: later)
+
+    assert backend.get("answers", "short") is None
+    assert backend.get("answers", "forever") == "altijd"
+
+
+def test_tags_invalidate_only_matching_entries(backend):
+    backend.set("answers", "a", 1, 10, tags=("essay-1", "corpus-1"))
+    backend.set("answers", "b", 2, 10, tags=("essay-2", "corpus-1"))
+    backend.set("answers", "c", 3, 10, tags=("essay-12",))
+
+    backend.invalidate_tag("answers", "essay-1")
+
+    assert [backend.get("answers", key) for key in "abc"] == [None, 2, 3]
+
+
+def test_sqlite_cache_is_shared_between_workers(tmp_path):
+    first = clarus.SQLiteCache(tmp_path / "cache.sqlite3")
+    second = clarus.SQLiteCache(tmp_path / "cache.sqlite3")
+
+    first.set("answers", "key", "gedeeld", 10)
+
+    assert second.get("answers", "key") == "gedeeld"
+
+
+def test_upload_on_one_worker_is_visible_on_another(client, openai, monkeypatch, tmp_path):
+    monkeypatch.setattr(clarus, "cache", clarus.SQLiteCache(tmp_path / "cache.sqlite3"))
+    version = client.post("/clarus/essays", json={"essay": "<p>Gedeelde tekst.</p>"}).get_json()["essayVersion"]
+
+    monkeypatch.setattr(clarus, "cache", clarus.SQLiteCache(tmp_path / "cache.sqlite3"))
+    monkeypatch.setattr(clarus, "_essay_registry", clarus.OrderedDict())
+    response = client.post("/chat", json={"vraag": "Wat staat er?", "essayVersion": version})
+
+    assert response.status_code == 200
+    assert "Gedeelde tekst." in "\n".join(message["content"] for message in openai.calls[-1]["messages"])
+
+
+def test_memory_backend_keeps_uploads_per_worker(client, monkeypatch):
+    version = client.post("/clarus/essays", json={"essay": "<p>Lokale tekst.</p>"}).get_json()["essayVersion"]
+
+    monkeypatch.setattr(clarus, "cache", clarus.MemoryCache())
+    monkeypatch.setattr(clarus, "_essay_registry", clarus.OrderedDict())
+
+    assert client.post("/chat", json={"vraag": "Wat staat er?", "essayVersion": version}).status_code == 409
+
+
+def test_unusable_sqlite_path_falls_back_to_memory(monkeypatch, tmp_path):
+    blocker = tmp_path / "file"
+    blocker.write_text("")
+    monkeypatch.setattr(clarus, "CLARUS_CACHE_BACKEND", "sqlite")
+    monkeypatch.setattr(clarus, "CLARUS_CACHE_PATH", blocker / "cache.sqlite3")
+
+    assert isinstance(clarus.create_cache_backend(), clarus.MemoryCache)
@@ -0,0 +1,63 @@
+import pytest
+
+from conftest import clarus, read_log, sse_events, wait_for
+
+QUESTION = {"vraag": "Waarom is vrijheid zonder verantwoordelijkheid leeg?"}
+
+
+def read_until(response, event_name):
+    """Read SSE chunks until `event_name` arrives, then leave the stream paused there."""
+    received = ""
+    for chunk in response.response:
+        received += chunk.decode() if isinstance(chunk, bytes) else chunk
+        if any(event == event_name for event, _ in sse_events(received)):
+            return received
+    pytest.fail(f"stream ended without a {event_name} event")
+
+
+def test_disconnect_mid_stream_cancels_upstream_and_logs_partial(client, openai):
+    openai.tokens = [f"woord{number} " for number in range(40)]
+    openai.delay = 0.01
+
+    response = client.post("/chat-stream", json=QUESTION, buffered=False)
+    read_until(response, "model")
+    response.close()
+
+    entries = read_log()
+    assert [entry["status"] for entry in entries] == ["cancelled"]
+    assert entries[0]["usage"]["estimated"] is True
+    assert wait_for(lambda: openai.streams[0].closed)
+    assert clarus.stream_slots.stats()["cancelled"] == 1
+    assert clarus.stream_slots.stats()["active"] == 0
+
+
+def test_disconnect_after_done_keeps_the_completed_entry(client, openai):
+    response = client.post("/chat-stream", json=QUESTION, buffered=False)
+    read_until(response, "done")
+    response.close()
+
+    entries = read_log()
+    assert [entry["status"] for entry in entries] == ["completed"]
+    assert entries[0]["answer"] == "Vrijheid is verantwoordelijkheid."
+    assert clarus.stream_slots.stats()["cancelled"] == 0
+
+
+def test_disconnect_after_error_keeps_the_error_entry(client, openai):
+    openai.failing = {clarus.CLARUS_MODEL, clarus.CLARUS_FALLBACK_MODEL}
+
+    response = client.post("/chat-stream", json=QUESTION, buffered=False)
+    read_until(response, "error")
+    response.close()
+
+    assert [entry["status"] for entry in read_log()] == ["error"]
+
+
+def test_completed_stream_logs_once_and_releases_its_slot(client, openai):
+    with client.post("/chat-stream", json=QUESTION) as response:
+        body = response.get_data(as_text=True)
+
+    events = sse_events(body)
+    assert events[-1][0] == "done"
+    assert "".join(data["token"] for event, data in events if event == "token") == "Vrijheid is verantwoordelijkheid."
+    assert [entry["status"] for entry in read_log()] == ["completed"]
+    assert clarus.stream_slots.stats()["active"] == 0
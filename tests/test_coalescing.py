@@ -0,0 +1,72 @@
+import json
+import time
+
+from conftest import clarus, post_in_background, read_log, sse_events, wait_for
+
+QUESTION = {"vraag": "Waarom is vrijheid zonder verantwoordelijkheid leeg?"}
+
+
+def test_identical_questions_share_one_upstream_call(openai):
+    openai.delay = 0.05
+    results = []
+    leader = post_in_background("/chat", QUESTION, results)
+    assert wait_for(lambda: openai.calls)
+    followers = [post_in_background("/chat", QUESTION, results, f"10.0.1.{number}") for number in range(2)]
+    for thread in [leader, *followers]:
+        thread.join()
+
+    entries = read_log()
+    leader_entry = next(entry for entry in entries if "coalescedWith" not in entry)
+    assert len(openai.calls) == 1
+    assert {json.loads(body)["antwoord"] for _, body in results} == {"".join(openai.tokens)}
+    assert [entry["coalescedWith"] for entry in entries if entry is not leader_entry] == [leader_entry["id"]] * 2
+    assert all(entry["usage"] == {} for entry in entries if entry is not leader_entry)
+    assert leader_entry["usage"]["completion_tokens"] == len(openai.tokens)
+
+
+def test_late_stream_follower_catches_up_from_the_first_token(openai):
+    openai.delay = 0.05
+    results = []
+    leader = post_in_background("/chat-stream", QUESTION, results)
+    assert wait_for(lambda: openai.streams and len(clarus.flights._calls) and next(iter(clarus.flights._calls.values())).events)
+    follower = post_in_background("/chat-stream", QUESTION, results, "10.0.1.1")
+    leader.join()
+    follower.join()
+
+    answers = ["".join(data["token"] for event, data in sse_events(body) if event == "token") for _, body in results]
+    assert len(openai.calls) == 1
+    assert answers == ["".join(openai.tokens)] * 2
+
+
+def test_upstream_failure_reaches_every_follower(openai, monkeypatch):
+    def slow_failure(model, messages, stream=False, **options):
+        openai.calls.append({"model": model})
+        time.sleep(0.1)
+        raise RuntimeError(f"{model} is down")
+
+    monkeypatch.setattr(openai, "create", slow_failure)
+    results = []
+    leader = post_in_background("/chat", QUESTION, results)
+    assert wait_for(lambda: openai.calls)
+    follower = post_in_background("/chat", QUESTION, results, "10.0.1.1")
+    leader.join()
+    follower.join()
+
+    entries = read_log()
+    assert [code for code, _ in results] == [500, 500]
+    assert [entry["status"] for entry in entries] == ["error", "error"]
+    assert len(openai.calls) == len({call["model"] for call in openai.calls})
+    assert clarus.flights._calls == {}
+
+
+def test_follow_ups_and_disabled_coalescing_call_separately(client, openai, monkeypatch):
+    history = [{"role": "user", "content": "Wat is vrijheid?"}, {"role": "assistant", "content": "Kiezen."}]
+    client.post("/chat", json={**QUESTION, "history": history})
+    client.post("/chat", json={**QUESTION, "history": history})
+    monkeypatch.setattr(clarus, "CLARUS_COALESCE", False)
+    monkeypatch.setattr(clarus.answer_cache, "max_entries", 0)
+    client.post("/chat", json=QUESTION)
+    client.post("/chat", json=QUESTION)
+
+    assert len(openai.calls) == 4
+    assert all("coalescedWith" not in entry for entry in read_log())
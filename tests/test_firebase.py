@@ -0,0 +1,105 @@
+import json
+import sys
+
+import pytest
+
+from conftest import Obj, clarus
+
+
+class FakeAdmin:
+    """Stand-ins for `firebase_admin` and its `credentials` and `firestore` modules."""
+
+    def __init__(self):
+        self._apps = {}
+        self.initialized = []
+        self.clients = 0
+
+    def initialize_app(self, credential=None):
+        self.initialized.append(credential)
+        self._apps["[DEFAULT]"] = credential
+
+    def client(self):
+        self.clients += 1
+        return Obj(number=self.clients)
+
+
+@pytest.fixture
+def admin(monkeypatch):
+    fake = FakeAdmin()
+    connection = clarus.FirebaseConnection()
+    connection._modules = {
+        "firebase_admin": fake,
+        "auth": Obj(),
+        "credentials": Obj(Certificate=lambda info: ("certificate", info["project_id"])),
+        "firestore": fake,
+    }
+    monkeypatch.setenv("GOOGLE_APPLICATION_CREDENTIALS", "/secrets/service-account.json")
+    fake.connection = connection
+    return fake
+
+
+def test_firestore_client_is_created_once_and_reused(admin):
+    first = admin.connection.firestore_client()
+    second = admin.connection.firestore_client()
+
+    assert first is second
+    assert admin.clients == 1
+    assert admin.initialized == [None]
+
+
+def test_service_account_json_is_used_when_set(admin, monkeypatch):
+    monkeypatch.setenv("FIREBASE_SERVICE_ACCOUNT_JSON", json.dumps({"project_id": "degrondvraag"}))
+
+    assert admin.connection.initialize()
+    assert admin.initialized == [("certificate", "degrondvraag")]
+
+
+def test_client_is_rebuilt_after_a_fork(admin):
+    first = admin.connection.firestore_client()
+    admin.connection._client_pid = -1
+
+    assert admin.connection.firestore_client() is not first
+    assert admin.initialized == [None]
+
+
+def test_failed_setup_backs_off_before_retrying(admin, monkeypatch):
+    monkeypatch.setenv("GOOGLE_APPLICATION_CREDENTIALS", "")
+    now = [1000.0]
+    monkeypatch.setattr(clarus.time, "monotonic", lambda: now[0])
+
+    assert admin.connection.firestore_client() is None
+    monkeypatch.setenv("GOOGLE_APPLICATION_CREDENTIALS", "/secrets/service-account.json")
+    assert admin.connection.firestore_client() is None
+    assert admin.initialized == []
+
+    now[0] += clarus.CLARUS_FIREBASE_RETRY_SECONDS
+    assert admin.connection.firestore_client() is not None
+    assert admin.initialized == [None]
+
+
+def test_backoff_doubles_after_each_failure(admin, monkeypatch):
+    monkeypatch.setenv("GOOGLE_APPLICATION_CREDENTIALS", "")
+    now = [1000.0]
+    monkeypatch.setattr(clarus.time, "monotonic", lambda: now[0])
+
+    waits = []
+    for _ in range(3):
+        assert not admin.connection.initialize()
+        waits.append(admin.connection._retry_at - now[0])
+        now[0] = admin.connection._retry_at
+
+    assert waits == [clarus.CLARUS_FIREBASE_RETRY_SECONDS * factor for factor in (1, 2, 4)]
+
+
+def test_missing_sdk_is_detected_once(monkeypatch):
+    monkeypatch.setitem(sys.modules, "firebase_admin", None)
+    connection = clarus.FirebaseConnection()
+
+    assert connection.modules() is None
+    assert connection.firestore_client() is None
+    assert connection._import_failed
+
+
+def test_import_does_not_touch_firebase():
+    assert clarus.FirebaseConnection()._modules is None
+    assert "firebase_admin" not in dir(clarus)
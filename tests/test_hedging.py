@@ -0,0 +1,126 @@
+import pytest
+
+from conftest import clarus, read_log, sse_events, wait_for
+
+ROUTE = {"name": "standard", "models": ["primary", "fallback"], "maxOutputTokens": 100}
+MESSAGES = [{"role": "user", "content": "Wat is vrijheid?"}]
+
+
+def run(route=ROUTE):
+    """Drive stream_completion to the end and return its events and result."""
+    stream = clarus.stream_completion(MESSAGES, None, route)
+    events = []
+    while True:
+        try:
+            events.append(next(stream))
+        except StopIteration as done:
+            return events, done.value
+
+
+def outcomes(result):
+    return [(attempt["model"], attempt["outcome"]) for attempt in result.get("attempts", [])]
+
+
+@pytest.fixture
+def deadlines(monkeypatch):
+    monkeypatch.setattr(clarus, "CLARUS_FIRST_TOKEN_MS", 100)
+    monkeypatch.setattr(clarus, "CLARUS_TOTAL_MS", 2000)
+
+
+def test_healthy_primary_answers_alone(openai, deadlines):
+    events, result = run()
+
+    assert result["model"] == "primary"
+    assert result["answer"] == "".join(openai.tokens)
+    assert "attempts" not in result
+    assert ("model", {"model": "primary", "hedged": False}) in events
+    assert [call["model"] for call in openai.calls] == ["primary"]
+
+
+def test_missed_first_token_deadline_falls_back(openai, deadlines):
+    openai.delays = {"primary": 0.5}
+
+    events, result = run()
+
+    assert result["model"] == "fallback"
+    assert outcomes(result) == [("primary", "timeout"), ("fallback", "won")]
+    assert ("status", {"message": "Clarus probeert een fallbackmodel."}) in events
+    assert "reset" not in [event for event, _ in events]
+    assert wait_for(lambda: openai.streams[0].closed)
+
+
+def test_missed_total_deadline_falls_back(openai, monkeypatch):
+    monkeypatch.setattr(clarus, "CLARUS_MODEL_DEADLINES", {"primary": {"firstTokenMs": 1000, "totalMs": 150}})
+    openai.delays = {"primary": 0.1}
+
+    _, result = run()
+
+    assert result["model"] == "fallback"
+    assert outcomes(result)[0] == ("primary", "timeout")
+
+
+def test_fallback_after_streamed_tokens_is_preceded_by_a_reset(openai, monkeypatch):
+    monkeypatch.setattr(clarus, "CLARUS_MODEL_DEADLINES", {"primary": {"firstTokenMs": 1000, "totalMs": 150}})
+    openai.delays = {"primary": 0.1}
+
+    events, _ = run()
+
+    names = [event for event, _ in events]
+    assert names.index("token") < names.index("reset") < names.index("model", names.index("reset"))
+    assert ("model", {"model": "fallback", "hedged": False}) == events[names.index("reset") + 1]
+
+
+def test_stream_reader_is_told_to_discard_the_partial_answer(client, openai, monkeypatch):
+    monkeypatch.setattr(clarus, "ROUTES", {**clarus.ROUTES, "standard": ROUTE})
+    monkeypatch.setattr(clarus, "CLARUS_MODEL_DEADLINES", {"primary": {"firstTokenMs": 1000, "totalMs": 150}})
+    openai.delays = {"primary": 0.1}
+
+    with client.post("/chat-stream", json={"vraag": "Waarom vraagt vrijheid om verantwoordelijkheid?"}) as response:
+        events = sse_events(response.get_data(as_text=True))
+
+    names = [event for event, _ in events]
+    after_reset = events[names.index("reset"):]
+    assert "token" in names[:names.index("reset")]
+    assert "".join(data["token"] for event, data in after_reset if event == "token") == "".join(openai.tokens)
+    assert read_log()[-1]["answer"] == "".join(openai.tokens)
+
+
+def test_failed_primary_falls_back(openai, deadlines):
+    openai.failing = {"primary"}
+
+    _, result = run()
+
+    assert outcomes(result) == [("primary", "error"), ("fallback", "won")]
+
+
+def test_every_model_failing_raises_the_last_error(openai, deadlines):
+    openai.failing = {"primary", "fallback"}
+
+    with pytest.raises(RuntimeError, match="fallback is down"):
+        run()
+
+
+def test_hedge_starts_the_next_model_and_cancels_the_loser(openai, deadlines, monkeypatch):
+    monkeypatch.setattr(clarus, "CLARUS_FIRST_TOKEN_MS", 2000)
+    monkeypatch.setattr(clarus, "CLARUS_HEDGE_MS", 50)
+    openai.delays = {"primary": 0.4}
+
+    events, result = run()
+
+    assert result["model"] == "fallback"
+    assert ("model", {"model": "fallback", "hedged": True}) in events
+    assert outcomes(result) == [("primary", "lost"), ("fallback", "won")]
+    assert wait_for(lambda: openai.streams[0].closed)
+    assert not clarus.breakers.get("primary").calls
+
+
+def test_stream_log_records_the_attempts(client, openai, deadlines, monkeypatch):
+    monkeypatch.setattr(clarus, "ROUTES", {**clarus.ROUTES, "standard": ROUTE})
+    openai.failing = {"primary"}
+
+    with client.post("/chat-stream", json={"vraag": "Waarom vraagt vrijheid om verantwoordelijkheid?"}) as response:
+        response.get_data()
+
+    entry = read_log()[-1]
+    assert entry["model"] == "fallback"
+    assert [attempt["outcome"] for attempt in entry["modelAttempts"]] == ["error", "won"]
@@ -0,0 +1,64 @@
+import pytest
+
+from conftest import clarus, read_log, sse_events
+
+
+def intent_of(question):
+    match = clarus.match_intent(clarus.classify_question(question)["tokens"])
+    return match and (match["intent"], match["language"])
+
+
+@pytest.mark.parametrize("question, expected", [
+    ("Wie heeft je gemaakt?", ("identity", "nl")),
+    ("Who made you?", ("identity", "en")),
+    ("Hi, who is behind this website?", ("identity", "en")),
+    ("Wat is Clarus eigenlijk?", ("about", "nl")),
+    ("What can you do?", ("about", "en")),
+    ("Waar kan ik een bug melden?", ("feedback", "nl")),
+])
+def test_fixed_rule_questions_match_their_intent(question, expected):
+    assert intent_of(question) == expected
+
+
+@pytest.mark.parametrize("question", [
+    "Who made you and what do you think about evil?",
+    "Wie schreef het essay over vrijheid en waarom koos hij die titel?",
+    "Who are you and who made you?",
+    "Wat is vrijheid?",
+])
+def test_mixed_or_ambiguous_questions_go_to_the_model(question):
+    assert intent_of(question) is None
+
+
+def test_intent_is_answered_locally_in_the_cue_language(client, openai):
+    response = client.post("/chat", json={"vraag": "Who made you?"})
+
+    entry = read_log()[-1]
+    assert response.get_json()["antwoord"] == clarus.INTENT_ANSWERS["identity"]["en"]
+    assert openai.calls == []
+    assert entry["status"] == "answered_intent"
+    assert entry["intent"] == "identity"
+    assert entry["intentConfidence"] >= clarus.CLARUS_INTENT_THRESHOLD
+
+
+def test_language_hint_overrides_the_cue_language(client, openai):
+    response = client.post("/chat", json={"vraag": "Who made you?", "language": "nl"})
+
+    assert response.get_json()["antwoord"] == clarus.INTENT_ANSWERS["identity"]["nl"]
+
+
+def test_stream_sends_the_local_answer(client, openai):
+    with client.post("/chat-stream", json={"vraag": "Wie heeft je gemaakt?"}) as response:
+        events = sse_events(response.get_data(as_text=True))
+
+    assert "".join(data["token"] for event, data in events if event == "token") == clarus.INTENT_ANSWERS["identity"]["nl"]
+    assert events[-1][0] == "done"
+    assert openai.calls == []
+
+
+def test_intents_can_be_turned_off(client, openai, monkeypatch):
+    monkeypatch.setattr(clarus, "CLARUS_INTENTS", False)
+
+    client.post("/chat", json={"vraag": "Who made you?"})
+
+    assert len(openai.calls) == 1
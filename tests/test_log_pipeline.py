@@ -0,0 +1,116 @@
+import threading
+import time
+
+import pytest
+
+from conftest import clarus, read_log, wait_for
+
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    """Asynchronous logging with a recording Firestore sink that can be held back."""
+    batches = []
+    gate = threading.Event()
+    gate.set()
+    firestore = {"up": True}
+
+    def write_firestore_logs(entries):
+        gate.wait(5)
+        if not firestore["up"]:
+            return False
+        batches.append([entry["id"] for entry in entries])
+        return True
+
+    monkeypatch.setattr(clarus, "CLARUS_LOG_ASYNC", True)
+    monkeypatch.setattr(clarus, "write_firestore_logs", write_firestore_logs)
+    monkeypatch.setattr(clarus, "log_pipeline", clarus.LogPipeline())
+    clarus.log_pipeline.batches = batches
+    clarus.log_pipeline.gate = gate
+    clarus.log_pipeline.firestore = firestore
+    yield clarus.log_pipeline
+    gate.set()
+    clarus.log_pipeline.flush()
+
+
+def entry(number):
+    return {"id": f"log-{number}", "timestamp": f"2026-01-01T00:00:{number:02d}+00:00", "status": "completed"}
+
+
+def test_requests_do_not_wait_for_the_log_sinks(client, openai, pipeline):
+    pipeline.gate.clear()
+
+    started = time.monotonic()
+    response = client.post("/chat", json={"vraag": "Wat is vrijheid?"})
+    elapsed = time.monotonic() - started
+
+    assert response.status_code == 200
+    assert elapsed < 1
+    assert read_log() == []
+    pipeline.gate.set()
+    assert pipeline.flush()
+    assert read_log()[-1]["id"] == response.get_json()["logId"]
+
+
+def test_entries_are_written_in_batches(pipeline):
+    pipeline.gate.clear()
+    for number in range(10):
+        clarus.append_log(entry(number))
+    pipeline.gate.set()
+
+    assert pipeline.flush()
+    assert sum(len(batch) for batch in pipeline.batches) == 10
+    assert len(pipeline.batches) < 10
+    assert [logged["id"] for logged in read_log()] == [f"log-{number}" for number in range(10)]
+    assert pipeline.stats()["written"] == 10
+
+
+def test_full_queue_drops_entries_under_the_drop_policy(monkeypatch, pipeline):
+    monkeypatch.setattr(clarus, "CLARUS_LOG_QUEUE_SIZE", 2)
+    monkeypatch.setattr(clarus, "CLARUS_LOG_BATCH_SIZE", 1)
+    monkeypatch.setattr(clarus, "CLARUS_LOG_DROP_POLICY", "drop")
+    monkeypatch.setattr(clarus, "log_pipeline", clarus.LogPipeline())
+    pipeline.gate.clear()
+    clarus.log_pipeline.submit(entry(0))
+    assert wait_for(lambda: clarus.log_pipeline.stats()["queueDepth"] == 0)
+
+    accepted = [clarus.log_pipeline.submit(entry(number)) for number in range(1, 5)]
+    pipeline.gate.set()
+
+    assert accepted == [True, True, False, False]
+    assert clarus.log_pipeline.stats()["dropped"] == 2
+    assert clarus.log_pipeline.flush()
+    assert [logged["id"] for logged in read_log()] == ["log-0", "log-1", "log-2"]
+
+
+def test_a_failed_batch_does_not_stop_the_writer(monkeypatch, pipeline):
+    pipeline.firestore["up"] = False
+    original = clarus.log_store.append
+    monkeypatch.setattr(clarus.log_store, "append", lambda entries: (_ for _ in ()).throw(OSError("disk full")))
+    clarus.append_log(entry(1))
+    assert pipeline.flush()
+
+    monkeypatch.setattr(clarus.log_store, "append", original)
+    clarus.append_log(entry(2))
+    assert pipeline.flush()
+
+    assert pipeline.stats()["failed"] == 1
+    assert pipeline.stats()["written"] == 1
+    assert [logged["id"] for logged in read_log()] == ["log-2"]
+
+
+def test_written_counts_only_committed_entries(pipeline):
+    pipeline.firestore["up"] = False
+    clarus.append_log(entry(1), to_file=False)
+    clarus.append_log(entry(2))
+    assert pipeline.flush()
+
+    assert pipeline.stats()["written"] == 1
+    assert pipeline.stats()["failed"] == 1
+
+
+def test_started_entries_reach_firestore_but_not_the_file(pipeline):
+    clarus.append_log(entry(1), to_file=False)
+    assert pipeline.flush()
+
+    assert pipeline.batches == [["log-1"]]
+    assert read_log() == []
@@ -0,0 +1,99 @@
+import gzip
+import os
+import time
+
+import pytest
+
+from conftest import clarus
+
+
+def entry(number):
+    return {"id": f"log-{number:02d}", "timestamp": f"2026-03-01T12:{number:02d}:00+00:00", "status": "completed"}
+
+
+@pytest.fixture
+def store(monkeypatch, tmp_path):
+    monkeypatch.setattr(clarus, "CLARUS_LOG_ROTATE_BYTES", 1)
+    monkeypatch.setattr(clarus, "CLARUS_LOG_INDEX_LINES", 3)
+    return clarus.JsonlLogStore(tmp_path / "logs" / "clarus.jsonl")
+
+
+def fill(store, batches=3, size=7):
+    for start in range(0, batches * size, size):
+        store.append([entry(number) for number in range(start, start + size)])
+
+
+def test_size_rotation_writes_indexed_gzip_segments(store):
+    fill(store)
+
+    segments = store.load_index()["segments"]
+    assert [segment["lines"] for segment in segments] == [7, 7]
+    assert [member["line"] for member in segments[0]["members"]] == [0, 3, 6]
+    assert segments[1]["first"] == entry(7)["timestamp"]
+    assert segments[1]["last"] == entry(13)["timestamp"]
+    with gzip.open(store.path.with_name(segments[0]["file"]), "rt", encoding="utf-8") as segment:
+        assert [line for line in segment] == [clarus.json.dumps(entry(number)) + "\n" for number in range(7)]
+    assert len(store.path.read_text(encoding="utf-8").splitlines()) == 7
+
+
+def test_tail_reads_newest_first_across_segments(store):
+    fill(store)
+
+    assert [logged["id"] for logged in store.tail(10)] == [entry(number)["id"] for number in range(20, 10, -1)]
+    assert len(store.tail(100)) == 21
+
+
+def test_tail_decompresses_only_the_members_it_needs(store, monkeypatch):
+    fill(store)
+    decompressed = []
+    original = clarus.gzip.decompress
+    monkeypatch.setattr(clarus.gzip, "decompress", lambda raw: decompressed.append(raw) or original(raw))
+
+    store.tail(7)
+    assert decompressed == []
+    store.tail(8)
+    assert len(decompressed) == 1
+    store.tail(11)
+    assert len(decompressed) == 1 + 2
+
+
+def test_tail_skips_malformed_lines(store):
+    store.path.parent.mkdir(parents=True)
+    store.path.write_text('{"id": "log-00"}\nnot json\n{"id": "log-01"}', encoding="utf-8")
+
+    assert [logged["id"] for logged in clarus.JsonlLogStore(store.path).tail(5)] == ["log-01", "log-00"]
+
+
+def test_daily_rotation_starts_a_new_file_each_day(monkeypatch, tmp_path):
+    monkeypatch.setattr(clarus, "CLARUS_LOG_ROTATE", "daily")
+    store = clarus.JsonlLogStore(tmp_path / "clarus.jsonl")
+    store.append([entry(1)])
+    store.append([entry(2)])
+    assert store.load_index()["segments"] == []
+
+    yesterday = time.time() - 86400
+    os.utime(store.path, (yesterday, yesterday))
+    store.append([entry(3)])
+
+    assert [segment["lines"] for segment in store.load_index()["segments"]] == [2]
+    assert [logged["id"] for logged in store.tail(5)] == ["log-03", "log-02", "log-01"]
+
+
+def test_writer_follows_a_rotation_by_another_worker(store):
+    other = clarus.JsonlLogStore(store.path)
+    store.append([entry(1)])
+    other.append([entry(2)])
+    store.append([entry(3)])
+
+    assert [logged["id"] for logged in store.tail(5)] == ["log-03", "log-02", "log-01"]
+    assert store.path.read_text(encoding="utf-8").count("\n") == 1
+
+
+def test_admin_route_reads_the_tail_across_segments(client, admin_headers, store, monkeypatch):
+    monkeypatch.setattr(clarus, "log_store", store)
+    fill(store)
+
+    response = client.get("/admin/clarus/logs", headers=admin_headers, query_string={"limit": 10})
+
+    assert response.status_code == 200
+    assert [logged["id"] for logged in response.get_json()["logs"]] == [entry(number)["id"] for number in range(20, 10, -1)]
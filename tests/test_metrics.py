@@ -0,0 +1,119 @@
+import pytest
+
+from conftest import clarus
+
+QUESTION = {"vraag": "Waarom is vrijheid zonder verantwoordelijkheid leeg?"}
+
+
+def scrape(client, **headers):
+    response = client.get("/metrics", headers=headers)
+    assert response.status_code == 200
+    return response.get_data(as_text=True).splitlines()
+
+
+def value(lines, series):
+    return next(float(line.rsplit(" ", 1)[1]) for line in lines if line.rsplit(" ", 1)[0] == series)
+
+
+@pytest.fixture
+def shared_metrics(monkeypatch, tmp_path):
+    monkeypatch.setattr(clarus, "CLARUS_METRICS_BACKEND", "sqlite")
+    monkeypatch.setattr(clarus, "CLARUS_METRICS_PATH", tmp_path / "metrics.sqlite3")
+    return lambda: clarus.Metrics()
+
+
+def test_requests_tokens_and_latency_are_exposed(client, openai):
+    client.post("/chat", json=QUESTION)
+    client.post("/chat", json={"vraag": "Who made you?"})
+
+    lines = scrape(client)
+    model = clarus.ROUTES["standard"]["models"][0]
+    labels = f'language="nl",model="{model}",route="standard",status="completed"'
+    assert "# TYPE clarus_requests_total counter" in lines
+    assert value(lines, f"clarus_requests_total{{{labels}}}") == 1
+    assert value(lines, 'clarus_requests_total{language="en",model="intent-router",route="none",status="answered_intent"}') == 1
+    assert value(lines, f'clarus_tokens_total{{kind="cached",model="{model}",route="standard"}}') == 64
+    assert value(lines, f'clarus_request_seconds_bucket{{{labels},le="+Inf"}}') == 1
+    assert value(lines, f"clarus_request_seconds_count{{{labels}}}") == 1
+    assert value(lines, 'clarus_stage_seconds_count{stage="build_messages"}') >= 1
+
+
+def test_histogram_buckets_are_cumulative():
+    metrics = clarus.Metrics()
+    for seconds in (0.002, 0.2, 3.0):
+        metrics.observe("clarus_request_seconds", seconds, route="standard")
+
+    lines = clarus.render_metrics(metrics.snapshot()).splitlines()
+
+    assert value(lines, 'clarus_request_seconds_bucket{route="standard",le="0.001"}') == 0
+    assert value(lines, 'clarus_request_seconds_bucket{route="standard",le="0.005"}') == 1
+    assert value(lines, 'clarus_request_seconds_bucket{route="standard",le="0.25"}') == 2
+    assert value(lines, 'clarus_request_seconds_bucket{route="standard",le="+Inf"}') == 3
+    assert value(lines, 'clarus_request_seconds_sum{route="standard"}') == pytest.approx(3.202)
+
+
+def test_large_counters_and_label_values_render_exactly():
+    metrics = clarus.Metrics()
+    metrics.inc("clarus_tokens_total", 12345678901234, model='gpt "x"\nnew', route="standard", kind="prompt")
+
+    text = clarus.render_metrics(metrics.snapshot())
+
+    assert 'clarus_tokens_total{kind="prompt",model="gpt \\"x\\"\\nnew",route="standard"} 12345678901234' in text
+
+
+def test_runtime_state_is_exported(client, openai, monkeypatch):
+    monkeypatch.setattr(clarus, "CLARUS_BREAKER_MIN_CALLS", 1)
+    clarus.breakers.record("primary", False, 10)
+    clarus.stream_slots.rejected = 2
+
+    lines = scrape(client)
+
+    assert value(lines, 'clarus_breaker_open{model="primary"}') == 1
+    assert value(lines, "clarus_streams_rejected_total") == 2
+    assert "# TYPE clarus_streams_active gauge" in lines
+
+
+def test_scrapes_can_require_a_token(client, monkeypatch):
+    monkeypatch.setattr(clarus, "CLARUS_METRICS_TOKEN", "scrape-secret")
+
+    assert client.get("/metrics").status_code == 403
+    assert client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 403
+    assert scrape(client, Authorization="Bearer scrape-secret")
+
+
+def test_metrics_can_be_turned_off(client, openai, monkeypatch):
+    monkeypatch.setattr(clarus, "CLARUS_METRICS", False)
+    client.post("/chat", json=QUESTION)
+
+    assert client.get("/metrics").status_code == 404
+    assert not any(name == "clarus_requests_total" for name, _ in clarus.metrics.snapshot()["counters"])
+
+
+def test_shared_backend_sums_every_worker(shared_metrics):
+    first, second = shared_metrics(), shared_metrics()
+    first.inc("clarus_requests_total", 2, status="completed")
+    first.observe("clarus_request_seconds", 0.2, status="completed")
+    first.flush()
+    second.inc("clarus_requests_total", 3, status="completed")
+    second.observe("clarus_request_seconds", 0.3, status="completed")
+
+    lines = clarus.render_metrics(second.collect()).splitlines()
+
+    assert value(lines, 'clarus_requests_total{status="completed"}') == 5
+    assert value(lines, 'clarus_request_seconds_count{status="completed"}') == 2
+
+
+def test_exited_workers_are_folded_into_one_row(shared_metrics):
+    gone, alive = shared_metrics(), shared_metrics()
+    gone.inc("clarus_requests_total", 4, status="completed")
+    gone.flush()
+    db = alive._connect()
+    db.execute("UPDATE metrics SET pid = ? WHERE process = ?", (2 ** 22 + 1, gone._process))
+    alive.inc("clarus_requests_total", 1, status="completed")
+
+    first = clarus.render_metrics(alive.collect())
+    second = clarus.render_metrics(alive.collect())
+
+    assert first == second
+    assert 'clarus_requests_total{status="completed"} 5' in first
+    assert [row[0] for row in db.execute("SELECT process FROM metrics ORDER BY process")] == sorted([alive._process, "retired"])
@@ -0,0 +1,52 @@
+import pytest
+
+from conftest import clarus, read_log
+
+FILLER = "De zee is stil en het licht valt laag over het water. " * 8
+PARAGRAPHS = [f"Alinea {number}. {FILLER}" for number in range(12)]
+PARAGRAPHS[8] = "Het kompas van een mens is zijn geweten. " * 11
+ESSAY = "".join(f"<p>{paragraph}</p>" for paragraph in PARAGRAPHS)
+QUESTION = "Wat bedoelt de schrijver met het kompas?"
+
+
+@pytest.fixture
+def small_budget(monkeypatch):
+    monkeypatch.setattr(clarus, "CLARUS_INPUT_TOKEN_BUDGET", clarus.STATIC_PROMPT_TOKENS + 600)
+
+
+def essay_prompt(call):
+    return next(message["content"] for message in call["messages"] if message["content"].startswith("Current essay title"))
+
+
+def test_paragraphs_become_passages_near_the_target_size():
+    passages = clarus.split_essay_passages(["Kort.", "Ook kort.", "Een lange zin over niets. " * 50, "Slot."])
+
+    assert passages[0] == "Kort.\n\nOok kort."
+    assert all(len(passage) <= clarus.CLARUS_PASSAGE_CHARS for passage in passages[1:-1])
+    assert passages[-1].endswith("Slot.")
+
+
+def test_short_essay_is_sent_whole(client, openai):
+    client.post("/chat", json={"vraag": QUESTION, "essay": "<p>Kort essay over het kompas.</p>"})
+
+    assert essay_prompt(openai.calls[-1]).endswith("Kort essay over het kompas.")
+    assert read_log()[-1]["essayPassages"] is None
+
+
+def test_long_essay_keeps_the_opening_and_the_matching_passage(client, openai, small_budget):
+    client.post("/chat", json={"vraag": QUESTION, "essay": ESSAY})
+
+    prompt = essay_prompt(openai.calls[-1])
+    chosen = read_log()[-1]["essayPassages"]
+    assert chosen == sorted(chosen)
+    assert chosen[:3] == [0, 1, 2]
+    assert 8 in chosen and 11 not in chosen
+    assert "Het kompas van een mens" in prompt
+    assert "Alinea 11." not in prompt
+    assert prompt.rstrip().endswith("[...]")
+
+
+def test_passages_follow_the_question(client, openai, small_budget):
+    client.post("/chat", json={"vraag": "Waarom valt het licht laag over de zee?", "essay": ESSAY})
+
+    assert 8 not in read_log()[-1]["essayPassages"]
@@ -0,0 +1,60 @@
+from conftest import clarus, read_log
+
+QUESTION = "Wat bedoelt de schrijver met verantwoordelijkheid?"
+HISTORY = [
+    {"role": "user" if turn % 2 == 0 else "assistant", "content": f"Beurt {turn}. " + "Een lange overweging over kiezen. " * 12}
+    for turn in range(12)
+]
+
+
+def history_sent(call):
+    return [message["content"] for message in call["messages"] if message["role"] in {"user", "assistant"}][:-1]
+
+
+def test_prompt_fits_the_budget_and_reports_its_sections(client, openai):
+    client.post("/chat", json={"vraag": QUESTION, "essay": "<p>Kort.</p>", "history": HISTORY})
+
+    tokens = read_log()[-1]["promptTokens"]
+    sections = ("system", "question", "essay", "corpus", "history")
+    assert tokens["budget"] == clarus.CLARUS_INPUT_TOKEN_BUDGET
+    assert tokens["total"] == sum(tokens[section] for section in sections) <= tokens["budget"]
+    assert tokens["dropped"] == {"essay": 0, "corpus": 0, "history": 0}
+    assert len(history_sent(openai.calls[-1])) == len(HISTORY)
+
+
+def test_tight_budget_drops_the_oldest_turns_first(client, openai, monkeypatch):
+    monkeypatch.setattr(clarus, "CLARUS_INPUT_TOKEN_BUDGET", clarus.STATIC_PROMPT_TOKENS + 400)
+
+    client.post("/chat", json={"vraag": QUESTION, "history": HISTORY})
+
+    sent = history_sent(openai.calls[-1])
+    tokens = read_log()[-1]["promptTokens"]
+    assert 0 < len(sent) < len(HISTORY)
+    assert sent == [turn["content"] for turn in HISTORY[-len(sent):]]
+    assert tokens["dropped"]["history"] == len(HISTORY) - len(sent)
+    assert tokens["total"] <= tokens["budget"]
+
+
+def test_tight_budget_keeps_the_best_ranked_corpus_essays(client, openai, monkeypatch):
+    corpus = [
+        {"id": f"essay-{number}", "title": f"Over schuld {number}", "excerpt": "Schuld en boete. " * (20 + number)}
+        for number in range(6)
+    ]
+    monkeypatch.setattr(clarus, "CLARUS_INPUT_TOKEN_BUDGET", clarus.STATIC_PROMPT_TOKENS + 450)
+
+    client.post("/chat", json={"vraag": "Welk essay gaat over schuld?", "essayCorpus": corpus})
+
+    entry = read_log()[-1]
+    ranked = [item["id"] for item in clarus.retrieve_corpus(clarus.register_corpus(corpus), clarus.build_query("Welk essay gaat over schuld?", []))]
+    assert 0 < len(entry["corpusRetrieved"]) < len(ranked)
+    assert entry["corpusRetrieved"] == ranked[:len(entry["corpusRetrieved"])]
+    assert entry["promptTokens"]["dropped"]["corpus"] == len(ranked) - len(entry["corpusRetrieved"])
+
+
+def test_model_budget_overrides_the_default(client, openai, monkeypatch):
+    monkeypatch.setattr(clarus, "CLARUS_MODEL_TOKEN_BUDGETS", {clarus.CLARUS_MODEL: clarus.STATIC_PROMPT_TOKENS + 400})
+
+    client.post("/chat", json={"vraag": QUESTION, "history": HISTORY})
+
+    assert read_log()[-1]["promptTokens"]["budget"] == clarus.STATIC_PROMPT_TOKENS + 400
+    assert len(history_sent(openai.calls[-1])) < len(HISTORY)
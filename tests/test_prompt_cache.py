@@ -0,0 +1,45 @@
+from conftest import clarus, read_log
+
+QUESTION = "Wat bedoelt de schrijver met verantwoordelijkheid?"
+
+
+def test_static_instructions_lead_every_prompt(client, openai):
+    client.post("/chat", json={"vraag": QUESTION, "essay": "<p>Eerste essay.</p>"})
+    client.post("/chat", json={"vraag": "What does the author mean?", "essay": "<p>Second essay.</p>", "language": "en"})
+
+    first, second = (call["messages"] for call in openai.calls)
+    assert first[0] == second[0] == {"role": "system", "content": clarus.STATIC_PROMPT}
+    assert first[-1] == {"role": "user", "content": QUESTION}
+    assert first[-2]["content"].startswith("Antwoord in het Nederlands.")
+    assert second[-2]["content"].startswith("Answer in English.")
+
+
+def test_prompt_cache_key_follows_the_context_versions(client, openai):
+    client.post("/chat", json={"vraag": QUESTION, "essay": "<p>Eerste essay.</p>"})
+    client.post("/chat", json={"vraag": "En wat betekent schuld?", "essay": "<p>Eerste essay.</p>"})
+    client.post("/chat", json={"vraag": QUESTION, "essay": "<p>Tweede essay.</p>"})
+
+    keys = [call["prompt_cache_key"] for call in openai.calls]
+    assert keys[0] == keys[1] != keys[2]
+    assert keys[0].startswith("clarus:")
+
+
+def test_prompt_cache_key_can_be_fixed_or_turned_off(client, openai, monkeypatch):
+    monkeypatch.setattr(clarus, "CLARUS_PROMPT_CACHE_KEY", "clarus-shared")
+    client.post("/chat", json={"vraag": QUESTION})
+    monkeypatch.setattr(clarus, "CLARUS_PROMPT_CACHE_KEY", "off")
+    client.post("/chat", json={"vraag": "En wat betekent schuld?"})
+
+    assert openai.calls[0]["prompt_cache_key"] == "clarus-shared"
+    assert "prompt_cache_key" not in openai.calls[1]
+
+
+def test_cached_prompt_tokens_are_logged(client, openai):
+    client.post("/chat", json={"vraag": QUESTION})
+    with client.post("/chat-stream", json={"vraag": "En wat betekent schuld?"}) as response:
+        response.get_data()
+
+    entries = read_log()
+    assert [entry["cachedTokens"] for entry in entries] == [64, 64]
+    assert entries[0]["usage"]["prompt_tokens_details"]["cached_tokens"] == 64
+    assert openai.calls[1]["stream_options"] == {"include_usage": True}
@@ -0,0 +1,73 @@
+from conftest import clarus
+
+ESSAY = {
+    "essayId": "essay-vrijheid",
+    "essayTitle": "Vrijheid",
+    "essay": "<p>Vrijheid zonder verantwoordelijkheid is leeg.</p><p>Wie kiest, draagt de gevolgen.</p>",
+}
+CORPUS = [
+    {"id": "vrijheid", "title": "Vrijheid", "excerpt": "Over kiezen en dragen."},
+    {"id": "schuld", "title": "Schuld", "excerpt": "Over wat we elkaar verschuldigd zijn."},
+]
+
+
+def test_registered_essay_is_answered_by_version(client, openai):
+    registered = client.post("/clarus/essays", json=ESSAY).get_json()
+
+    response = client.post("/chat", json={"vraag": "Wat bedoelt de auteur?", "essayVersion": registered["essayVersion"]})
+
+    assert response.status_code == 200
+    assert registered["essayId"] == ESSAY["essayId"]
+    prompt = "\n".join(message["content"] for message in openai.calls[-1]["messages"])
+    assert "Wie kiest, draagt de gevolgen." in prompt
+
+
+def test_registered_corpus_reports_its_version_and_size(client):
+    first = client.post("/clarus/corpus", json={"essayCorpus": CORPUS}).get_json()
+    second = client.post("/clarus/corpus", json={"essayCorpus": list(CORPUS)}).get_json()
+
+    assert first == second
+    assert first["corpusSize"] == 2
+
+
+def test_unknown_version_asks_for_an_upload(client, openai):
+    response = client.post("/chat", json={"vraag": "Wat bedoelt de auteur?", "essayVersion": "0" * 64})
+
+    assert response.status_code == 409
+    assert response.get_json()["uploadRequired"] == "essay"
+    assert openai.calls == []
+
+
+def test_empty_uploads_are_rejected(client):
+    assert client.post("/clarus/essays", json={"essayId": "leeg"}).status_code == 400
+    assert client.post("/clarus/corpus", json={"essayCorpus": []}).status_code == 400
+
+
+def test_oversized_upload_is_refused_before_hashing(client, monkeypatch):
+    hashed = []
+    monkeypatch.setitem(clarus.app.config, "MAX_CONTENT_LENGTH", 1024)
+    monkeypatch.setattr(clarus, "content_version", lambda value: hashed.append(value) or "x")
+
+    response = client.post("/clarus/essays", json={**ESSAY, "essay": "woord " * 1000})
+    corpus = client.post("/clarus/corpus", json={"essayCorpus": CORPUS * 50})
+
+    assert response.status_code == 413
+    assert corpus.status_code == 413
+    assert "error" in response.get_json()
+    assert hashed == []
+
+
+def test_uploads_share_the_client_rate_limit(client, monkeypatch):
+    monkeypatch.setattr(clarus, "CLARUS_RATE_PER_MINUTE", 60.0)
+    monkeypatch.setattr(clarus, "CLARUS_RATE_BURST", 2)
+
+    codes = [
+        client.post("/clarus/essays", json=ESSAY).status_code,
+        client.post("/clarus/corpus", json={"essayCorpus": CORPUS}).status_code,
+        client.post("/clarus/essays", json=ESSAY).status_code,
+    ]
+    limited = client.post("/chat", json={"vraag": "Wie heeft je gemaakt?"})
+
+    assert codes == [200, 200, 429]
+    assert limited.status_code == 429
+    assert limited.headers["Retry-After"]
@@ -0,0 +1,55 @@
+from conftest import clarus, read_log
+
+TOPICS = ["vrijheid", "schuld", "angst", "liefde", "macht", "tijd", "dood", "waarheid", "taal", "arbeid"]
+CORPUS = [
+    {
+        "id": topic,
+        "title": f"Over {topic}",
+        "path": f"/essays/{topic}",
+        "categories": ["filosofie"],
+        "excerpt": f"Een beschouwing over {topic}.",
+        "body": f"Dit stuk gaat over {topic} en wat {topic} van ons vraagt.",
+    }
+    for topic in TOPICS
+]
+
+
+def test_tokenize_folds_accents_stems_and_drops_stopwords():
+    assert clarus.tokenize("Wat zijn de Ideeën over Vrijheden?") == clarus.tokenize("ideeen vrijheden")
+    assert clarus.tokenize("Ideeën")[0] == "idee"
+    assert clarus.tokenize("the essays of freedom") == ["freedom"]
+
+
+def test_bm25_ranks_the_matching_document_first():
+    index = clarus.BM25Index([clarus.tokenize(item["body"]) for item in CORPUS])
+
+    ranked = index.top(clarus.build_query("Wat zegt de schrijver over schuld?", []), 3)
+
+    assert ranked[0][0] == TOPICS.index("schuld")
+    assert len(ranked) == 1
+
+
+def test_history_terms_count_at_half_weight():
+    history = [{"role": "user", "content": "En angst?"}, {"role": "assistant", "content": "Liefde"}]
+
+    query = clarus.build_query("En over de dood?", history)
+
+    assert query == {"angst": 0.5, "dood": 1.0}
+
+
+def test_corpus_question_sends_only_the_best_matching_essays(client, openai):
+    client.post("/chat", json={"vraag": "Welk essay gaat over de waarheid?", "essayCorpus": CORPUS, "contextType": "archive"})
+
+    entry = read_log()[-1]
+    prompt = "\n".join(message["content"] for message in openai.calls[-1]["messages"])
+    assert entry["corpusRetrieved"][0] == "waarheid"
+    assert len(entry["corpusRetrieved"]) <= clarus.CLARUS_CORPUS_TOP_K
+    assert entry["corpusSize"] == len(CORPUS)
+    assert "/essays/waarheid" in prompt
+    assert "/essays/arbeid" not in prompt
+
+
+def test_corpus_question_without_matches_falls_back_to_the_first_essays(client, openai):
+    client.post("/chat", json={"vraag": "Wat raad je aan?", "essayCorpus": CORPUS})
+
+    assert read_log()[-1]["corpusRetrieved"] == TOPICS[:clarus.CLARUS_CORPUS_TOP_K]
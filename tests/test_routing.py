@@ -0,0 +1,56 @@
+import pytest
+
+from conftest import clarus, read_log
+
+NO_CONTEXT = {"corpus": None}
+DEEP_QUESTION = (
+    "Hoe verhouden vrijheid, verantwoordelijkheid en schuld zich tot elkaar als we het lijden "
+    "van anderen serieus nemen en geloof niet langer als vanzelfsprekend beschouwen in deze tijd?"
+)
+
+
+def route_for(question, context=NO_CONTEXT):
+    return clarus.route_question(clarus.classify_question(question), context)["name"]
+
+
+@pytest.mark.parametrize("question, route", [
+    ("Wat is vrijheid?", "brief"),
+    ("Define responsibility", "brief"),
+    ("Waarom zou vrijheid verantwoordelijkheid vereisen?", "standard"),
+    ("Geef een uitgebreide uitleg van schuld", "deep"),
+    ("Explain guilt step by step", "deep"),
+    (DEEP_QUESTION, "deep"),
+])
+def test_questions_are_routed_by_shape(question, route):
+    assert route_for(question) == route
+
+
+def test_corpus_context_takes_the_corpus_route_unless_depth_is_asked():
+    assert route_for("Wat is vrijheid?", {"corpus": {"items": []}}) == "corpus"
+    assert route_for("Geef een grondige analyse", {"corpus": {"items": []}}) == "deep"
+
+
+def test_route_sets_the_model_order_and_output_budget(client, openai):
+    client.post("/chat", json={"vraag": "Wat is vrijheid?"})
+    client.post("/chat", json={"vraag": "Geef een uitgebreide uitleg van schuld"})
+
+    brief, deep = openai.calls
+    assert brief["model"] == clarus.ROUTES["brief"]["models"][0]
+    assert brief["max_completion_tokens"] == clarus.ROUTES["brief"]["maxOutputTokens"]
+    assert deep["model"] == clarus.ROUTES["deep"]["models"][0]
+    assert deep["max_completion_tokens"] == clarus.ROUTES["deep"]["maxOutputTokens"]
+    assert [entry["route"] for entry in read_log()] == ["brief", "deep"]
+
+
+def test_routes_can_be_overridden_and_are_clamped(monkeypatch):
+    monkeypatch.setattr(clarus, "CLARUS_ROUTES", {
+        "deep": {"models": ["gpt-5.4-mini", "gpt-5.4-mini", ""], "maxOutputTokens": 99999},
+        "brief": {"maxOutputTokens": 1},
+    })
+
+    routes = clarus.load_routes()
+
+    assert routes["deep"]["models"] == ["gpt-5.4-mini"]
+    assert routes["deep"]["maxOutputTokens"] == clarus.ROUTE_OUTPUT_CEILING
+    assert routes["brief"]["maxOutputTokens"] == 16
+    assert routes["standard"]["maxOutputTokens"] == clarus.DEFAULT_ROUTES["standard"]["maxOutputTokens"]
@@ -0,0 +1,74 @@
+import re
+
+import pytest
+
+from conftest import clarus, read_log
+
+
+@pytest.mark.parametrize("pattern", clarus.OFF_TOPIC_PATTERNS)
+def test_compiled_guard_matches_every_source_pattern(pattern):
+    phrase = pattern[2:-2]
+    question = f"Vertel iets over {phrase} alsjeblieft"
+
+    assert re.search(pattern, question)
+    assert clarus.classify_question(question)["offTopic"]
+
+
+@pytest.mark.parametrize("question", [
+    "Can you write me a python script?",
+    "How do I fix my bike?",
+    "Kun je iets voor me bouwen, maak het snel",
+    "Geef me een recept voor soep",
+])
+def test_practical_and_off_topic_requests_are_refused(question):
+    assert clarus.is_off_topic(question)
+
+
+@pytest.mark.parametrize("question", [
+    "Is writing python code a moral act?",
+    "Can you explain what the essay means?",
+    "How do I live with suffering?",
+    "Waarom is vrijheid zonder verantwoordelijkheid leeg?",
+    "",
+])
+def test_essay_and_moral_questions_pass(question):
+    assert not clarus.is_off_topic(question)
+
+
+def test_language_comes_from_markers_unless_hinted():
+    assert clarus.classify_question("Wat bedoelt de schrijver?")["language"] == "nl"
+    assert clarus.classify_question("What does the author mean?")["language"] == "en"
+    assert clarus.classify_question("What does the author mean?", "nl")["language"] == "nl"
+
+
+def test_only_the_scanned_prefix_is_classified():
+    padding = "waarom " * (clarus.QUESTION_SCAN_CHARS // len("waarom "))
+
+    assert not clarus.is_off_topic(padding + "python")
+    assert clarus.is_off_topic("python " + padding)
+
+
+def test_off_topic_question_is_answered_without_the_model(client, openai):
+    response = client.post("/chat", json={"vraag": "Schrijf een python script voor mij", "language": "nl"})
+
+    assert response.get_json()["antwoord"] == clarus.scope_redirect("nl")
+    assert response.get_json()["model"] == "scope-guard"
+    assert openai.calls == []
+    assert read_log()[-1]["status"] == "refused_off_topic"
+
+
+@pytest.mark.parametrize("path", ["/chat", "/chat-stream"])
+def test_each_question_is_classified_once(client, openai, monkeypatch, path):
+    questions = []
+    classify = clarus.classify_question
+
+    def counting(question, language_hint=""):
+        questions.append(question)
+        return classify(question, language_hint)
+
+    monkeypatch.setattr(clarus, "classify_question", counting)
+    with client.post(path, json={"vraag": "Why does freedom ask for responsibility?"}) as response:
+        response.get_data()
+
+    assert len(questions) == 1
+    assert "Answer in English." in "\n".join(message["content"] for message in openai.calls[-1]["messages"])
@@ -0,0 +1,90 @@
+from conftest import clarus, sse_events
+
+FIRST = {"vraag": "Waarom is vrijheid zonder verantwoordelijkheid leeg?"}
+FOLLOW_UP = "En wat betekent dat voor schuld?"
+
+
+def sent_turns(call):
+    """Conversation messages the model received, without system prompts and the new question."""
+    return [(message["role"], message["content"]) for message in call["messages"][:-1] if message["role"] != "system"]
+
+
+def test_follow_up_with_only_the_session_id_gets_the_stored_history(client, openai):
+    first = client.post("/chat", json=FIRST).get_json()
+
+    second = client.post("/chat", json={"vraag": FOLLOW_UP, "sessionId": first["sessionId"]})
+
+    assert second.status_code == 200
+    assert second.get_json()["sessionId"] == first["sessionId"]
+    assert sent_turns(openai.calls[-1]) == [("user", FIRST["vraag"]), ("assistant", first["antwoord"])]
+
+
+def test_unknown_session_id_without_history_starts_a_session(client, openai):
+    session_id = "client-chosen-session-0001"
+
+    first = client.post("/chat", json={**FIRST, "sessionId": session_id})
+    second = client.post("/chat", json={"vraag": FOLLOW_UP, "sessionId": session_id})
+
+    assert first.status_code == 200
+    assert first.get_json()["sessionId"] == session_id
+    assert sent_turns(openai.calls[0]) == []
+    assert [turn[0] for turn in sent_turns(openai.calls[-1])] == ["user", "assistant"]
+    assert second.get_json()["sessionId"] == session_id
+
+
+def test_unknown_session_id_with_history_is_seeded_from_it(client, openai):
+    history = [{"role": "user", "content": "Wat is vrijheid?"}, {"role": "assistant", "content": "Kiezen."}]
+
+    client.post("/chat", json={"vraag": FOLLOW_UP, "sessionId": "expired-session-00001", "history": history})
+    client.post("/chat", json={"vraag": "En verder?", "sessionId": "expired-session-00001"})
+
+    assert sent_turns(openai.calls[-1])[:2] == [("user", "Wat is vrijheid?"), ("assistant", "Kiezen.")]
+    assert len(sent_turns(openai.calls[-1])) == 4
+
+
+def test_malformed_session_id_gets_a_fresh_one(client, openai):
+    response = client.post("/chat", json={**FIRST, "sessionId": "../etc"}).get_json()
+
+    assert response["sessionId"] != "../etc"
+    assert clarus.SESSION_ID_PATTERN.match(response["sessionId"])
+
+
+def test_sent_history_wins_over_the_session(client, openai):
+    first = client.post("/chat", json=FIRST).get_json()
+    history = [{"role": "user", "content": "Iets anders"}, {"role": "assistant", "content": "Ja."}]
+
+    client.post("/chat", json={"vraag": FOLLOW_UP, "sessionId": first["sessionId"], "history": history})
+
+    assert sent_turns(openai.calls[-1]) == [("user", "Iets anders"), ("assistant", "Ja.")]
+
+
+def test_sessions_are_off_for_several_workers_without_a_shared_cache(client, openai, monkeypatch):
+    monkeypatch.setattr(clarus, "CLARUS_WORKERS", 2)
+
+    response = client.post("/chat", json=FIRST).get_json()
+
+    assert response["sessionId"] is None
+    assert not clarus.sessions.enabled
+
+
+def test_sessions_work_across_workers_with_the_sqlite_cache(client, openai, monkeypatch, tmp_path):
+    monkeypatch.setattr(clarus, "CLARUS_WORKERS", 2)
+    monkeypatch.setattr(clarus, "cache", clarus.SQLiteCache(tmp_path / "cache.sqlite3"))
+    first = client.post("/chat", json=FIRST).get_json()
+
+    # Another worker has its own connection to the same file.
+    monkeypatch.setattr(clarus, "cache", clarus.SQLiteCache(tmp_path / "cache.sqlite3"))
+    client.post("/chat", json={"vraag": FOLLOW_UP, "sessionId": first["sessionId"]})
+
+    assert sent_turns(openai.calls[-1]) == [("user", FIRST["vraag"]), ("assistant", first["antwoord"])]
+
+
+def test_stream_done_event_carries_the_session_id(client, openai):
+    with client.post("/chat-stream", json=FIRST) as response:
+        events = sse_events(response.get_data(as_text=True))
+
+    done = dict(events)["done"]
+    assert clarus.SESSION_ID_PATTERN.match(done["sessionId"])
+    follow_up = client.post("/chat", json={"vraag": FOLLOW_UP, "sessionId": done["sessionId"]})
+    assert follow_up.status_code == 200
+    assert len(sent_turns(openai.calls[-1])) == 2
@@ -0,0 +1,97 @@
+import time
+
+import pytest
+
+from conftest import clarus, read_log, sse_events
+
+
+@pytest.fixture
+def held(monkeypatch):
+    """Hold tokens until an event or the character limit flushes them."""
+    monkeypatch.setattr(clarus, "CLARUS_SSE_FLUSH_MS", 60_000)
+    monkeypatch.setattr(clarus, "CLARUS_SSE_FLUSH_CHARS", 10)
+
+
+def compact_tokens(body):
+    tokens = []
+    for frame in body.split("\n\n"):
+        lines = frame.split("\n")
+        if lines[0] == "event: t":
+            tokens.append("\n".join(line[len("data: "):] for line in lines[1:]))
+    return tokens
+
+
+def test_first_token_is_sent_at_once_and_later_ones_are_coalesced(held):
+    framer = clarus.SseFramer()
+
+    assert framer.token("Vrijheid") == clarus.sse("token", {"token": "Vrijheid"})
+    assert framer.token(" is") == ""
+    assert framer.token(" ver") == ""
+    assert framer.token("antwoordelijk") == clarus.sse("token", {"token": " is verantwoordelijk"})
+
+
+def test_events_flush_held_tokens_first(held):
+    framer = clarus.SseFramer()
+    framer.token("Ja")
+    framer.token(".")
+
+    frame = framer.event("done", {"logId": "log-1"})
+
+    assert frame == clarus.sse("token", {"token": "."}) + clarus.sse("done", {"logId": "log-1"})
+    assert framer.stats() == {"sseFrames": 3, "sseBytes": len((clarus.sse("token", {"token": "Ja"}) + frame).encode("utf-8"))}
+
+
+def test_flush_window_releases_tokens_over_time(monkeypatch):
+    monkeypatch.setattr(clarus, "CLARUS_SSE_FLUSH_MS", 0)
+    framer = clarus.SseFramer()
+
+    assert [bool(framer.token(token)) for token in ("a", "b", "c")] == [True, True, True]
+
+
+def test_compact_frames_carry_raw_text_lines():
+    framer = clarus.SseFramer(compact=True)
+
+    assert framer.token("Eerste regel\nTweede €") == "event: t\ndata: Eerste regel\ndata: Tweede €\n\n"
+
+
+def test_stream_sends_fewer_frames_than_tokens(client, openai, held):
+    openai.tokens = ["Vrij", "heid", " is", " een", " opdracht", "."]
+
+    with client.post("/chat-stream", json={"vraag": "Waarom is vrijheid leeg?"}) as response:
+        events = sse_events(response.get_data(as_text=True))
+
+    tokens = [data["token"] for event, data in events if event == "token"]
+    entry = read_log()[-1]
+    assert "".join(tokens) == "".join(openai.tokens)
+    assert tokens[0] == "Vrij"
+    assert len(tokens) < len(openai.tokens)
+    assert entry["sseFrames"] == len(events)
+
+
+def test_stream_uses_the_compact_format_on_request(client, openai):
+    openai.tokens = ["Eerste", " regel", "\n", "Tweede"]
+
+    with client.post("/chat-stream", json={"vraag": "Waarom is vrijheid leeg?", "streamFormat": "compact"}) as response:
+        body = response.get_data(as_text=True)
+
+    assert "".join(compact_tokens(body)) == "Eerste regel\nTweede"
+    assert "event: token" not in body
+    assert body.rstrip().split("\n\n")[-1].startswith("event: done")
+
+
+@pytest.mark.parametrize("coalesce", [False, True])
+def test_held_tokens_do_not_wait_for_a_slow_next_token(client, openai, monkeypatch, coalesce):
+    monkeypatch.setattr(clarus, "CLARUS_COALESCE", coalesce)
+    monkeypatch.setattr(clarus, "CLARUS_SSE_FLUSH_MS", 50)
+    monkeypatch.setattr(clarus, "CLARUS_HEARTBEAT_MS", 1000)
+    openai.tokens = ["Vrijheid", " vraagt", " moed."]
+    openai.delay = [0.0, 0.01, 0.6]
+
+    started = time.monotonic()
+    response = client.post("/chat-stream", json={"vraag": "Waarom is vrijheid leeg?"}, buffered=False)
+    arrivals = [(time.monotonic() - started, chunk.decode("utf-8")) for chunk in response.response]
+    response.close()
+
+    held = next(at for at, chunk in arrivals if "vraagt" in chunk)
+    slow = next(at for at, chunk in arrivals if "moed" in chunk)
+    assert held < 0.3 < slow
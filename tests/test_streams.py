@@ -0,0 +1,106 @@
+import os
+import runpy
+import subprocess
+import sys
+import time
+
+import pytest
+
+from conftest import ROOT, clarus, post_in_background, read_log, wait_for
+
+
+def test_streams_over_the_cap_are_refused(client, openai, monkeypatch):
+    monkeypatch.setattr(clarus, "stream_slots", clarus.StreamSlots(1))
+    openai.delay = 0.05
+    results = []
+    first = post_in_background("/chat-stream", {"vraag": "Waarom is vrijheid leeg?"}, results)
+    assert wait_for(lambda: openai.calls)
+
+    second = client.post("/chat-stream", json={"vraag": "Waarom is schuld zwaar?"})
+    first.join()
+
+    assert second.status_code == 503
+    assert second.headers["Retry-After"] == "5"
+    assert results[0][0] == 200
+    assert [entry["status"] for entry in read_log()] == ["busy", "completed"]
+    assert clarus.stream_slots.stats() == {"active": 0, "limit": 1, "rejected": 1, "cancelled": 0}
+
+
+def test_slot_is_released_after_a_failed_stream(client, openai, monkeypatch):
+    monkeypatch.setattr(clarus, "stream_slots", clarus.StreamSlots(1))
+    openai.failing = set(clarus.ROUTES["standard"]["models"])
+
+    with client.post("/chat-stream", json={"vraag": "Waarom is vrijheid leeg?"}) as response:
+        response.get_data()
+
+    assert read_log()[-1]["status"] == "error"
+    assert clarus.stream_slots.stats()["active"] == 0
+
+
+def test_slow_first_token_keeps_the_connection_alive(client, openai, monkeypatch):
+    monkeypatch.setattr(clarus, "CLARUS_HEARTBEAT_MS", 50)
+    openai.tokens = ["Ja."]
+    openai.delays = {model: 0.3 for model in clarus.ROUTES["standard"]["models"]}
+
+    with client.post("/chat-stream", json={"vraag": "Waarom is vrijheid leeg?"}) as response:
+        body = response.get_data(as_text=True)
+
+    assert body.index(": heartbeat") < body.index("event: token")
+
+
+def test_open_streams_do_not_block_other_requests(client, openai):
+    openai.delay = 0.2
+    openai.tokens = ["Vrijheid", " vraagt", " moed."]
+    results = []
+    stream = post_in_background("/chat-stream", {"vraag": "Waarom is vrijheid leeg?"}, results)
+    assert wait_for(lambda: openai.calls)
+
+    started = time.monotonic()
+    health = client.get("/health")
+    elapsed = time.monotonic() - started
+    stream.join()
+
+    assert health.status_code == 200
+    assert elapsed < 0.2
+    assert health.get_json()["streams"]["limit"] == 0
+
+
+def test_gevent_profile_publishes_its_worker_count(monkeypatch):
+    monkeypatch.setenv("WEB_CONCURRENCY", "3")
+
+    profile = runpy.run_path(str(ROOT / "gunicorn_gevent.conf.py"))
+
+    assert profile["worker_class"] == "gevent"
+    assert profile["workers"] == 3
+    assert clarus.os.environ["WEB_CONCURRENCY"] == "3"
+
+
+def test_gevent_profile_shares_the_cache_between_workers(monkeypatch):
+    monkeypatch.setenv("WEB_CONCURRENCY", "3")
+    monkeypatch.delenv("CLARUS_CACHE_BACKEND")
+
+    runpy.run_path(str(ROOT / "gunicorn_gevent.conf.py"))
+
+    assert clarus.os.environ["CLARUS_CACHE_BACKEND"] == "sqlite"
+
+
+@pytest.mark.parametrize("workers, backend, expected", [("1", None, None), ("3", "memory", "memory")])
+def test_gevent_profile_keeps_a_single_worker_or_an_explicit_backend(monkeypatch, workers, backend, expected):
+    monkeypatch.setenv("WEB_CONCURRENCY", workers)
+    if backend:
+        monkeypatch.setenv("CLARUS_CACHE_BACKEND", backend)
+    else:
+        monkeypatch.delenv("CLARUS_CACHE_BACKEND")
+
+    runpy.run_path(str(ROOT / "gunicorn_gevent.conf.py"))
+
+    assert clarus.os.environ.get("CLARUS_CACHE_BACKEND") == expected
+
+
+def test_per_process_uploads_with_several_workers_are_warned_about():
+    env = {**os.environ, "WEB_CONCURRENCY": "2", "CLARUS_CACHE_BACKEND": "memory"}
+
+    started = subprocess.run([sys.executable, "-c", "import app"], cwd=ROOT, env=env, capture_output=True, text=True)
+
+    assert started.returncode == 0
+    assert "get 409 uploadRequired" in started.stderr
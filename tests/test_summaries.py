@@ -0,0 +1,115 @@
+import pytest
+
+from conftest import clarus, read_log, wait_for
+
+HISTORY = [
+    {"role": "user" if turn % 2 == 0 else "assistant", "content": f"Beurt {turn}: " + "een overweging over kiezen en dragen. " * 4}
+    for turn in range(8)
+]
+FIRST = "Wat betekent dat voor schuld?"
+SECOND = "En voor vergeving?"
+
+
+@pytest.fixture
+def low_threshold(monkeypatch):
+    monkeypatch.setattr(clarus, "CLARUS_SUMMARY_THRESHOLD", 100)
+
+
+def summary_calls(openai):
+    return [call for call in openai.calls if call["messages"][0]["content"] == clarus.SUMMARY_PROMPT]
+
+
+def chat_calls(openai):
+    return [call for call in openai.calls if call["messages"][0]["content"] != clarus.SUMMARY_PROMPT]
+
+
+def summarized():
+    return [entry for entry in read_log() if entry.get("status") == "summarized"]
+
+
+def ask(client, question, history, session_id=None):
+    payload = {"vraag": question, "history": history, **({"sessionId": session_id} if session_id else {})}
+    return client.post("/chat", json=payload).get_json()
+
+
+def test_long_history_is_summarized_after_the_answer(client, openai, low_threshold):
+    ask(client, FIRST, HISTORY)
+
+    assert wait_for(lambda: summarized())
+    call = summary_calls(openai)[0]
+    assert call["model"] == clarus.SUMMARY_ROUTE["models"][0]
+    assert call["max_completion_tokens"] == clarus.CLARUS_SUMMARY_MAX_TOKENS
+    assert "Beurt 0:" in call["messages"][1]["content"]
+    assert summarized()[0]["summarizedTurns"] == len(HISTORY) + 2 - clarus.CLARUS_SUMMARY_KEEP_TURNS
+
+
+def test_next_turn_sends_the_summary_and_only_recent_turns(client, openai, low_threshold):
+    first = ask(client, FIRST, HISTORY)
+    assert wait_for(lambda: summarized())
+    history = HISTORY + [{"role": "user", "content": FIRST}, {"role": "assistant", "content": first["antwoord"]}]
+
+    ask(client, SECOND, history, first["sessionId"])
+
+    messages = chat_calls(openai)[-1]["messages"]
+    turns = [message["content"] for message in messages if message["role"] in {"user", "assistant"}][:-1]
+    entry = [entry for entry in read_log() if entry.get("question") == SECOND][0]
+    assert any(message["content"].startswith("Summary of the earlier conversation:") for message in messages)
+    assert turns == [turn["content"] for turn in history[-clarus.CLARUS_SUMMARY_KEEP_TURNS:]]
+    assert entry["historySummary"]["summarizedTurns"] == len(history) - clarus.CLARUS_SUMMARY_KEEP_TURNS
+    assert entry["historySummary"]["savedTokens"] > 0
+    assert wait_for(lambda: len(summarized()) == 2)
+
+
+def test_later_summaries_extend_the_previous_one(client, openai, low_threshold):
+    first = ask(client, FIRST, HISTORY)
+    assert wait_for(lambda: summarized())
+    history = HISTORY + [{"role": "user", "content": FIRST}, {"role": "assistant", "content": first["antwoord"]}]
+
+    ask(client, SECOND, history, first["sessionId"])
+
+    assert wait_for(lambda: len(summarized()) == 2)
+    assert summary_calls(openai)[-1]["messages"][1]["content"].startswith("Summary so far:")
+
+
+def test_short_history_is_not_summarized(client, openai):
+    ask(client, FIRST, HISTORY[:2])
+
+    assert summary_calls(openai) == []
+    assert not clarus.summaries._building
+
+
+def test_summaries_follow_the_session_setting(client, openai, low_threshold, monkeypatch):
+    monkeypatch.setattr(clarus, "CLARUS_WORKERS", 2)
+
+    ask(client, FIRST, HISTORY)
+
+    assert not clarus.summaries.enabled
+    assert summary_calls(openai) == []
+
+
+def test_conversations_with_the_same_recent_turns_do_not_share_a_summary(client, openai, low_threshold):
+    first = ask(client, FIRST, HISTORY)
+    assert wait_for(lambda: summarized())
+    other = [{**turn, "content": turn["content"].replace("kiezen", "twijfelen")} for turn in HISTORY[:2]] + HISTORY[2:]
+    history = other + [{"role": "user", "content": FIRST}, {"role": "assistant", "content": first["antwoord"]}]
+
+    ask(client, SECOND, history, first["sessionId"])
+    ask(client, SECOND, history)
+
+    assert all(
+        not message["content"].startswith("Summary of the earlier conversation:")
+        for call in chat_calls(openai)[1:]
+        for message in call["messages"]
+    )
+
+
+def test_summary_follows_the_session_window(client, openai, low_threshold, monkeypatch):
+    monkeypatch.setattr(clarus, "CLARUS_HISTORY_TURNS", 8)
+    first = ask(client, FIRST, HISTORY)
+    assert wait_for(lambda: summarized())
+    history = (HISTORY + [{"role": "user", "content": FIRST}, {"role": "assistant", "content": first["antwoord"]}])[-8:]
+
+    ask(client, SECOND, history, first["sessionId"])
+
+    entry = [entry for entry in read_log() if entry.get("question") == SECOND][0]
+    assert entry["historySummary"]["summarizedTurns"] == 8 - clarus.CLARUS_SUMMARY_KEEP_TURNS